@@ -8,8 +8,9 @@ CREATE TABLE `articles` (
   `updated_at` datetime DEFAULT CURRENT_TIMESTAMP,
   `updated_by` varchar(45) NOT NULL,
   PRIMARY KEY (`article_id`),
-  KEY `timezone_idx` (`publisher_timezone`),
-  KEY `publish_time_idx` (`published_time`)
+  KEY `timezone_published_time_idx` (`publisher_timezone`,`published_time`),
+  KEY `publish_time_idx` (`published_time`),
+  FULLTEXT KEY `headline_content_ftidx` (`headline`,`article_content`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 CREATE TABLE `entities` (
@@ -38,6 +39,34 @@ CREATE TABLE `tags` (
   CONSTRAINT `article_id_fk_1` FOREIGN KEY (`article_id`) REFERENCES `articles` (`article_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
+CREATE TABLE `search_documents` (
+  `article_id` varchar(90) NOT NULL,
+  `document` mediumtext NOT NULL,
+  `updated_at` datetime DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`article_id`),
+  CONSTRAINT `article_id_fk_3` FOREIGN KEY (`article_id`) REFERENCES `articles` (`article_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE `content_dictionaries` (
+  `dictionary_id` int(11) NOT NULL AUTO_INCREMENT,
+  `codec` varchar(10) NOT NULL,
+  `dictionary` mediumblob NOT NULL,
+  `created_at` datetime DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`dictionary_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE `article_contents` (
+  `article_id` varchar(90) NOT NULL,
+  `codec` varchar(10) NOT NULL,
+  `dictionary_id` int(11) DEFAULT NULL,
+  `content` longblob NOT NULL,
+  `content_length` int(11) NOT NULL,
+  `updated_at` datetime DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`article_id`),
+  KEY `dictionary_id_fk_1` (`dictionary_id`),
+  CONSTRAINT `article_id_fk_4` FOREIGN KEY (`article_id`) REFERENCES `articles` (`article_id`),
+  CONSTRAINT `dictionary_id_fk_1` FOREIGN KEY (`dictionary_id`) REFERENCES `content_dictionaries` (`dictionary_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 /* Populate tables with sample data */
 INSERT INTO `articles`
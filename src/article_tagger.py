@@ -1,12 +1,38 @@
-from flask import Flask, request
+from flask import Flask, Response, json, request
 import logging
 import os
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import traceback
 
-from utils.database_utilities import DatabaseUtilities
+from base_classes.engine_utils import current_client
+from utils.background import run_periodically
+from utils.bulk_tagger import bulk_tag, summarize
+from utils.database_utilities import ARTICLE_LIST_COLUMNS, DatabaseUtilities
+from utils.export import EXPORT_FORMATS, EXPORT_TABLES, Exporter, check_pyarrow
+from utils.facets import FacetEngine, GlobalFacets
+from utils.filter_index import FilterIndex
+from utils.ingest import article_ingestion, entity_ingestion, iter_lines
 from utils.init_logger import init_logger
-from utils.request_parser import parse_tag_article, parse_searched, is_desc
+from utils.instrumentation import Instrumentation
+from utils.multi_search import MultiSearch
+from utils.profiling import Profiler
+from utils.request_parser import (
+    decode_cursor,
+    encode_cursor,
+    parse_bulk_tag_article,
+    parse_fields,
+    parse_response_format,
+    parse_suggest_field,
+    parse_tag_article,
+    parse_time,
+)
+from utils.search_cache import RespClient, SearchCache
+from utils.search_documents import SearchDocumentStore
+from utils.search_engine import SearchEngine
+from utils.suggest_index import SuggestIndex
+from utils.serialization import columnar_articles, columns, dumps, records
+from utils.tag_queue import TagWriteQueue
+from utils.text_index import InvertedIndex, MySQLFullTextIndex
 
 
 app = Flask(__name__)
@@ -14,9 +40,202 @@ db_utils = DatabaseUtilities(
     host=os.getenv("DATABASE_CONTAINER"), database=os.getenv("MYSQL_DATABASE")
 )
 
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+TAG_BATCH_SIZE = int(os.getenv("TAG_BATCH_SIZE", "1000"))
+TAG_WRITE_BEHIND = os.getenv("TAG_WRITE_BEHIND", "false").lower() == "true"
+TAG_QUEUE_PATH = os.getenv("TAG_QUEUE_PATH", "tag_queue.sqlite3")
+TEXT_INDEX = os.getenv("TEXT_INDEX", "mysql")
+TEXT_INDEX_REFRESH_SECONDS = float(os.getenv("TEXT_INDEX_REFRESH_SECONDS", "30"))
+FILTER_INDEX = os.getenv("FILTER_INDEX", "false").lower() == "true"
+FILTER_INDEX_REFRESH_SECONDS = float(os.getenv("FILTER_INDEX_REFRESH_SECONDS", "10"))
+SEARCH_CACHE = os.getenv("SEARCH_CACHE", "false").lower() == "true"
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_MAX_STALENESS = float(os.getenv("SEARCH_CACHE_MAX_STALENESS", "60"))
+SEARCH_CACHE_SHARED_HOST = os.getenv("SEARCH_CACHE_SHARED_HOST")
+SEARCH_CACHE_SHARED_PORT = int(os.getenv("SEARCH_CACHE_SHARED_PORT", "6379"))
+METRICS = os.getenv("METRICS", "true").lower() == "true"
+SLOW_REQUEST_SECONDS = os.getenv("SLOW_REQUEST_SECONDS")
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "5"))
+GLOBAL_FACETS = os.getenv("GLOBAL_FACETS", "false").lower() == "true"
+GLOBAL_FACETS_REFRESH_SECONDS = float(os.getenv("GLOBAL_FACETS_REFRESH_SECONDS", "300"))
+DEFAULT_FACET_LIMIT = int(os.getenv("DEFAULT_FACET_LIMIT", "10"))
+SUGGEST_INDEX = os.getenv("SUGGEST_INDEX", "false").lower() == "true"
+SUGGEST_REFRESH_SECONDS = float(os.getenv("SUGGEST_REFRESH_SECONDS", "300"))
+SUGGEST_MAX_LIMIT = int(os.getenv("SUGGEST_MAX_LIMIT", "50"))
+MAX_MULTI_SEARCHES = int(os.getenv("MAX_MULTI_SEARCHES", "50"))
+# Encodes list and search responses with orjson and ISO 8601 dates instead of the Flask encoder
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+INGEST_MAX_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", str(16 * 1024 * 1024)))
+INGEST_MAX_BATCH_BYTES = int(os.getenv("INGEST_MAX_BATCH_BYTES", str(64 * 1024 * 1024)))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Rows written this recently may belong to uncommitted transactions, left to the next export
+EXPORT_COMMIT_LAG_SECONDS = float(os.getenv("EXPORT_COMMIT_LAG_SECONDS", "60"))
+SEARCH_DOCUMENTS = os.getenv("SEARCH_DOCUMENTS", "false").lower() == "true"
+SEARCH_DOCUMENTS_REFRESH_SECONDS = float(os.getenv("SEARCH_DOCUMENTS_REFRESH_SECONDS", "10"))
+# Requests are profiled when sent with the X-Profile: <PROFILE_TOKEN> header, or at the sample rate
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_DIRECTORY = os.getenv("PROFILE_DIRECTORY", "profiles")
+PROFILE_MAX = int(os.getenv("PROFILE_MAX", "100"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
 init_logger()
 logger = logging.getLogger("ArticleTaggerLogs")
 
+if db_utils.replica_engines:
+    db_utils.check_replicas()
+    run_periodically(db_utils.check_replicas, REPLICA_CHECK_SECONDS, "replica_health_check")
+
+if TEXT_INDEX == "memory":
+    text_index = InvertedIndex(db_utils)
+    text_index.build()
+    run_periodically(text_index.refresh, TEXT_INDEX_REFRESH_SECONDS, "text_index_refresh")
+else:
+    text_index = MySQLFullTextIndex(db_utils)
+
+filter_index = None
+if FILTER_INDEX:
+    filter_index = FilterIndex(db_utils)
+    filter_index.build()
+    run_periodically(filter_index.refresh, FILTER_INDEX_REFRESH_SECONDS, "filter_index_refresh")
+
+search_documents = None
+if SEARCH_DOCUMENTS:
+    search_documents = SearchDocumentStore(db_utils)
+    search_documents.start()
+    run_periodically(
+        search_documents.refresh, SEARCH_DOCUMENTS_REFRESH_SECONDS, "search_documents_refresh"
+    )
+search_engine = SearchEngine(
+    db_utils, text_index=text_index, filter_index=filter_index, documents=search_documents
+)
+
+global_facets = None
+if GLOBAL_FACETS:
+    global_facets = GlobalFacets(db_utils)
+    global_facets.build()
+    run_periodically(global_facets.build, GLOBAL_FACETS_REFRESH_SECONDS, "global_facets_refresh")
+facet_engine = FacetEngine(search_engine, global_facets=global_facets)
+
+suggest_index = None
+if SUGGEST_INDEX:
+    suggest_index = SuggestIndex(db_utils, max_limit=SUGGEST_MAX_LIMIT)
+    suggest_index.build()
+    run_periodically(suggest_index.build, SUGGEST_REFRESH_SECONDS, "suggest_index_refresh")
+multi_search = MultiSearch(search_engine)
+exporter = Exporter(db_utils, commit_lag=EXPORT_COMMIT_LAG_SECONDS)
+
+search_cache = None
+if SEARCH_CACHE:
+    shared_client = None
+    if SEARCH_CACHE_SHARED_HOST:
+        shared_client = RespClient(SEARCH_CACHE_SHARED_HOST, SEARCH_CACHE_SHARED_PORT)
+    search_cache = SearchCache(
+        SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_STALENESS, shared_client=shared_client
+    )
+
+instrumentation = None
+if METRICS:
+    instrumentation = Instrumentation(
+        slow_request_seconds=float(SLOW_REQUEST_SECONDS) if SLOW_REQUEST_SECONDS else None
+    )
+    instrumentation.instrument_engine(db_utils.engine)
+    for index, replica_engine in enumerate(db_utils.replica_engines):
+        instrumentation.instrument_engine(replica_engine, f"replica_{index}")
+    instrumentation.init_app(app)
+    if search_cache is not None:
+        instrumentation.add_collector(search_cache.metrics)
+
+profiler = None
+if PROFILE_TOKEN or PROFILE_SAMPLE_RATE > 0:
+    profiler = Profiler(
+        PROFILE_DIRECTORY,
+        token=PROFILE_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        mode=PROFILE_MODE,
+        interval=PROFILE_SAMPLE_INTERVAL,
+        max_profiles=PROFILE_MAX,
+    )
+    profiler.init_app(app)
+
+
+def on_tags_written(
+    tags: List[Dict[str, str]], inserted: Optional[List[Dict[str, str]]] = None
+) -> None:
+    """Brings in-memory indexes and caches up to date with newly committed tags. inserted lists
+    the tags which did not exist before, all of them by default."""
+    if search_documents is not None:
+        # Refreshed first, so invalidated searches are not cached again from stale documents
+        search_documents.refresh_articles({tag["article_id"] for tag in tags})
+    if filter_index is not None:
+        filter_index.add_tags(tags)
+    if search_cache is not None:
+        search_cache.invalidate_tags(tags)
+    if global_facets is not None:
+        global_facets.add_tags(tags if inserted is None else inserted)
+    if suggest_index is not None:
+        suggest_index.add_tags(tags if inserted is None else inserted)
+    return
+
+
+def on_articles_written(articles: List[Dict[str, Any]], outcomes: Dict[str, List[str]]) -> None:
+    """Brings in-memory indexes and caches up to date with newly committed articles, outcomes
+    listing the "inserted" and "updated" article ids. Cached searches do not pick up new articles
+    until they expire."""
+    if isinstance(text_index, InvertedIndex):
+        for article in articles:
+            text_index.add_article(
+                article["article_id"], article["headline"], article["article_content"]
+            )
+    if search_documents is not None:
+        search_documents.refresh_articles(article["article_id"] for article in articles)
+    if search_cache is not None:
+        search_cache.invalidate(outcomes["updated"], [])
+    if global_facets is not None:
+        global_facets.add_articles(len(outcomes["inserted"]))
+    return
+
+
+def on_entities_written(entities: List[Dict[str, str]], outcomes: Dict[str, List[Any]]) -> None:
+    """Brings in-memory indexes and caches up to date with newly committed entities, outcomes
+    listing the "inserted" entities."""
+    inserted = outcomes["inserted"]
+    if filter_index is not None:
+        filter_index.add_entities(inserted)
+    if search_documents is not None:
+        search_documents.refresh_articles({entity["article_id"] for entity in inserted})
+    if search_cache is not None:
+        search_cache.invalidate([entity["article_id"] for entity in inserted], [])
+    if global_facets is not None:
+        global_facets.add_entities(inserted)
+    if suggest_index is not None:
+        suggest_index.add_entities(inserted)
+    return
+
+
+tag_queue = None
+if TAG_WRITE_BEHIND:
+    tag_queue = TagWriteQueue(
+        db_utils, TAG_QUEUE_PATH, batch_size=TAG_BATCH_SIZE, on_commit=on_tags_written
+    )
+    tag_queue.start()
+
+
+def json_response(response: Dict[str, Any], status: int) -> Response:
+    """Encodes a response with the fast serialization path, dates as ISO 8601 strings."""
+    return Response(dumps(response), status=status, mimetype="application/json")
+
+
+@app.before_request
+def identify_client() -> None:
+    """Identifies the client by its X-Client-Id header, or its address, so that it reads its own
+    writes from the primary (see DATABASE_READ_YOUR_WRITES_SECONDS)."""
+    current_client.set(request.headers.get("X-Client-Id") or request.remote_addr)
+    return
+
 
 @app.route("/", methods=["GET"])
 def home():
@@ -24,27 +243,85 @@ def home():
 
 
 @app.route("/api/get_all_articles", methods=["GET"])
-def get_all_articles() -> Tuple[Dict[str, Any], int]:
-    """Returns all articles, headlines and publishing time ordered by latest publishing time."""
+def get_all_articles() -> Union[Response, Tuple[Dict[str, Any], int]]:
+    """Returns all articles, headlines and publishing time ordered by latest publishing time.
+
+    Optional query parameters:
+    "limit" - Returns a single page of at most limit articles (capped at MAX_PAGE_SIZE). The
+    response contains a "next_cursor" key, null once the last page has been reached.
+    "cursor" - Returns the page following the one the cursor was given with.
+    "stream" - Set to "ndjson" to stream every article as one JSON object per line.
+    "format" - Set to "columnar" to return the articles as one list per attribute under
+    "content" instead of one object per article, with ISO 8601 dates.
+    """
+    if request.args.get("stream") == "ndjson":
+        return Response(stream_all_articles(), mimetype="application/x-ndjson")
+
     response = {}
     try:
-        articles = db_utils.query_all_articles()
-        # List of row objects to list of dicts
-        response["content"] = [article._asdict() for article in articles]
+        response_format = parse_response_format(request.args.get("format"))
+    except ValueError as error:
+        response["message"] = f"Invalid format! {error}"
+        return (response, 400)
+    paginated = "limit" in request.args or "cursor" in request.args
+    if paginated:
+        try:
+            limit = min(int(request.args.get("limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError(f"Invalid limit: {limit}")
+            cursor = request.args.get("cursor")
+            cursor = decode_cursor(cursor) if cursor else None
+        except ValueError as error:
+            response["message"] = f"Invalid pagination parameters! {error}"
+            return (response, 400)
+
+    try:
+        if paginated:
+            articles = db_utils.query_articles_page(limit, cursor)
+            response["next_cursor"] = None
+            if len(articles) == limit:
+                last = articles[-1]
+                response["next_cursor"] = encode_cursor(last.published_time, last.article_id)
+        else:
+            articles = db_utils.query_all_articles()
+        if response_format == "columnar":
+            response["content"] = columns(ARTICLE_LIST_COLUMNS, articles)
+        elif FAST_JSON:
+            response["content"] = records(ARTICLE_LIST_COLUMNS, articles)
+        else:
+            # List of row objects to list of dicts
+            response["content"] = [article._asdict() for article in articles]
         msg = "All articles returned"
         status = 200
     except:
         msg = "Unable to fetch articles! Here is the traceback:\n" + traceback.format_exc()
         status = 500
     response["message"] = msg
-    logger.debug("Get all articles msg:", msg)
+    logger.debug("Get all articles msg: %s", msg)
+    if FAST_JSON or response_format == "columnar":
+        return json_response(response, status)
     return (response, status)
 
 
+def stream_all_articles() -> Iterator[Union[str, bytes]]:
+    """Yields every article as a line of JSON, reading rows from a server-side cursor so memory
+    use does not grow with the size of the articles table."""
+    try:
+        for article in db_utils.stream_all_articles(STREAM_BATCH_SIZE):
+            if FAST_JSON:
+                yield dumps(dict(zip(ARTICLE_LIST_COLUMNS, article))) + b"\n"
+            else:
+                yield json.dumps(article._asdict()) + "\n"
+    except:
+        logger.error("Streaming all articles failed!", exc_info=True)
+        raise
+
+
 @app.route("/api/search_articles", methods=["GET"])
-def search_articles() -> Tuple[Dict[str, Any], int]:
-    """Returns articles by search criteria in GET request. Currently only supports
-    exact string matching.
+def search_articles() -> Union[Response, Tuple[Dict[str, Any], int]]:
+    """Returns articles by search criteria in GET request. Supports exact string matching on
+    article attributes, tags and entities, and free text search on headline and article content
+    with the "text" key.
 
     Body format for GET request should be a JSON object (dictionary) where keys represent
     article attributes.
@@ -59,37 +336,338 @@ def search_articles() -> Tuple[Dict[str, Any], int]:
             "city": ["toronto"],
             "topic": ["covid-19"]
         },
+        "text": "vaccine rollout",
+        "fields": ["headline", "published_time", "entity", "tags"],
         "order_by_time": "desc"
     }
+
+    "fields" lists the article attributes to return, out of "headline", "published_time",
+    "publisher_timezone", "article_content", "entity" and "tags". Defaults to all of them except
+    "article_content", which can be fetched on demand from /api/articles/<article_id>/content.
+
+    Passing "explain=true" as a query parameter adds the generated SQL and timings to the
+    response under "explain". Passing "format=columnar" returns the content as one list per
+    attribute, i.e. {"article_id": [...], "headline": [...]}, with ISO 8601 dates.
     """
     response = {}
     searched = request.json
-    article_ids = parse_searched(db_utils, searched)
-    try:
-        articles_dict = db_utils.query_article_by_article_id(article_ids, desc=is_desc(searched))
-        entities_dict = db_utils.query_entities_by_article_id(article_ids)
-        tags_dict = db_utils.query_tag_by_article_id(article_ids)
-        if entities_dict:
-            # Attach entities to its article in articles_dict
-            for article_id, entity_dict in entities_dict.items():
-                articles_dict[article_id].update({"entity": {}})
-                articles_dict[article_id]["entity"].update(entity_dict)
-        if tags_dict:
-            # Attach tags to its article in articles_dict
-            for article_id, tag_dict in tags_dict.items():
-                articles_dict[article_id].update({"tags": tag_dict})
-
-        response["content"] = articles_dict
+    explain = request.args.get("explain", "false").lower() == "true"
+    try:
+        response_format = parse_response_format(request.args.get("format"))
+    except ValueError as error:
+        response["message"] = f"Invalid format! {error}"
+        return (response, 400)
+
+    try:
+        articles_dict = None
+        if search_cache is not None and not explain:
+            articles_dict = search_cache.get(searched)
+        if articles_dict is None:
+            articles_dict, explained = search_engine.search(searched, explain=explain)
+            if search_cache is not None:
+                search_cache.set(searched, articles_dict)
+            if explained:
+                response["explain"] = explained
+        if response_format == "columnar":
+            response["content"] = columnar_articles(articles_dict, parse_fields(searched))
+        else:
+            response["content"] = articles_dict
         msg = "Search results returned"
         status = 200
+    except ValueError as error:
+        msg = f"Invalid search! {error}"
+        status = 400
     except:
         msg = "Unable to perform search! Here is the traceback:\n" + traceback.format_exc()
         status = 500
     response["message"] = msg
-    logger.debug("Search articles msg:", msg)
+    logger.debug("Search articles msg: %s", msg)
+    if FAST_JSON or response_format == "columnar":
+        return json_response(response, status)
     return (response, status)
 
 
+@app.route("/api/multi_search", methods=["GET"])
+def multi_search_articles() -> Union[Response, Tuple[Dict[str, Any], int]]:
+    """Runs a batch of searches given as a list of search_articles bodies in GET request (at most
+    MAX_MULTI_SEARCHES of them). Criteria shared between searches, i.e. the same entity values,
+    are only evaluated once and the matching articles of all searches are fetched together.
+
+    Response contains one result per search under "results", in order. A result holds the
+    "content" search_articles would have returned, or an error "message" and "status" if the
+    search is invalid.
+    """
+    response = {}
+    searches = request.json
+    if not isinstance(searches, list) or len(searches) > MAX_MULTI_SEARCHES:
+        response["message"] = (
+            f"Invalid multi search! Body must be a list of at most {MAX_MULTI_SEARCHES} searches"
+        )
+        return (response, 400)
+
+    try:
+        results = [None] * len(searches)
+        if search_cache is not None:
+            for position, searched in enumerate(searches):
+                if isinstance(searched, dict):
+                    articles_dict = search_cache.get(searched)
+                    if articles_dict is not None:
+                        results[position] = {"content": articles_dict}
+        missed = [position for position, result in enumerate(results) if result is None]
+        searched_results = multi_search.search([searches[position] for position in missed])
+        for position, result in zip(missed, searched_results):
+            results[position] = result
+            if search_cache is not None and "content" in result:
+                search_cache.set(searches[position], result["content"])
+        response["results"] = results
+        msg = "Search results returned"
+        status = 200
+    except:
+        msg = "Unable to perform searches! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Multi search msg: %s", msg)
+    if FAST_JSON:
+        return json_response(response, status)
+    return (response, status)
+
+
+@app.route("/api/search_facets", methods=["GET"])
+def search_facets() -> Tuple[Dict[str, Any], int]:
+    """Returns tag and entity value counts over the articles matching the search criteria in GET
+    request, without returning the articles. Takes the same body as search_articles, an empty
+    body counting over all articles.
+
+    Optional query parameters:
+    "facet_limit" - Number of top tags and top values per entity to return (default
+    DEFAULT_FACET_LIMIT).
+
+    Response content contains the number of matching articles under "total", the top tags under
+    "tags" and the top values of every entity under "entity", as lists of {"value", "count"}
+    objects by descending count.
+    """
+    response = {}
+    try:
+        facet_limit = int(request.args.get("facet_limit", DEFAULT_FACET_LIMIT))
+        if facet_limit < 1:
+            raise ValueError(f"Invalid facet_limit: {facet_limit}")
+    except ValueError as error:
+        response["message"] = f"Invalid facet parameters! {error}"
+        return (response, 400)
+
+    try:
+        response["content"] = facet_engine.facets(request.get_json(silent=True) or {}, facet_limit)
+        msg = "Search facets returned"
+        status = 200
+    except ValueError as error:
+        msg = f"Invalid search! {error}"
+        status = 400
+    except:
+        msg = "Unable to compute facets! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Search facets msg: %s", msg)
+    return (response, status)
+
+
+@app.route("/api/suggest", methods=["GET"])
+def suggest() -> Tuple[Dict[str, Any], int]:
+    """Returns the tag names or entity values starting with a prefix, for autocompletion.
+    Answered from the in-memory suggest index, without querying the database.
+
+    Query parameters:
+    "field" - "tag" or "entity:<entity>" (i.e. "entity:city").
+    "prefix" - Start of the values, ignoring case (default "", the most frequent values).
+    "limit" - Number of values to return (default 10, at most SUGGEST_MAX_LIMIT).
+
+    Response content is a list of {"value", "count"} objects by descending number of articles.
+    """
+    response = {}
+    if suggest_index is None:
+        response["message"] = "Suggestions are disabled! Set SUGGEST_INDEX to true."
+        return (response, 503)
+    try:
+        field, entity = parse_suggest_field(request.args.get("field"))
+        limit = int(request.args.get("limit", "10"))
+        if limit < 1:
+            raise ValueError(f"Invalid limit: {limit}")
+        response["content"] = suggest_index.suggest(
+            field, entity, request.args.get("prefix", ""), limit
+        )
+        msg = "Suggestions returned"
+        status = 200
+    except ValueError as error:
+        msg = f"Invalid suggest parameters! {error}"
+        status = 400
+    except:
+        msg = "Unable to suggest values! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Suggest msg: %s", msg)
+    return (response, status)
+
+
+@app.route("/api/articles/<article_id>/content", methods=["GET"])
+def get_article_content(article_id: str) -> Tuple[Dict[str, Any], int]:
+    """Returns the content of an article.
+
+    Optional query parameters:
+    "offset" - Number of characters to skip from the start of the content (default 0).
+    "length" - Maximum number of characters to return, the whole remaining content by default.
+    The response contains the "total_length" of the content in characters, so large contents can
+    be fetched in ranges.
+    """
+    response = {}
+    try:
+        offset = int(request.args.get("offset", 0))
+        length = request.args.get("length")
+        length = int(length) if length is not None else None
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError("offset and length must be positive")
+    except ValueError as error:
+        response["message"] = f"Invalid content range! {error}"
+        return (response, 400)
+
+    try:
+        content = db_utils.query_article_content(article_id, offset, length)
+        if content is None:
+            response["message"] = f"Article {article_id} not found!"
+            return (response, 404)
+        response["article_id"] = article_id
+        response["content"] = content.content
+        response["offset"] = offset
+        response["total_length"] = content.total_length
+        msg = "Article content returned"
+        status = 200
+    except:
+        msg = "Unable to fetch article content! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Get article content msg: %s", msg)
+    return (response, status)
+
+
+@app.route("/api/articles/bulk", methods=["POST"])
+def ingest_articles() -> Tuple[Dict[str, Any], int]:
+    """Inserts or replaces articles from an NDJSON body (one JSON object per line), read as a
+    stream. Every line must hold "article_id", "headline", "published_time" (ISO 8601) and
+    "publisher_timezone", and may hold "article_content".
+    Ex (on a single line):
+    {"article_id": "abc789", "headline": "wire headline", "published_time": "2022-01-03T08:00:00Z",
+    "publisher_timezone": "UTC"}
+
+    Optional query parameters:
+    "batch_size" - Number of articles per upsert statement and transaction (default
+    INGEST_BATCH_SIZE). A batch is written early once its lines add up to
+    INGEST_MAX_BATCH_BYTES.
+
+    Response contains a "summary" with the number of "received", "inserted", "updated" and
+    "rejected" lines, and the "rejected" lines with their line number and reason.
+    """
+    return ingest(article_ingestion, on_articles_written, "articles")
+
+
+@app.route("/api/entities/bulk", methods=["POST"])
+def ingest_entities() -> Tuple[Dict[str, Any], int]:
+    """Inserts entities from an NDJSON body (one JSON object per line), read as a stream. Every
+    line must hold "article_id", "entity" and "entity_value", the article must already exist.
+    Ex:
+    {"article_id": "abc789", "entity": "city", "entity_value": "toronto"}
+
+    Optional query parameters:
+    "batch_size" - Number of entities per insert statement and transaction (default
+    INGEST_BATCH_SIZE). A batch is written early once its lines add up to
+    INGEST_MAX_BATCH_BYTES.
+
+    Response contains a "summary" with the number of "received", "inserted", "skipped" (already
+    existing) and "rejected" lines, and the "rejected" lines with their line number and reason.
+    """
+    return ingest(entity_ingestion, on_entities_written, "entities")
+
+
+def ingest(
+    ingestion_factory: Callable[..., Any], on_written: Callable[..., None], rows: str
+) -> Tuple[Dict[str, Any], int]:
+    """Runs an ingestion on the request body stream."""
+    response = {}
+    try:
+        batch_size = int(request.args.get("batch_size", INGEST_BATCH_SIZE))
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch_size: {batch_size}")
+    except ValueError as error:
+        response["message"] = f"Invalid ingestion parameters! {error}"
+        return (response, 400)
+
+    try:
+        ingestion = ingestion_factory(
+            db_utils,
+            batch_size=batch_size,
+            max_batch_bytes=INGEST_MAX_BATCH_BYTES,
+            on_written=on_written,
+        )
+        response.update(ingestion.run(iter_lines(request.stream, INGEST_MAX_LINE_BYTES)))
+        msg = f"Ingestion of {rows} done!"
+        status = 200
+    except:
+        msg = f"Ingestion of {rows} unsuccessful! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Ingest %s msg: %s", rows, msg)
+    return (response, status)
+
+
+@app.route("/api/export/<table>", methods=["GET"])
+def export_table(table: str) -> Union[Response, Tuple[Dict[str, Any], int]]:
+    """Streams a snapshot of the articles, entities or tags table as a columnar file, read
+    EXPORT_BATCH_SIZE rows at a time from a read replica when one is configured. Tag, entity,
+    timezone and audit columns are dictionary-encoded.
+
+    Optional query parameters:
+    "format" - "arrow" (default) for an Arrow IPC file, or "parquet".
+    "since" - ISO 8601 time, only exports the rows written (updated_at/tagged_at) since then.
+
+    The X-Export-Until response header holds the exclusive upper bound of the exported rows, to
+    pass as "since" to the next incremental export.
+    """
+    response = {}
+    if table not in EXPORT_TABLES:
+        response["message"] = f"Unknown table {table}!"
+        return (response, 404)
+    try:
+        check_pyarrow()
+    except RuntimeError as error:
+        response["message"] = f"Exports are unavailable! {error}"
+        return (response, 503)
+    try:
+        file_format = request.args.get("format", "arrow")
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format: {file_format}")
+        since = request.args.get("since")
+        since = parse_time(since) if since else None
+    except ValueError as error:
+        response["message"] = f"Invalid export parameters! {error}"
+        return (response, 400)
+
+    try:
+        until = exporter.watermark()
+    except:
+        response["message"] = "Unable to export! Here is the traceback:\n" + traceback.format_exc()
+        logger.debug("Export table msg: %s", response["message"])
+        return (response, 500)
+    name = f"{table}-{until:%Y%m%dT%H%M%S}.{file_format}"
+    mimetype = "application/vnd.apache.arrow.file"
+    if file_format == "parquet":
+        mimetype = "application/vnd.apache.parquet"
+    return Response(
+        exporter.stream(table, file_format, since, until, EXPORT_BATCH_SIZE),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={name}",
+            "X-Export-Until": until.isoformat(),
+        },
+    )
+
+
 @app.route("/api/tag_article", methods=["POST"])
 def tag_article() -> Tuple[Dict[str, Any], int]:
     """Adds tags to an article given the article id. List of tag values should be mapped
@@ -104,12 +682,19 @@ def tag_article() -> Tuple[Dict[str, Any], int]:
         {"article_id": "abc123", "tags": ["news", "global"]},
         {"article_id": "abc456", "tags": ["travel"]}
     ]
+
+    When the write-behind mode is enabled (TAG_WRITE_BEHIND environment variable), tags are
+    validated and queued instead, and the response contains a "job_id" to poll on
+    /api/tag_jobs/<job_id>.
     """
     response = {}
     tagged_articles = request.json
+    if tag_queue is not None:
+        return queue_tags(tagged_articles)
     tags_to_insert = parse_tag_article(tagged_articles, db_utils.username)
     try:
         db_utils.insert_tags(tags_to_insert)
+        on_tags_written(tags_to_insert)
         status = 200
         msg = "Tagging successful!"
         response["inserted_tags"] = tags_to_insert
@@ -117,5 +702,77 @@ def tag_article() -> Tuple[Dict[str, Any], int]:
         status = 500
         msg = "Tagging unsuccessful! Here is the traceback:\n" + traceback.format_exc()
     response["message"] = msg
-    logger.debug("Tag articles msg:", msg)
+    logger.debug("Tag articles msg: %s", msg)
+    return (response, status)
+
+
+def queue_tags(tagged_articles: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+    """Validates tagging request and appends it to the write-behind queue."""
+    response = {}
+    try:
+        tags_to_queue, results = parse_bulk_tag_article(tagged_articles, db_utils.username)
+        response["job_id"] = tag_queue.enqueue(tags_to_queue, results)
+        response["queued_tags"] = len(tags_to_queue)
+        response["rejected"] = results
+        status = 202
+        msg = "Tagging queued!"
+    except:
+        status = 500
+        msg = "Tagging could not be queued! Here is the traceback:\n" + traceback.format_exc()
+    response["message"] = msg
+    logger.debug("Queue tags msg: %s", msg)
+    return (response, status)
+
+
+@app.route("/api/tag_jobs/<job_id>", methods=["GET"])
+def tag_job_status(job_id: str) -> Tuple[Dict[str, Any], int]:
+    """Returns the status of a queued tagging job. Once the job is "done", the response also
+    contains the summary and per tag results as returned by /api/tag_article/bulk."""
+    if tag_queue is None:
+        return ({"message": "Write-behind tagging is not enabled!"}, 404)
+    job = tag_queue.status(job_id)
+    if job is None:
+        return ({"message": f"Tagging job {job_id} not found!"}, 404)
+    job["message"] = f"Tagging job {job['status']}"
+    return (job, 200)
+
+
+@app.route("/api/tag_article/bulk", methods=["POST"])
+def bulk_tag_articles() -> Tuple[Dict[str, Any], int]:
+    """Adds tags to articles in bulk. Takes the same body as tag_article, but is meant for large
+    tagging jobs: tags are deduplicated, checked against existing articles in batched lookups and
+    inserted in chunks with INSERT IGNORE (or INSERT ... ON DUPLICATE KEY UPDATE).
+
+    Optional query parameters:
+    "batch_size" - Number of tags per insert statement and transaction (default TAG_BATCH_SIZE).
+    "on_duplicate" - "ignore" (default) skips tags an article already has, "update" refreshes
+    their tagged_by and tagged_at.
+
+    Response contains a "summary" of counts by status and per tag "results" with a status of
+    "inserted", "updated", "skipped" or "failed".
+    """
+    response = {}
+    try:
+        batch_size = int(request.args.get("batch_size", TAG_BATCH_SIZE))
+        on_duplicate = request.args.get("on_duplicate", "ignore")
+        if batch_size < 1 or on_duplicate not in ("ignore", "update"):
+            raise ValueError(f"Invalid batch_size {batch_size} or on_duplicate {on_duplicate}")
+    except ValueError as error:
+        response["message"] = f"Invalid bulk tagging parameters! {error}"
+        return (response, 400)
+
+    try:
+        tags_to_insert, results = parse_bulk_tag_article(request.json, db_utils.username)
+        tagged = bulk_tag(db_utils, tags_to_insert, batch_size, on_duplicate)
+        on_tags_written(tagged["written"], tagged["inserted"])
+        results.extend(tagged["results"])
+        response["summary"] = summarize(results)
+        response["results"] = results
+        status = 200
+        msg = "Bulk tagging done!"
+    except:
+        status = 500
+        msg = "Bulk tagging unsuccessful! Here is the traceback:\n" + traceback.format_exc()
+    response["message"] = msg
+    logger.debug("Bulk tag articles msg: %s", msg)
     return (response, status)
@@ -0,0 +1,156 @@
+from quart import Quart, Response, json, request
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Tuple
+import traceback
+
+from utils.async_database_utilities import AsyncDatabaseUtilities
+from utils.async_search_engine import AsyncSearchEngine
+from utils.init_logger import init_logger
+from utils.request_parser import decode_cursor, encode_cursor, parse_tag_article
+from utils.search_cache import RespClient, SearchCache
+
+
+app = Quart(__name__)
+db_utils = AsyncDatabaseUtilities(
+    host=os.getenv("DATABASE_CONTAINER"),
+    database=os.getenv("MYSQL_DATABASE"),
+    pool_size=int(os.getenv("ASYNC_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("ASYNC_MAX_OVERFLOW", "10")),
+)
+search_engine = AsyncSearchEngine(db_utils)
+
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+SEARCH_CACHE = os.getenv("SEARCH_CACHE", "false").lower() == "true"
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_MAX_STALENESS = float(os.getenv("SEARCH_CACHE_MAX_STALENESS", "60"))
+SEARCH_CACHE_SHARED_HOST = os.getenv("SEARCH_CACHE_SHARED_HOST")
+SEARCH_CACHE_SHARED_PORT = int(os.getenv("SEARCH_CACHE_SHARED_PORT", "6379"))
+
+init_logger()
+logger = logging.getLogger("ArticleTaggerAsyncLogs")
+
+search_cache = None
+if SEARCH_CACHE:
+    shared_client = None
+    if SEARCH_CACHE_SHARED_HOST:
+        shared_client = RespClient(SEARCH_CACHE_SHARED_HOST, SEARCH_CACHE_SHARED_PORT)
+    search_cache = SearchCache(
+        SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_STALENESS, shared_client=shared_client
+    )
+
+
+async def run_blocking(function, *args) -> Any:
+    """Runs a blocking call (i.e. the shared search cache tier) off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+@app.route("/", methods=["GET"])
+async def home():
+    return "Article tagger API home"
+
+
+@app.route("/api/get_all_articles", methods=["GET"])
+async def get_all_articles() -> Tuple[Dict[str, Any], int]:
+    """Returns all articles, headlines and publishing time ordered by latest publishing time.
+    Accepts the same "limit", "cursor" and "stream" query parameters as the Flask application."""
+    if request.args.get("stream") == "ndjson":
+        return Response(stream_all_articles(), mimetype="application/x-ndjson")
+
+    response = {}
+    paginated = "limit" in request.args or "cursor" in request.args
+    if paginated:
+        try:
+            limit = min(int(request.args.get("limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError(f"Invalid limit: {limit}")
+            cursor = request.args.get("cursor")
+            cursor = decode_cursor(cursor) if cursor else None
+        except ValueError as error:
+            response["message"] = f"Invalid pagination parameters! {error}"
+            return (response, 400)
+
+    try:
+        if paginated:
+            articles = await db_utils.query_articles_page(limit, cursor)
+            response["next_cursor"] = None
+            if len(articles) == limit:
+                last = articles[-1]
+                response["next_cursor"] = encode_cursor(last.published_time, last.article_id)
+        else:
+            articles = await db_utils.query_all_articles()
+        # List of row objects to list of dicts
+        response["content"] = [article._asdict() for article in articles]
+        msg = "All articles returned"
+        status = 200
+    except:
+        msg = "Unable to fetch articles! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Get all articles msg: %s", msg)
+    return (response, status)
+
+
+async def stream_all_articles() -> AsyncIterator[str]:
+    """Yields every article as a line of JSON, reading rows from a server-side cursor."""
+    try:
+        async for article in db_utils.stream_all_articles(STREAM_BATCH_SIZE):
+            yield json.dumps(article._asdict()) + "\n"
+    except:
+        logger.error("Streaming all articles failed!", exc_info=True)
+        raise
+
+
+@app.route("/api/search_articles", methods=["GET"])
+async def search_articles() -> Tuple[Dict[str, Any], int]:
+    """Returns articles by search criteria in GET request. Takes the same body as the Flask
+    application, the article, entity and tag queries of a search run concurrently."""
+    response = {}
+    searched = await request.get_json()
+    explain = request.args.get("explain", "false").lower() == "true"
+    try:
+        articles_dict = None
+        if search_cache is not None and not explain:
+            articles_dict = await run_blocking(search_cache.get, searched)
+        if articles_dict is None:
+            articles_dict, explained = await search_engine.search(searched, explain=explain)
+            if search_cache is not None:
+                await run_blocking(search_cache.set, searched, articles_dict)
+            if explained:
+                response["explain"] = explained
+        response["content"] = articles_dict
+        msg = "Search results returned"
+        status = 200
+    except ValueError as error:
+        msg = f"Invalid search! {error}"
+        status = 400
+    except:
+        msg = "Unable to perform search! Here is the traceback:\n" + traceback.format_exc()
+        status = 500
+    response["message"] = msg
+    logger.debug("Search articles msg: %s", msg)
+    return (response, status)
+
+
+@app.route("/api/tag_article", methods=["POST"])
+async def tag_article() -> Tuple[Dict[str, Any], int]:
+    """Adds tags to an article given the article id. Takes the same body as the Flask
+    application."""
+    response = {}
+    tagged_articles = await request.get_json()
+    tags_to_insert = parse_tag_article(tagged_articles, db_utils.username)
+    try:
+        await db_utils.insert_tags(tags_to_insert)
+        if search_cache is not None:
+            await run_blocking(search_cache.invalidate_tags, tags_to_insert)
+        status = 200
+        msg = "Tagging successful!"
+        response["inserted_tags"] = tags_to_insert
+    except:
+        status = 500
+        msg = "Tagging unsuccessful! Here is the traceback:\n" + traceback.format_exc()
+    response["message"] = msg
+    logger.debug("Tag articles msg: %s", msg)
+    return (response, status)
@@ -0,0 +1,76 @@
+#!/usr/local/bin/python3 -u
+
+import logging
+import ssl
+
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from base_classes.engine_utils import quoted_env
+
+
+class AsyncEngineUtilities:
+    """Base class using SQLAlchemy async engines to initialize a database connection. Mirrors
+    EngineUtilities for applications running on an event loop."""
+
+    def __init__(
+        self,
+        host: str,
+        database: str,
+        port: int,
+        dialect: str,
+        recyle_timer: int,
+        pool_size: int,
+        max_overflow: int,
+    ) -> None:
+        self.logger = logging.getLogger("AsyncEngineUtilitiesLogs")
+        self.host = host
+        self.database = database
+        self.port = port
+        self.dialect = dialect
+
+        self.username = quoted_env("MYSQL_USER")
+        password = quoted_env("MYSQL_PASSWORD")
+        if self.username is None or password is None:
+            self.logger.error("Credentials not found.")
+        try:
+            # Encrypted but unverified connection, same as ssl-mode required
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+            self.engine = create_async_engine(
+                f"{dialect}://{self.username}:{password}@"
+                f"{self.host}:{self.port}/{self.database}",
+                connect_args={"ssl": ssl_context},
+                pool_recycle=recyle_timer,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+            )
+            self.init_session = sessionmaker(
+                bind=self.engine, class_=AsyncSession, expire_on_commit=False
+            )
+            self.logger.info(
+                f"Async engine and sessionmaker configured for {self.database} on {self.host}!"
+            )
+        except:
+            self.logger.error(
+                f"Could not configure async engine and sessionmaker for {self.database} "
+                f"on {self.host}!"
+            )
+            raise
+
+    @asynccontextmanager
+    async def session_manager(self) -> None:
+        """Creates a session from session factory and wraps query in session in database transaction."""
+        session = self.init_session()
+        try:
+            yield session
+            await session.commit()
+        except:
+            self.logger.warning("Session failed!", exc_info=True)
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+        return
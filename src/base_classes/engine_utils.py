@@ -1,17 +1,66 @@
 #!/usr/local/bin/python3 -u
 
+from contextvars import ContextVar
+import itertools
 import logging
 import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
 import urllib.parse
 
 from contextlib import contextmanager
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+
+# Identifies the client on whose behalf queries run, for read-your-writes stickiness
+current_client: ContextVar[Optional[str]] = ContextVar("current_client", default=None)
+
+
+def quoted_env(name: str) -> Optional[str]:
+    """Returns an environment variable quoted for a database url, or None if it is not set."""
+    value = os.getenv(name)
+    return urllib.parse.quote_plus(value) if value is not None else None
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection, and how many of them found
+    the pool exhausted. Every wait is also passed to the functions of wait_listeners, shared by
+    all pools so they survive pool re-creation."""
+
+    wait_listeners: List[Callable[[float], None]] = []
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _do_get(self) -> Any:
+        exhausted = self.checkedin() == 0 and self.overflow() >= self._max_overflow
+        start = time.perf_counter()
+        connection = super()._do_get()
+        waited = time.perf_counter() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.waits += exhausted
+            self.wait_time += waited
+        for listener in self.wait_listeners:
+            listener(waited)
+        return connection
 
 
 class EngineUtilities:
     """Base class using SQLAlchemy engines to initialize a database connection. Contains useful
-    functions to transact with the database."""
+    functions to transact with the database.
+
+    Besides the primary, read replicas can be listed in the DATABASE_REPLICAS environment variable
+    as comma separated host:port pairs or SQLAlchemy urls. Reads through read_session_manager are
+    spread over the healthy replicas, writes always go to the primary."""
 
     def __init__(
         self,
@@ -29,20 +78,23 @@ class EngineUtilities:
         self.port = port
         self.dialect = dialect
 
+        # DATABASE_URL points the application to another database, i.e. a SQLite stand-in, which
+        # needs no credentials
+        database_url = os.getenv("DATABASE_URL")
+        self.username = quoted_env("MYSQL_USER")
+        password = quoted_env("MYSQL_PASSWORD")
+        if database_url and database_url.startswith("sqlite"):
+            self.username = os.getenv("MYSQL_USER", "sqlite")
+        elif self.username is None or password is None:
+            self.logger.error("Credentials not found.")
         try:
-            self.username = urllib.parse.quote_plus(os.getenv("MYSQL_USER"))
-            password = urllib.parse.quote_plus(os.getenv("MYSQL_PASSWORD"))
-        except AttributeError:
-            self.logger.error(f"Credentials not found.")
-        try:
-            conn_args = {"ssl": {"ssl-mode": "required"}}
-            self.engine = create_engine(
-                f"{dialect}://{self.username}:{password}@"
+            self.engine = self._create_engine(
+                database_url
+                or f"{dialect}://{self.username}:{password}@"
                 f"{self.host}:{self.port}/{self.database}",
-                connect_args=conn_args,
-                pool_recycle=recyle_timer,
-                pool_size=pool_size,
-                max_overflow=max_overflow,
+                recyle_timer,
+                pool_size,
+                max_overflow,
             )
             self.init_session = sessionmaker(bind=self.engine)
             self.logger.info(
@@ -54,10 +106,77 @@ class EngineUtilities:
             )
             raise
 
+        self.replica_engines = []
+        replicas = os.getenv("DATABASE_REPLICAS")
+        for replica in replicas.split(",") if replicas else []:
+            replica = replica.strip()
+            if "://" not in replica:
+                replica_host, _, replica_port = replica.partition(":")
+                replica = (
+                    f"{dialect}://{self.username}:{password}@"
+                    f"{replica_host}:{replica_port or self.port}/{self.database}"
+                )
+            self.replica_engines.append(
+                self._create_engine(replica, recyle_timer, pool_size, max_overflow)
+            )
+        self.init_read_sessions = [sessionmaker(bind=engine) for engine in self.replica_engines]
+        self.replica_healthy = [True] * len(self.replica_engines)
+        self.replica_lag: List[Optional[float]] = [None] * len(self.replica_engines)
+        self.replica_counter = itertools.count()
+        # Replicas lagging behind the primary by more than this many seconds are not read from
+        self.max_replica_lag = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+        # Clients read from the primary for this many seconds after writing, 0 disables it
+        self.read_your_writes_seconds = float(os.getenv("DATABASE_READ_YOUR_WRITES_SECONDS", "0"))
+        self.last_writes: Dict[str, float] = {}
+        self.last_writes_lock = threading.Lock()
+        if self.replica_engines:
+            self.logger.info(f"{len(self.replica_engines)} read replicas configured!")
+
+    @staticmethod
+    def _create_engine(url: str, recyle_timer: int, pool_size: int, max_overflow: int) -> Any:
+        if url.startswith("sqlite"):
+            return create_engine(url)
+        conn_args = {"ssl": {"ssl-mode": "required"}}
+        return create_engine(
+            url,
+            connect_args=conn_args,
+            poolclass=TimedQueuePool,
+            pool_recycle=recyle_timer,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+        )
+
     @contextmanager
     def session_manager(self) -> None:
         """Creates a session from session factory and wraps query in session in database transaction."""
-        session = self.init_session()
+        with self._transaction(self.init_session()) as session:
+            yield session
+        self._record_write()
+        return
+
+    @contextmanager
+    def read_session_manager(self) -> None:
+        """Creates a session on a healthy replica, picked round robin, and wraps query in session in
+        database transaction. Falls back to the primary when no replica is healthy or reachable, or
+        when the current client wrote within the read-your-writes window."""
+        session = None
+        index = self._pick_replica()
+        if index is not None:
+            session = self.init_read_sessions[index]()
+            try:
+                # Checks out the connection now, so an unreachable replica can still be skipped
+                session.connection()
+            except OperationalError:
+                self.logger.warning(f"Replica {index} unreachable, reading from primary!")
+                self.replica_healthy[index] = False
+                session.close()
+                session = None
+        with self._transaction(session or self.init_session()) as session:
+            yield session
+        return
+
+    @contextmanager
+    def _transaction(self, session: Session) -> None:
         try:
             yield session
             session.commit()
@@ -68,3 +187,62 @@ class EngineUtilities:
         finally:
             session.close()
         return
+
+    def _pick_replica(self) -> Optional[int]:
+        client = current_client.get()
+        if client is not None and self.read_your_writes_seconds > 0:
+            with self.last_writes_lock:
+                written_at = self.last_writes.get(client)
+            if written_at is not None:
+                if time.monotonic() - written_at < self.read_your_writes_seconds:
+                    return None
+        healthy = [index for index, ok in enumerate(self.replica_healthy) if ok]
+        if not healthy:
+            return None
+        return healthy[next(self.replica_counter) % len(healthy)]
+
+    def _record_write(self) -> None:
+        client = current_client.get()
+        if client is None or self.read_your_writes_seconds <= 0 or not self.replica_engines:
+            return
+        now = time.monotonic()
+        with self.last_writes_lock:
+            self.last_writes[client] = now
+            if len(self.last_writes) > 10000:
+                expired = now - self.read_your_writes_seconds
+                self.last_writes = {
+                    client: written_at
+                    for client, written_at in self.last_writes.items()
+                    if written_at > expired
+                }
+        return
+
+    def check_replicas(self) -> None:
+        """Checks every replica is reachable and measures its replication lag. Unreachable replicas,
+        stopped replication and replicas lagging by more than max_replica_lag seconds are taken out
+        of the read rotation until the next check."""
+        for index, engine in enumerate(self.replica_engines):
+            try:
+                with engine.connect() as connection:
+                    lag = self._replication_lag(connection)
+            except:
+                self.logger.warning(f"Replica {index} health check failed!", exc_info=True)
+                lag = None
+            healthy = lag is not None and lag <= self.max_replica_lag
+            if healthy != self.replica_healthy[index]:
+                self.logger.info(f"Replica {index} is now {'healthy' if healthy else 'unhealthy'}.")
+            self.replica_lag[index] = lag
+            self.replica_healthy[index] = healthy
+        return
+
+    @staticmethod
+    def _replication_lag(connection: Any) -> Optional[float]:
+        """Returns the replication lag in seconds, None when replication is stopped. Databases which
+        are not replicating, i.e. a second local instance, have no lag."""
+        if connection.dialect.name != "mysql":
+            return 0.0
+        status = connection.exec_driver_sql("SHOW SLAVE STATUS").mappings().first()
+        if status is None:
+            return 0.0
+        lag = status["Seconds_Behind_Master"]
+        return float(lag) if lag is not None else None
@@ -1,6 +1,16 @@
 # coding: utf-8
-from sqlalchemy import Column, DateTime, ForeignKey, Index, String
-from sqlalchemy.dialects.mysql import INTEGER, LONGTEXT
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    text,
+)
+from sqlalchemy.dialects.mysql import INTEGER, LONGBLOB, LONGTEXT, MEDIUMBLOB, MEDIUMTEXT
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -10,13 +20,17 @@ metadata = Base.metadata
 
 class Article(Base):
     __tablename__ = 'articles'
+    __table_args__ = (
+        Index('headline_content_ftidx', 'headline', 'article_content', mysql_prefix='FULLTEXT'),
+        Index('timezone_published_time_idx', 'publisher_timezone', 'published_time'),
+    )
 
     article_id = Column(String(90), primary_key=True)
     headline = Column(String(450), nullable=False)
     published_time = Column(DateTime, nullable=False, index=True)
-    publisher_timezone = Column(String(90), nullable=False, index=True)
-    article_content = Column(LONGTEXT)
-    updated_at = Column(DateTime, nullable=False)
+    publisher_timezone = Column(String(90), nullable=False)
+    article_content = Column(Text().with_variant(LONGTEXT, 'mysql'))
+    updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
     updated_by = Column(String(45), nullable=False)
 
 
@@ -30,7 +44,7 @@ class Entity(Base):
     article_id = Column(ForeignKey('articles.article_id'), nullable=False, index=True)
     entity = Column(String(45), nullable=False)
     entity_value = Column(String(90), nullable=False)
-    updated_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
     updated_by = Column(String(45), nullable=False)
 
     article = relationship('Article')
@@ -39,14 +53,47 @@ class Entity(Base):
 class Tag(Base):
     __tablename__ = 'tags'
     __table_args__ = (
-        Index('tag_tag_value_idx', 'tag', 'tag_value'),
+        Index('tag_idx', 'tag'),
+        UniqueConstraint('article_id', 'tag', name='article_tag_unique'),
     )
 
     tag_id = Column(INTEGER(11), primary_key=True)
     article_id = Column(ForeignKey('articles.article_id'), nullable=False, index=True)
     tag = Column(String(45), nullable=False)
-    tag_value = Column(String(45), nullable=False)
-    tagged_at = Column(DateTime, nullable=False)
+    tagged_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
     tagged_by = Column(String(45), nullable=False)
 
     article = relationship('Article')
+
+
+class SearchDocument(Base):
+    __tablename__ = 'search_documents'
+
+    article_id = Column(ForeignKey('articles.article_id'), primary_key=True)
+    document = Column(Text().with_variant(MEDIUMTEXT, 'mysql'), nullable=False)
+    updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+    article = relationship('Article')
+
+
+class ContentDictionary(Base):
+    __tablename__ = 'content_dictionaries'
+
+    dictionary_id = Column(INTEGER(11), primary_key=True)
+    codec = Column(String(10), nullable=False)
+    dictionary = Column(LargeBinary().with_variant(MEDIUMBLOB, 'mysql'), nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+
+class ArticleContent(Base):
+    __tablename__ = 'article_contents'
+
+    article_id = Column(ForeignKey('articles.article_id'), primary_key=True)
+    codec = Column(String(10), nullable=False)
+    dictionary_id = Column(ForeignKey('content_dictionaries.dictionary_id'))
+    content = Column(LargeBinary().with_variant(LONGBLOB, 'mysql'), nullable=False)
+    content_length = Column(INTEGER(11), nullable=False)
+    updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+    article = relationship('Article')
+    content_dictionary = relationship('ContentDictionary')
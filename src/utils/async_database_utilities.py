@@ -0,0 +1,65 @@
+#!/usr/local/bin/python3 -u
+
+from datetime import datetime
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from base_classes.async_engine_utils import AsyncEngineUtilities
+from models.db_models import Tag
+from utils.database_utilities import articles_page_statement
+
+
+class AsyncDatabaseUtilities(AsyncEngineUtilities):
+    """Utilities class inheriting from AsyncEngineUtilities to perform queries on the database
+    from an event loop. Mirrors the queries of DatabaseUtilities used by the API routes."""
+
+    def __init__(
+        self,
+        host: str,
+        database: str,
+        port: int = 3306,
+        dialect: str = "mysql+aiomysql",
+        recyle_timer: int = 14400,
+        pool_size: int = 20,
+        max_overflow: int = 10,
+    ) -> None:
+        super().__init__(host, database, port, dialect, recyle_timer, pool_size, max_overflow)
+        self.logger = logging.getLogger("AsyncDatabaseUtilitiesLogs")
+
+    async def query_all_articles(self) -> List[Any]:
+        """Queries all articles and returns them by latest published time."""
+        async with self.session_manager() as session:
+            articles = (await session.execute(articles_page_statement())).all()
+        return articles
+
+    async def query_articles_page(
+        self, limit: int, cursor: Optional[Tuple[datetime, str]] = None
+    ) -> List[Any]:
+        """Queries a page of articles by latest published time, starting right after the given
+        (published_time, article_id) cursor."""
+        async with self.session_manager() as session:
+            articles = (await session.execute(articles_page_statement(limit, cursor))).all()
+        return articles
+
+    async def stream_all_articles(self, batch_size: int = 1000) -> AsyncIterator[Any]:
+        """Streams all articles by latest published time from a server-side cursor, fetching
+        batch_size rows at a time."""
+        async with self.session_manager() as session:
+            result = await session.stream(articles_page_statement())
+            async for partition in result.partitions(batch_size):
+                for article in partition:
+                    yield article
+
+    async def execute_all(self, statement: Any) -> List[Any]:
+        """Executes a statement on its own session. Returns all result rows."""
+        async with self.session_manager() as session:
+            rows = (await session.execute(statement)).all()
+        return rows
+
+    async def insert_tags(self, tags: List[Dict[str, str]]) -> None:
+        """Bulk inserts list of tags for given article id."""
+        async with self.session_manager() as session:
+            await session.run_sync(
+                lambda sync_session: sync_session.bulk_insert_mappings(Tag, tags)
+            )
+        return
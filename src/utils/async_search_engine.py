@@ -0,0 +1,48 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from utils.request_parser import parse_fields, parse_limit
+from utils.search_engine import SearchEngine
+
+
+class AsyncSearchEngine(SearchEngine):
+    """SearchEngine running on an async engine. The article, entity and tag statements are
+    independent, so each runs on its own session and connection concurrently."""
+
+    async def search(
+        self, searched: Dict[str, Any], explain: bool = False
+    ) -> Tuple[Dict[str, Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Runs the article, entity and tag statements of a search concurrently. Raises ValueError
+        on unknown fields, malformed published times or an invalid limit.
+        Returns a dictionary mapping article id to its attributes, and the generated SQL and
+        timings if explain is set."""
+        start = time.perf_counter()
+        fields = parse_fields(searched)
+        limit = parse_limit(searched)
+        criteria = self.build_criteria(searched)
+        statements = []
+        if criteria:
+            statements = [self.build_article_statement(searched, criteria, fields, limit)]
+            statements.extend(self.build_hydration_statements(criteria, fields, searched, limit))
+        timings = {"compile_ms": (time.perf_counter() - start) * 1000}
+
+        articles, hydration = [], []
+        if statements:
+            step = time.perf_counter()
+            articles, *hydrations = await asyncio.gather(
+                *(self.db_utils.execute_all(statement) for statement in statements)
+            )
+            hydration = [row for rows in hydrations for row in rows]
+            timings["search_ms"] = (time.perf_counter() - step) * 1000
+        articles_dict = self.assemble(articles, hydration)
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        self.logger.debug("Search timings: %s", timings)
+
+        if not explain:
+            return articles_dict, None
+        explained = {
+            "timings": timings,
+            "statements": [self.explain_statement(statement) for statement in statements],
+        }
+        return articles_dict, explained
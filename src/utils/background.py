@@ -0,0 +1,23 @@
+import logging
+import threading
+from typing import Callable
+
+
+logger = logging.getLogger("BackgroundLogs")
+
+
+def run_periodically(function: Callable[[], None], interval: float, name: str) -> threading.Thread:
+    """Starts a daemon thread calling function every interval seconds. Exceptions are logged and
+    do not stop the thread. Returns the started thread."""
+
+    def loop() -> None:
+        stopped = threading.Event()
+        while not stopped.wait(interval):
+            try:
+                function()
+            except:
+                logger.warning(f"Periodic task {name} failed!", exc_info=True)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,93 @@
+from collections import Counter
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from utils.database_utilities import DatabaseUtilities
+
+
+logger = logging.getLogger("BulkTaggerLogs")
+
+# Reason of the tags of chunks failing on a transient database error, which may succeed retried
+DATABASE_ERROR = "Database error"
+# Reason of the tags the database refused, which fail again when retried
+REJECTED_BY_DATABASE = "Rejected by the database"
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a database error may go away when retried: lost connections, lock wait timeouts,
+    deadlocks and other operational errors, as opposed to rows violating the schema."""
+    if isinstance(error, OperationalError):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def tag_result(tag: Dict[str, str], status: str, reason: Optional[str] = None) -> Dict[str, str]:
+    """Builds the result reported for a single tag of a bulk tagging job."""
+    result = {"article_id": tag["article_id"], "tag": tag["tag"], "status": status}
+    if reason:
+        result["reason"] = reason
+    return result
+
+
+def bulk_tag(
+    db_utils: DatabaseUtilities,
+    tags: List[Dict[str, str]],
+    batch_size: int = 1000,
+    on_duplicate: str = "ignore",
+) -> Dict[str, List[Dict[str, str]]]:
+    """Inserts a large list of unique tags in chunks of batch_size, each chunk being its own
+    multi-row statement and transaction so lock holds stay short. Tags of unknown articles are
+    reported as failed without reaching the insert, and a failing chunk does not abort the others.
+    A chunk failing on a transient error is reported as DATABASE_ERROR, one refused by the
+    database is split in halves down to the offending tags, reported as REJECTED_BY_DATABASE.
+    Returns the per-tag results along with the list of tags that were written, and the list of
+    those which were newly inserted."""
+    results = []
+    written = []
+    all_inserted = []
+    existing_article_ids = db_utils.query_existing_article_ids(
+        list({tag["article_id"] for tag in tags}), batch_size
+    )
+    valid_tags = []
+    for tag in tags:
+        if tag["article_id"] in existing_article_ids:
+            valid_tags.append(tag)
+        else:
+            results.append(tag_result(tag, "failed", "Unknown article_id"))
+
+    existing_status = "updated" if on_duplicate == "update" else "skipped"
+    chunks = [
+        valid_tags[start : start + batch_size] for start in range(0, len(valid_tags), batch_size)
+    ]
+    while chunks:
+        chunk = chunks.pop(0)
+        try:
+            inserted, existing = db_utils.upsert_tags(chunk, on_duplicate)
+        except Exception as error:
+            if is_transient(error):
+                logger.warning(f"Tag chunk of {len(chunk)} tags failed!", exc_info=True)
+                results.extend(tag_result(tag, "failed", DATABASE_ERROR) for tag in chunk)
+            elif len(chunk) > 1:
+                # Bisects the chunk so only the offending tags fail
+                middle = len(chunk) // 2
+                chunks[:0] = [chunk[:middle], chunk[middle:]]
+            else:
+                logger.warning(f"Tag {chunk[0]} refused: {error}")
+                results.append(tag_result(chunk[0], "failed", REJECTED_BY_DATABASE))
+            continue
+        results.extend(tag_result(tag, "inserted") for tag in inserted)
+        results.extend(tag_result(tag, existing_status) for tag in existing)
+        written.extend(inserted)
+        all_inserted.extend(inserted)
+        if on_duplicate == "update":
+            written.extend(existing)
+    return {"results": results, "written": written, "inserted": all_inserted}
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Counts bulk tagging results by status."""
+    summary = {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+    summary.update(Counter(result["status"] for result in results))
+    return summary
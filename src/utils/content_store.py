@@ -0,0 +1,497 @@
+from abc import ABC, abstractmethod
+import argparse
+from collections import Counter, namedtuple
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import zlib
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from base_classes.engine_utils import EngineUtilities
+from models.db_models import Article, ArticleContent, ContentDictionary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CONTENT_STORES = ("row", "table", "file")
+CONTENT_CODECS = ("zlib", "zstd")
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+# zlib only looks back 32KB, zstd dictionaries are usually trained to about 110KB
+DICTIONARY_SIZES = {"zlib": 32 * 1024, "zstd": 110 * 1024}
+# Header of the files of the file store: codec index and dictionary id (0 for none)
+FILE_HEADER = struct.Struct("<BI")
+
+# Range of an article content, as returned by DatabaseUtilities.query_article_content
+ContentRange = namedtuple("ContentRange", ["content", "total_length"])
+
+
+def check_zstandard() -> None:
+    """Raises RuntimeError if zstandard, an optional dependency of the zstd codec, is missing."""
+    if zstandard is None:
+        raise RuntimeError("The zstd codec needs zstandard, install it with pip install zstandard")
+    return
+
+
+def build_dictionary(codec: str, samples: List[str], size: Optional[int] = None) -> bytes:
+    """Builds a dictionary of the text shared by sample contents, priming the compression of every
+    content so that short contents compress well on their own. zstd trains its dictionary, zlib
+    uses the most repeated word trigrams of the samples (the most frequent ones last, where
+    zlib references them with the shortest distances)."""
+    size = size or DICTIONARY_SIZES[codec]
+    if codec == "zstd":
+        check_zstandard()
+        encoded = [sample.encode("utf-8") for sample in samples]
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    counts: Counter = Counter()
+    for sample in samples:
+        words = sample.split()
+        counts.update(" ".join(words[start : start + 3]) for start in range(len(words) - 2))
+    phrases = []
+    total = 0
+    for phrase, count in counts.most_common():
+        encoded = (phrase + " ").encode("utf-8")
+        # Phrases found once are no help to other contents
+        if count < 2 or total + len(encoded) > size:
+            break
+        phrases.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(phrases))
+
+
+class ContentCodec:
+    """Compresses article contents with zlib or zstd, primed with an optional shared dictionary
+    identified by dictionary_id."""
+
+    def __init__(
+        self,
+        codec: str = "zlib",
+        dictionary: Optional[bytes] = None,
+        dictionary_id: Optional[int] = None,
+        level: Optional[int] = None,
+    ) -> None:
+        if codec not in CONTENT_CODECS:
+            raise ValueError(f"Unknown content codec: {codec}")
+        if codec == "zstd":
+            check_zstandard()
+        self.codec = codec
+        self.dictionary = dictionary or None
+        self.dictionary_id = dictionary_id if self.dictionary else None
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        self.zstd_dictionary = None
+        if codec == "zstd" and self.dictionary:
+            self.zstd_dictionary = zstandard.ZstdCompressionDict(self.dictionary)
+
+    def compress(self, content: str) -> bytes:
+        data = content.encode("utf-8")
+        if self.codec == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.zstd_dictionary)
+            return compressor.compress(data)
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> str:
+        if self.codec == "zstd":
+            decompressor = zstandard.ZstdDecompressor(dict_data=self.zstd_dictionary)
+            return decompressor.decompress(data).decode("utf-8")
+        if self.dictionary:
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+class ContentStore(ABC):
+    """Base class of the stores keeping article content compressed out of the articles rows, so
+    that article scans and hydration read lean rows. Contents are compressed with the latest
+    dictionary of the configured codec, and decompressed with the codec and dictionary they were
+    compressed with.
+
+    Subclasses implement the abstract get_raw, put_raw, delete, save_dictionary, load_dictionary
+    and latest_dictionary_id."""
+
+    def __init__(self, codec: str = "zlib", level: Optional[int] = None) -> None:
+        if codec not in CONTENT_CODECS:
+            raise ValueError(f"Unknown content codec: {codec}")
+        self.codec = codec
+        self.level = level
+        self.logger = logging.getLogger("ContentStoreLogs")
+        self.lock = threading.Lock()
+        # Codecs by (codec, dictionary id), loaded as contents compressed with them are read
+        self.codecs: Dict[Tuple[str, Optional[int]], ContentCodec] = {}
+        self.writer: Optional[ContentCodec] = None
+
+    @abstractmethod
+    def get_raw(self, article_ids: List[str]) -> Dict[str, Tuple[str, Optional[int], bytes]]:
+        """Returns the (codec, dictionary id, compressed content) of the given articles."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_raw(self, rows: List[Dict[str, Any]], session: Any = None) -> None:
+        """Stores compressed contents, given as rows of article_id, codec, dictionary_id, content
+        and content_length."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, article_ids: List[str], session: Any = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_dictionary(self, codec: str, dictionary: bytes) -> int:
+        """Stores a dictionary. Returns its id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_dictionary(self, dictionary_id: int) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def latest_dictionary_id(self, codec: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def get_codec(self, codec: str, dictionary_id: Optional[int]) -> ContentCodec:
+        key = (codec, dictionary_id)
+        with self.lock:
+            content_codec = self.codecs.get(key)
+        if content_codec is None:
+            dictionary = self.load_dictionary(dictionary_id) if dictionary_id else None
+            content_codec = ContentCodec(codec, dictionary, dictionary_id, self.level)
+            with self.lock:
+                self.codecs[key] = content_codec
+        return content_codec
+
+    def writer_codec(self) -> ContentCodec:
+        """Returns the codec compressing new contents, with the latest dictionary when the store
+        has one. Dictionaries trained by the migration command are picked up on restart."""
+        if self.writer is None:
+            self.writer = self.get_codec(self.codec, self.latest_dictionary_id(self.codec))
+        return self.writer
+
+    def train(self, samples: List[str], size: Optional[int] = None) -> int:
+        """Builds and stores a dictionary of sample contents, used to compress new contents.
+        Returns the dictionary id."""
+        dictionary = build_dictionary(self.codec, samples, size)
+        dictionary_id = self.save_dictionary(self.codec, dictionary)
+        self.writer = self.get_codec(self.codec, dictionary_id)
+        self.logger.info(f"Content dictionary {dictionary_id} built from {len(samples)} samples.")
+        return dictionary_id
+
+    def get_many(self, article_ids: List[str]) -> Dict[str, str]:
+        """Returns a dictionary mapping article id to content, for the articles with a stored
+        content."""
+        contents = {}
+        for article_id, (codec, dictionary_id, data) in self.get_raw(article_ids).items():
+            contents[article_id] = self.get_codec(codec, dictionary_id).decompress(data)
+        return contents
+
+    def get(self, article_id: str) -> Optional[str]:
+        return self.get_many([article_id]).get(article_id)
+
+    def put_many(self, contents: Dict[str, Optional[str]], session: Any = None) -> int:
+        """Compresses and stores contents by article id, a None content deleting the stored
+        content of its article. The table store writes in session's transaction when given.
+        Returns the number of compressed bytes stored."""
+        codec = self.writer_codec()
+        rows = []
+        deleted = []
+        for article_id, content in contents.items():
+            if content is None:
+                deleted.append(article_id)
+                continue
+            rows.append(
+                {
+                    "article_id": article_id,
+                    "codec": codec.codec,
+                    "dictionary_id": codec.dictionary_id,
+                    "content": codec.compress(content),
+                    "content_length": len(content),
+                }
+            )
+        if deleted:
+            self.delete(deleted, session)
+        if rows:
+            self.put_raw(rows, session)
+        return sum(len(row["content"]) for row in rows)
+
+
+class TableContentStore(ContentStore):
+    """Stores compressed contents in the article_contents table and their dictionaries in the
+    content_dictionaries table. Contents are read from the read replicas like articles."""
+
+    def __init__(
+        self,
+        db_utils: EngineUtilities,
+        codec: str = "zlib",
+        level: Optional[int] = None,
+        batch_size: int = 1000,
+    ) -> None:
+        super().__init__(codec, level)
+        self.db_utils = db_utils
+        self.batch_size = batch_size
+
+    def get_raw(self, article_ids: List[str]) -> Dict[str, Tuple[str, Optional[int], bytes]]:
+        contents = {}
+        with self.db_utils.read_session_manager() as session:
+            for start in range(0, len(article_ids), self.batch_size):
+                rows = session.execute(
+                    select(
+                        ArticleContent.article_id,
+                        ArticleContent.codec,
+                        ArticleContent.dictionary_id,
+                        ArticleContent.content,
+                    ).where(
+                        ArticleContent.article_id.in_(article_ids[start : start + self.batch_size])
+                    )
+                ).all()
+                for row in rows:
+                    contents[row.article_id] = (row.codec, row.dictionary_id, row.content)
+        return contents
+
+    def put_raw(self, rows: List[Dict[str, Any]], session: Any = None) -> None:
+        if session is None:
+            with self.db_utils.session_manager() as session:
+                return self.put_raw(rows, session)
+        updated_columns = ["codec", "dictionary_id", "content", "content_length"]
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start : start + self.batch_size]
+            if self.db_utils.engine.dialect.name == "sqlite":
+                statement = sqlite_insert(ArticleContent).values(batch)
+                updates = {column: statement.excluded[column] for column in updated_columns}
+                statement = statement.on_conflict_do_update(
+                    index_elements=[ArticleContent.article_id],
+                    set_={**updates, "updated_at": func.now()},
+                )
+            else:
+                statement = mysql_insert(ArticleContent).values(batch)
+                updates = {column: statement.inserted[column] for column in updated_columns}
+                statement = statement.on_duplicate_key_update(**updates, updated_at=func.now())
+            session.execute(statement)
+        return
+
+    def delete(self, article_ids: List[str], session: Any = None) -> None:
+        if session is None:
+            with self.db_utils.session_manager() as session:
+                return self.delete(article_ids, session)
+        session.query(ArticleContent).filter(ArticleContent.article_id.in_(article_ids)).delete(
+            synchronize_session=False
+        )
+        return
+
+    def save_dictionary(self, codec: str, dictionary: bytes) -> int:
+        with self.db_utils.session_manager() as session:
+            result = session.execute(
+                insert(ContentDictionary).values(codec=codec, dictionary=dictionary)
+            )
+            return result.inserted_primary_key[0]
+
+    def load_dictionary(self, dictionary_id: int) -> bytes:
+        # Read from the primary, a new dictionary may not have reached the replicas yet
+        with self.db_utils.session_manager() as session:
+            return session.execute(
+                select(ContentDictionary.dictionary).where(
+                    ContentDictionary.dictionary_id == dictionary_id
+                )
+            ).scalar_one()
+
+    def latest_dictionary_id(self, codec: str) -> Optional[int]:
+        with self.db_utils.session_manager() as session:
+            return session.execute(
+                select(func.max(ContentDictionary.dictionary_id)).where(
+                    ContentDictionary.codec == codec
+                )
+            ).scalar()
+
+
+class FileContentStore(ContentStore):
+    """Stores every compressed content in its own file of a local directory, named after the hash
+    of its article id, and dictionaries under the dictionaries folder. Files are replaced
+    atomically. Every application instance needs the directory, i.e. on a shared volume."""
+
+    def __init__(self, directory: str, codec: str = "zlib", level: Optional[int] = None) -> None:
+        super().__init__(codec, level)
+        self.directory = directory
+        self.dictionary_directory = os.path.join(directory, "dictionaries")
+        os.makedirs(self.dictionary_directory, exist_ok=True)
+
+    def path(self, article_id: str) -> str:
+        digest = hashlib.sha1(article_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:] + ".bin")
+
+    def get_raw(self, article_ids: List[str]) -> Dict[str, Tuple[str, Optional[int], bytes]]:
+        contents = {}
+        for article_id in article_ids:
+            try:
+                with open(self.path(article_id), "rb") as content_file:
+                    data = content_file.read()
+            except FileNotFoundError:
+                continue
+            codec_index, dictionary_id = FILE_HEADER.unpack_from(data)
+            contents[article_id] = (
+                CONTENT_CODECS[codec_index],
+                dictionary_id or None,
+                data[FILE_HEADER.size :],
+            )
+        return contents
+
+    def put_raw(self, rows: List[Dict[str, Any]], session: Any = None) -> None:
+        for row in rows:
+            path = self.path(row["article_id"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            header = FILE_HEADER.pack(CONTENT_CODECS.index(row["codec"]), row["dictionary_id"] or 0)
+            with open(path + ".tmp", "wb") as content_file:
+                content_file.write(header + row["content"])
+            os.replace(path + ".tmp", path)
+        return
+
+    def delete(self, article_ids: List[str], session: Any = None) -> None:
+        for article_id in article_ids:
+            try:
+                os.remove(self.path(article_id))
+            except FileNotFoundError:
+                pass
+        return
+
+    def dictionary_ids(self, codec: str) -> List[int]:
+        suffix = f".{codec}.dict"
+        return [
+            int(name[: -len(suffix)])
+            for name in os.listdir(self.dictionary_directory)
+            if name.endswith(suffix)
+        ]
+
+    def save_dictionary(self, codec: str, dictionary: bytes) -> int:
+        existing = [
+            dictionary_id for name in CONTENT_CODECS for dictionary_id in self.dictionary_ids(name)
+        ]
+        dictionary_id = max(existing, default=0) + 1
+        path = os.path.join(self.dictionary_directory, f"{dictionary_id}.{codec}.dict")
+        with open(path, "wb") as dictionary_file:
+            dictionary_file.write(dictionary)
+        return dictionary_id
+
+    def load_dictionary(self, dictionary_id: int) -> bytes:
+        for codec in CONTENT_CODECS:
+            path = os.path.join(self.dictionary_directory, f"{dictionary_id}.{codec}.dict")
+            if os.path.exists(path):
+                with open(path, "rb") as dictionary_file:
+                    return dictionary_file.read()
+        raise FileNotFoundError(f"Content dictionary {dictionary_id} not found!")
+
+    def latest_dictionary_id(self, codec: str) -> Optional[int]:
+        return max(self.dictionary_ids(codec), default=None)
+
+
+def build_content_store(
+    db_utils: EngineUtilities,
+    store: str = "row",
+    codec: str = "zlib",
+    level: Optional[int] = None,
+    directory: str = "content",
+) -> Optional[ContentStore]:
+    """Builds the content store of the given kind: None for "row", contents staying in the
+    articles rows, a TableContentStore for "table" or a FileContentStore for "file"."""
+    if store not in CONTENT_STORES:
+        raise ValueError(f"Unknown content store: {store}")
+    if store == "table":
+        return TableContentStore(db_utils, codec, level)
+    if store == "file":
+        return FileContentStore(directory, codec, level)
+    return None
+
+
+def migrate_contents(
+    db_utils: EngineUtilities,
+    store: ContentStore,
+    batch_size: int = 500,
+    train_sample: int = 1000,
+) -> Dict[str, Any]:
+    """Moves the contents still in the articles rows to store, batch_size articles at a time by
+    article id, first building a dictionary from train_sample contents. Every batch is read,
+    stored and cleared from its rows in one transaction holding the rows locked (FOR UPDATE), so
+    concurrent article updates wait for it and never have their content overwritten by the one
+    read: the table store writes in that transaction, and articles updated before the batch is
+    read have their content in the store already and are skipped. Can be stopped and run again at
+    any time: content in a row takes precedence over stored content.
+    Returns the number of articles moved and their size in bytes before and after compression."""
+    logger = logging.getLogger("ContentStoreLogs")
+    if train_sample:
+        with db_utils.session_manager() as session:
+            samples = (
+                session.execute(
+                    select(Article.article_content)
+                    .where(Article.article_content.isnot(None))
+                    .limit(train_sample)
+                )
+                .scalars()
+                .all()
+            )
+        if samples:
+            store.train(samples)
+    stats = {"articles": 0, "content_bytes": 0, "stored_bytes": 0}
+    cursor = ""
+    while True:
+        with db_utils.session_manager() as session:
+            articles = session.execute(
+                select(Article.article_id, Article.article_content)
+                .where(Article.article_content.isnot(None), Article.article_id > cursor)
+                .order_by(Article.article_id)
+                .limit(batch_size)
+                .with_for_update()
+            ).all()
+            if not articles:
+                break
+            stats["stored_bytes"] += store.put_many(
+                {article.article_id: article.article_content for article in articles}, session
+            )
+            session.execute(
+                update(Article)
+                .where(Article.article_id.in_([article.article_id for article in articles]))
+                .values(article_content=None)
+                .execution_options(synchronize_session=False)
+            )
+        stats["articles"] += len(articles)
+        stats["content_bytes"] += sum(len(article.article_content.encode()) for article in articles)
+        cursor = articles[-1].article_id
+        logger.info(f"{stats['articles']} article contents moved.")
+    if stats["stored_bytes"]:
+        stats["compression_ratio"] = stats["content_bytes"] / stats["stored_bytes"]
+    return stats
+
+
+if __name__ == "__main__":
+    # MOVES ARTICLE CONTENT OUT OF THE ARTICLES ROWS INTO A CONTENT STORE, RUN FROM THE SRC FOLDER
+    # Ex: python -m utils.content_store --store table --codec zlib
+    from utils.database_utilities import DatabaseUtilities
+    from utils.init_logger import init_logger
+
+    parser = argparse.ArgumentParser(description="Moves article content to a content store.")
+    parser.add_argument("--store", choices=CONTENT_STORES[1:], default="table")
+    parser.add_argument("--codec", choices=CONTENT_CODECS, default="zlib")
+    parser.add_argument("--level", type=int)
+    parser.add_argument("--directory", default="content", help="Directory of the file store")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--train-sample",
+        type=int,
+        default=1000,
+        help="Number of contents the compression dictionary is built from, 0 to skip it",
+    )
+    args = parser.parse_args()
+    init_logger()
+    db_utils = DatabaseUtilities(
+        host=os.getenv("DATABASE_CONTAINER"), database=os.getenv("MYSQL_DATABASE")
+    )
+    store = build_content_store(db_utils, args.store, args.codec, args.level, args.directory)
+    print(json.dumps(migrate_contents(db_utils, store, args.batch_size, args.train_sample)))
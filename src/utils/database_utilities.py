@@ -1,11 +1,83 @@
 #!/usr/local/bin/python3 -u
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import datetime, timedelta
+import json
 import logging
-from typing import Any, Dict, List
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import String, and_, bindparam, func, insert, or_, select, text, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from base_classes.engine_utils import EngineUtilities
 from models.db_models import Article, Entity, Tag
+from utils.content_store import ContentRange, build_content_store
+
+
+# Columns of the article listings returned by get_all_articles
+ARTICLE_LIST_COLUMNS = ("article_id", "headline", "published_time")
+
+
+def articles_page_statement(
+    limit: Optional[int] = None, cursor: Optional[Tuple[datetime, str]] = None
+) -> Any:
+    """Builds the statement selecting articles by latest published time, starting right after the
+    given (published_time, article_id) cursor. Keyset pagination keeps every page a range scan on
+    publish_time_idx regardless of how deep the page is."""
+    statement = select(*(getattr(Article, column) for column in ARTICLE_LIST_COLUMNS))
+    if cursor:
+        published_time, article_id = cursor
+        statement = statement.where(
+            or_(
+                Article.published_time < published_time,
+                and_(Article.published_time == published_time, Article.article_id < article_id),
+            )
+        )
+    statement = statement.order_by(Article.published_time.desc(), Article.article_id.desc())
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def id_set_statement(ids: List[str], dialect_name: str) -> Any:
+    """Builds the statement selecting the given ids as an article_id column out of a single bound
+    JSON array parameter, with JSON_TABLE on MySQL and json_each on SQLite. Unlike an IN list,
+    the statement is the same whatever the number of ids, so it stays small and cacheable."""
+    ids_param = bindparam("ids", json.dumps(list(ids)), type_=String, unique=True)
+    if dialect_name == "sqlite":
+        statement = text("SELECT value AS article_id FROM json_each(:ids)")
+    else:
+        # JSON_TABLE columns are utf8mb4_bin, compared with the collation of the article tables
+        statement = text(
+            "SELECT ids.article_id COLLATE utf8mb4_0900_ai_ci AS article_id FROM JSON_TABLE("
+            ":ids, '$[*]' COLUMNS (article_id VARCHAR(90) PATH '$')) AS ids"
+        )
+    return statement.bindparams(ids_param).columns(article_id=String(90))
+
+
+def article_criteria(filters: Dict[str, Any]) -> List[Any]:
+    """Builds the clauses on the articles table of the criteria returned by
+    request_parser.parse_article_filters. Published time and timezone criteria are answered by
+    publish_time_idx and timezone_published_time_idx."""
+    criteria = []
+    if filters.get("article_id"):
+        criteria.append(Article.article_id.in_(filters["article_id"]))
+    if filters.get("headline"):
+        criteria.append(Article.headline.in_(filters["headline"]))
+    if filters.get("publisher_timezone"):
+        criteria.append(Article.publisher_timezone.in_(filters["publisher_timezone"]))
+    if filters.get("published_time"):
+        criteria.append(Article.published_time.in_(filters["published_time"]))
+    if filters.get("published_from"):
+        criteria.append(Article.published_time >= filters["published_from"])
+    if filters.get("published_to"):
+        criteria.append(Article.published_time < filters["published_to"])
+    return criteria
 
 
 class DatabaseUtilities(EngineUtilities):
@@ -23,109 +95,193 @@ class DatabaseUtilities(EngineUtilities):
     ) -> None:
         super().__init__(host, database, port, dialect, recyle_timer, pool_size, max_overflow)
         self.logger = logging.getLogger("DatabaseUtilitiesLogs")
+        # Id sets larger than this are sent as a single JSON array parameter instead of an IN list
+        self.max_id_list = int(os.getenv("DATABASE_MAX_ID_LIST", "1000"))
+        # Queries by article ids fetch this many ids per query, running that many queries at once.
+        # Chunk sessions of all requests share that many connections, at most the pool overflow,
+        # so parallel chunks never take the connections the pool keeps for other requests
+        self.id_chunk_size = int(os.getenv("DATABASE_ID_CHUNK_SIZE", "10000"))
+        id_chunk_concurrency = int(os.getenv("DATABASE_ID_CHUNK_CONCURRENCY", "4"))
+        self.id_chunk_concurrency = max(1, min(id_chunk_concurrency, max_overflow))
+        if self.id_chunk_concurrency != id_chunk_concurrency:
+            self.logger.warning(
+                f"Id chunk concurrency lowered to {self.id_chunk_concurrency}, the pool overflow."
+            )
+        self.id_chunk_slots = threading.BoundedSemaphore(self.id_chunk_concurrency)
+        # Rows are stamped when written but only visible once committed, pollers of timestamps
+        # stay this many seconds behind the database time to pick up slow transactions
+        self.commit_lag = float(os.getenv("DATABASE_COMMIT_LAG_SECONDS", "60"))
+        # Article content compressed out of the articles rows, None when it stays in the rows
+        level = os.getenv("CONTENT_STORE_LEVEL")
+        self.content_store = build_content_store(
+            self,
+            os.getenv("CONTENT_STORE", "row"),
+            codec=os.getenv("CONTENT_STORE_CODEC", "zlib"),
+            level=int(level) if level else None,
+            directory=os.getenv("CONTENT_STORE_DIRECTORY", "content"),
+        )
+
+    def lagged_watermark(self, session: Any, latest: datetime) -> datetime:
+        """Returns the watermark of a poller having seen rows stamped up to latest: at most
+        commit_lag seconds before the database time, so the next poll, inclusive of the
+        watermark, also sees rows committed since with an earlier timestamp."""
+        now = session.execute(select(func.now())).scalar()
+        return min(latest, now - timedelta(seconds=self.commit_lag))
+
+    def fill_contents(self, articles: List[Dict[str, Any]]) -> None:
+        """Sets the article_content of the given article dicts without content in their row
+        from the content store, if any. Content still in a row takes precedence."""
+        if self.content_store is None:
+            return
+        missing = [article for article in articles if article.get("article_content") is None]
+        if not missing:
+            return
+        contents = self.content_store.get_many([article["article_id"] for article in missing])
+        for article in missing:
+            article["article_content"] = contents.get(article["article_id"])
+        return
+
+    def id_criterion(self, column: Any, ids: List[str]) -> Any:
+        """Builds the clause matching column against a set of ids: an IN list for up to
+        max_id_list ids, a subquery over the ids as one JSON array parameter beyond."""
+        if len(ids) <= self.max_id_list:
+            return column.in_(ids)
+        return column.in_(id_set_statement(ids, self.engine.dialect.name))
+
+    def query_in_chunks(
+        self, article_ids: List[str], query: Callable[[List[str]], List[Any]]
+    ) -> List[Any]:
+        """Runs query on chunks of id_chunk_size article ids, each on its own session, at most
+        id_chunk_concurrency chunks at a time across all requests. Returns the rows of all chunks,
+        in chunk order."""
+        if len(article_ids) <= self.id_chunk_size:
+            return query(article_ids)
+        chunks = [
+            article_ids[start : start + self.id_chunk_size]
+            for start in range(0, len(article_ids), self.id_chunk_size)
+        ]
+
+        def query_chunk(chunk: List[str]) -> List[Any]:
+            with self.id_chunk_slots:
+                return query(chunk)
+
+        with ThreadPoolExecutor(max_workers=self.id_chunk_concurrency) as executor:
+            # Runs every chunk in a copy of the caller's context, which picks the read session
+            futures = [
+                executor.submit(contextvars.copy_context().run, query_chunk, chunk)
+                for chunk in chunks
+            ]
+            return [row for future in futures for row in future.result()]
 
     def query_all_articles(self) -> List[Any]:
         """Queries all articles and returns them by latest published time."""
-        with self.session_manager() as session:
+        with self.read_session_manager() as session:
             articles = (
-                session.query(Article.article_id, Article.headline, Article.published_time)
+                session.query(*(getattr(Article, column) for column in ARTICLE_LIST_COLUMNS))
                 .order_by(Article.published_time.desc())
                 .all()
             )
         return articles
 
-    def query_by_article(self, searched: Dict[str, Any]) -> List[str]:
-        """Query articles table for articles corresponding to given search attributes.
-        Returns a list of article ids."""
-        with self.session_manager() as session:
-            articles_query = session.query(Article.article_id)
-
-            article_ids = searched.get("article_id")
-            if article_ids:
-                articles_query = articles_query.filter(Article.article_id.in_(article_ids))
-
-            headlines = searched.get("headline")
-            if headlines:
-                articles_query = articles_query.filter(Article.headline.in_(headlines))
-            # Execute query
-            articles = articles_query.all()
-        return [article.article_id for article in articles]
-
-    def query_by_tags(self, tags: List[str]) -> List[str]:
-        """Query tags table articles corresponding to searched tags.
-        Returns a list of article ids."""
-        with self.session_manager() as session:
-            articles = session.query(Tag.article_id).filter(Tag.tag.in_(tags)).all()
-        return [article.article_id for article in articles]
+    def query_articles_page(
+        self, limit: int, cursor: Optional[Tuple[datetime, str]] = None
+    ) -> List[Any]:
+        """Queries a page of articles by latest published time, starting right after the given
+        (published_time, article_id) cursor."""
+        with self.read_session_manager() as session:
+            articles = session.execute(articles_page_statement(limit, cursor)).all()
+        return articles
 
-    def query_by_entities(self, entities: Dict[str, List[str]]) -> List[str]:
-        """Query entities table for articles corresponding to given search attributes.
-        Returns a list of article ids."""
-        article_ids = []
-        with self.session_manager() as session:
-            # Cascading search to narrow down articles ids which satisfy all search parameters
-            for entity, entity_values in entities.items():
-                articles = (
-                    session.query(Entity.article_id)
-                    .filter(Entity.entity == entity)
-                    .filter(Entity.entity_value.in_(entity_values))
-                    .all()
-                )
-                current_article_ids = [article.article_id for article in articles]
-                if not current_article_ids:
-                    # No articles found with current entity and entity values set
-                    return []
-                elif not article_ids:
-                    article_ids.extend(current_article_ids)
-                else:
-                    # Take articles which satisfy searched criteria
-                    article_ids = list(set(article_ids) & set(current_article_ids))
-                    if not article_ids:
-                        return []
-        return article_ids
+    def stream_all_articles(self, batch_size: int = 1000) -> Iterator[Any]:
+        """Streams all articles by latest published time from a server-side cursor, fetching
+        batch_size rows at a time. The session stays open until the generator is exhausted."""
+        with self.read_session_manager() as session:
+            result = session.execute(
+                articles_page_statement(), execution_options={"stream_results": True}
+            )
+            for partition in result.partitions(batch_size):
+                yield from partition
+        return
 
-    def query_article_by_article_id(self, article_ids: List[str], desc: bool) -> Dict[str, Dict[str, str]]:
+    def query_article_content(
+        self, article_id: str, offset: int = 0, length: Optional[int] = None
+    ) -> Optional[Any]:
+        """Queries the content of an article, starting offset characters in and truncated to length
+        characters. Only the requested range is sent over by the database.
+        Content kept in the content store is decompressed in full, then sliced.
+        Returns a row with content and total_length attributes, or None if the article does not
+        exist."""
+        # SQL SUBSTRING positions start at 1
+        if length is None:
+            content = func.substring(Article.article_content, offset + 1)
+        else:
+            content = func.substring(Article.article_content, offset + 1, length)
+        with self.read_session_manager() as session:
+            article = session.execute(
+                select(
+                    content.label("content"),
+                    func.char_length(Article.article_content).label("total_length"),
+                ).where(Article.article_id == article_id)
+            ).first()
+        if article is None or article.total_length is not None or self.content_store is None:
+            return article
+        content = self.content_store.get(article_id)
+        if content is None:
+            return article
+        end = None if length is None else offset + length
+        return ContentRange(content[offset:end], len(content))
+
+    def query_article_by_article_id(
+        self, article_ids: List[str], desc: bool, fields: Optional[List[str]] = None
+    ) -> Dict[str, Dict[str, str]]:
         """Queries by article ids on article table. Creates base articles_dict to attach article attributes to.
+        Only the article attributes listed in fields are returned, all of them by default.
+        Large id sets are queried in chunks (see query_in_chunks).
         Returns a dictionary mapping article id to an article dict containing article attributes and values."""
-        with self.session_manager() as session:
-            articles = (
-                session.query(
+        if fields is None:
+            fields = ["headline", "published_time", "publisher_timezone", "article_content"]
+
+        def query_chunk(chunk: List[str]) -> List[Any]:
+            with self.read_session_manager() as session:
+                articles = session.query(
                     Article.article_id,
-                    Article.headline,
-                    Article.published_time,
-                    Article.publisher_timezone,
-                    Article.article_content,
-                )
-                .filter(Article.article_id.in_(article_ids))
-            )
-            if desc:
-                articles = articles.order_by(Article.published_time.desc())
-            else:
-                articles = articles.order_by(Article.published_time.asc())
-            articles.all()
+                    *[getattr(Article, field) for field in fields],
+                ).filter(self.id_criterion(Article.article_id, chunk))
+                if desc:
+                    articles = articles.order_by(Article.published_time.desc())
+                else:
+                    articles = articles.order_by(Article.published_time.asc())
+                return articles.all()
+
+        articles = self.query_in_chunks(list(article_ids), query_chunk)
+        if len(article_ids) > self.id_chunk_size and "published_time" in fields:
+            # Chunks are each ordered, merges them
+            articles.sort(key=lambda article: article.published_time, reverse=desc)
 
         # Dictionary of article ids mapped to article dict object
         # i.e. { article_id: { article_id: abc123, headline: headline1, ... } }
         articles_dict = OrderedDict()
         for article in articles:
             articles_dict[article.article_id] = article._asdict()
-        self.logger.debug("articles_dict: ", articles_dict)
+        if "article_content" in fields:
+            self.fill_contents(list(articles_dict.values()))
+        self.logger.debug("articles_dict: %s", articles_dict)
         return articles_dict
 
     def query_entities_by_article_id(self, article_ids: List[str]) -> Dict[str, Dict[str, List[str]]]:
         """Queries by article ids on entities table. Pulls all entities belonging to articles corresponding to
         search criteria. Maps entities and entity values to their associated article id in a dict.
         Returns a dictionary mapping article id to a dict of entities mapped to a list of their values."""
-        with self.session_manager() as session:
-            entities = (
-                session.query(
-                    Entity.article_id,
-                    Entity.entity,
-                    Entity.entity_value
-                    )
-                .filter(Entity.article_id.in_(article_ids))
-                .all()
-            )
+
+        def query_chunk(chunk: List[str]) -> List[Any]:
+            with self.read_session_manager() as session:
+                return (
+                    session.query(Entity.article_id, Entity.entity, Entity.entity_value)
+                    .filter(self.id_criterion(Entity.article_id, chunk))
+                    .all()
+                )
+
+        entities = self.query_in_chunks(list(article_ids), query_chunk)
         # Dictionary of article ids mapped to entities mapped to entity values
         # i.e. { article_id: { entity1: [entity_values], entity2: [entity_values, ...] } }
         entities_dict = {}
@@ -137,32 +293,33 @@ class DatabaseUtilities(EngineUtilities):
                 else:
                     article_entities[entity.entity] = [entity.entity_value]
             else:
-                entities_dict = {entity.article_id: {entity.entity: [entity.entity_value]}}
-        self.logger.debug("entities_dict: ", entities_dict)
+                entities_dict[entity.article_id] = {entity.entity: [entity.entity_value]}
+        self.logger.debug("entities_dict: %s", entities_dict)
         return entities_dict
 
     def query_tag_by_article_id(self, article_ids: List[str]) -> Dict[str, List[str]]:
         """Queries by article id on tags table. Pulls all tags associated with an article.
         Returns a dictionary mapping an article id with a list of its tags."""
-        with self.session_manager() as session:
-            tags = (
-                session.query(
-                    Tag.article_id,
-                    Tag.tag
-                    )
-                .filter(Tag.article_id.in_(article_ids))
-                .all()
-            )
-            # Dictionary of article ids mapped to tag dicts mapped to the tag value
-            # i.e. { article_id: [tag1, tag2, ...] }
-            tags_dict = {}
-            for tag in tags:
-                article_tags = tags_dict.get(tag.article_id)
-                if article_tags:
-                    article_tags.append(tag.tag)
-                else:
-                    tags_dict = {tag.article_id: [tag.tag]}
-        self.logger.debug("tags_dict: ", tags_dict)
+
+        def query_chunk(chunk: List[str]) -> List[Any]:
+            with self.read_session_manager() as session:
+                return (
+                    session.query(Tag.article_id, Tag.tag)
+                    .filter(self.id_criterion(Tag.article_id, chunk))
+                    .all()
+                )
+
+        tags = self.query_in_chunks(list(article_ids), query_chunk)
+        # Dictionary of article ids mapped to tag dicts mapped to the tag value
+        # i.e. { article_id: [tag1, tag2, ...] }
+        tags_dict = {}
+        for tag in tags:
+            article_tags = tags_dict.get(tag.article_id)
+            if article_tags:
+                article_tags.append(tag.tag)
+            else:
+                tags_dict[tag.article_id] = [tag.tag]
+        self.logger.debug("tags_dict: %s", tags_dict)
         return tags_dict
 
     def insert_tags(self, tags: List[Dict[str, str]]) -> None:
@@ -170,3 +327,123 @@ class DatabaseUtilities(EngineUtilities):
         with self.session_manager() as session:
             session.bulk_insert_mappings(Tag, tags)
         return
+
+    def query_existing_article_ids(
+        self, article_ids: List[str], batch_size: int = 1000
+    ) -> Set[str]:
+        """Looks up which of the given article ids exist in the articles table, batch_size ids
+        at a time on a single session. Returns the set of existing article ids."""
+        existing = set()
+        with self.session_manager() as session:
+            for start in range(0, len(article_ids), batch_size):
+                articles = session.execute(
+                    select(Article.article_id).where(
+                        Article.article_id.in_(article_ids[start : start + batch_size])
+                    )
+                ).all()
+                existing.update(article.article_id for article in articles)
+        return existing
+
+    def upsert_tags(
+        self, tags: List[Dict[str, str]], on_duplicate: str = "ignore"
+    ) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Inserts tags in a single multi-row statement and transaction, skipping
+        (on_duplicate="ignore") or refreshing (on_duplicate="update") tags an article already has.
+        Returns the list of inserted tags and the list of already existing tags."""
+        with self.session_manager() as session:
+            pairs = [(tag["article_id"], tag["tag"]) for tag in tags]
+            existing_pairs = set(
+                session.execute(
+                    select(Tag.article_id, Tag.tag).where(
+                        tuple_(Tag.article_id, Tag.tag).in_(pairs)
+                    )
+                ).all()
+            )
+            if self.engine.dialect.name == "sqlite":
+                statement = sqlite_insert(Tag).values(tags)
+                if on_duplicate == "update":
+                    statement = statement.on_conflict_do_update(
+                        index_elements=[Tag.article_id, Tag.tag],
+                        set_={"tagged_by": statement.excluded.tagged_by, "tagged_at": func.now()},
+                    )
+                else:
+                    statement = statement.on_conflict_do_nothing()
+            else:
+                statement = mysql_insert(Tag).values(tags)
+                if on_duplicate == "update":
+                    statement = statement.on_duplicate_key_update(
+                        tagged_by=statement.inserted.tagged_by, tagged_at=func.now()
+                    )
+                else:
+                    statement = statement.prefix_with("IGNORE")
+            session.execute(statement)
+        inserted = [tag for tag in tags if (tag["article_id"], tag["tag"]) not in existing_pairs]
+        existing = [tag for tag in tags if (tag["article_id"], tag["tag"]) in existing_pairs]
+        return inserted, existing
+
+    def upsert_articles(self, articles: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+        """Inserts articles in a single multi-row statement and transaction, replacing the
+        attributes of articles which already exist. Contents go to the content store, if any.
+        Returns the list of inserted article ids and the list of updated article ids."""
+        article_ids = [article["article_id"] for article in articles]
+        if self.content_store is not None:
+            contents = {
+                article["article_id"]: article.get("article_content") for article in articles
+            }
+            articles = [{**article, "article_content": None} for article in articles]
+        updated_columns = [
+            "headline",
+            "published_time",
+            "publisher_timezone",
+            "article_content",
+            "updated_by",
+        ]
+        with self.session_manager() as session:
+            existing_ids = set(
+                session.execute(
+                    select(Article.article_id).where(Article.article_id.in_(article_ids))
+                ).scalars()
+            )
+            if self.engine.dialect.name == "sqlite":
+                statement = sqlite_insert(Article).values(articles)
+                updates = {column: statement.excluded[column] for column in updated_columns}
+                statement = statement.on_conflict_do_update(
+                    index_elements=[Article.article_id], set_={**updates, "updated_at": func.now()}
+                )
+            else:
+                statement = mysql_insert(Article).values(articles)
+                updates = {column: statement.inserted[column] for column in updated_columns}
+                statement = statement.on_duplicate_key_update(**updates, updated_at=func.now())
+            session.execute(statement)
+            if self.content_store is not None:
+                # Written in the transaction of the articles by the table store
+                self.content_store.put_many(contents, session)
+        inserted = [article_id for article_id in article_ids if article_id not in existing_ids]
+        updated = [article_id for article_id in article_ids if article_id in existing_ids]
+        return inserted, updated
+
+    def insert_entities(
+        self, entities: List[Dict[str, str]]
+    ) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Inserts entities in a single multi-row statement and transaction, skipping the
+        (article_id, entity, entity_value) mappings which already exist.
+        Returns the list of inserted entities and the list of already existing entities."""
+
+        def key(entity: Dict[str, str]) -> Tuple[str, str, str]:
+            return (entity["article_id"], entity["entity"], entity["entity_value"])
+
+        with self.session_manager() as session:
+            existing_keys = set(
+                session.execute(
+                    select(Entity.article_id, Entity.entity, Entity.entity_value).where(
+                        tuple_(Entity.article_id, Entity.entity, Entity.entity_value).in_(
+                            [key(entity) for entity in entities]
+                        )
+                    )
+                ).all()
+            )
+            inserted = [entity for entity in entities if key(entity) not in existing_keys]
+            if inserted:
+                session.execute(insert(Entity).values(inserted))
+        existing = [entity for entity in entities if key(entity) in existing_keys]
+        return inserted, existing
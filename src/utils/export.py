@@ -0,0 +1,325 @@
+import argparse
+from datetime import datetime, timedelta
+import io
+import json
+import logging
+import os
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+from sqlalchemy import DateTime, Integer, Text, func, select
+
+from models.db_models import Article, Entity, Tag
+from utils.database_utilities import DatabaseUtilities
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+EXPORT_FORMATS = ("arrow", "parquet")
+# Exported tables mapped to their model and the column incremental exports are bounded on
+EXPORT_TABLES = {
+    "articles": (Article, "updated_at"),
+    "entities": (Entity, "updated_at"),
+    "tags": (Tag, "tagged_at"),
+}
+# Columns holding few distinct values, stored dictionary-encoded
+DICTIONARY_COLUMNS = {
+    "publisher_timezone",
+    "updated_by",
+    "entity",
+    "entity_value",
+    "tag",
+    "tagged_by",
+}
+MANIFEST = "export_manifest.json"
+
+
+def check_pyarrow() -> None:
+    """Raises RuntimeError if pyarrow, an optional dependency needed for exports, is missing."""
+    if pa is None:
+        raise RuntimeError("Exports need pyarrow, install it with pip install pyarrow")
+    return
+
+
+def arrow_type(column: Any) -> Any:
+    """Maps a table column to its Arrow type."""
+    if column.name in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    # Columns with dialect variants, i.e. LONGTEXT on MySQL, wrap their generic type
+    column_type = getattr(column.type, "impl", column.type)
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("s")
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Text):
+        return pa.large_string()
+    return pa.string()
+
+
+class DictionaryEncoder:
+    """Dictionary-encodes a column across record batches. The dictionary only grows, every batch
+    extending the dictionary of the previous one, so Arrow IPC files hold dictionary deltas
+    instead of replacements (which the file format does not support)."""
+
+    def __init__(self) -> None:
+        self.indices: Dict[str, int] = {}
+        # Kept as an Arrow array, only the values new to a batch are converted and appended
+        self.dictionary = pa.array([], pa.string())
+
+    def encode(self, values: List[Optional[str]]) -> Any:
+        indices = []
+        new_values = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            index = self.indices.get(value)
+            if index is None:
+                index = len(self.indices)
+                self.indices[value] = index
+                new_values.append(value)
+            indices.append(index)
+        if new_values:
+            self.dictionary = pa.concat_arrays(
+                [self.dictionary, pa.array(new_values, pa.string())]
+            )
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), self.dictionary)
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file object buffering what is written until drained, to stream files written
+    by Arrow and Parquet writers."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class Exporter:
+    """Exports the articles, entities and tags tables to columnar files, Arrow IPC (which can be
+    memory-mapped) or Parquet, batch_size rows at a time so memory stays bounded. Rows are read
+    from a server-side cursor on a read replica when one is configured.
+
+    Incremental exports only hold the rows written in [since, until), until being the database
+    time at the start of the export minus the maximum replica lag and commit_lag seconds. Rows are
+    stamped when written but only visible once their transaction commits, so rows committed up to
+    commit_lag seconds after their timestamp still fall in the next window. Deleted rows are not
+    exported."""
+
+    def __init__(
+        self, db_utils: DatabaseUtilities, directory: str = "exports", commit_lag: float = 60.0
+    ) -> None:
+        self.db_utils = db_utils
+        self.directory = directory
+        self.commit_lag = commit_lag
+        self.logger = logging.getLogger("ExporterLogs")
+
+    @staticmethod
+    def schema(table: str) -> Any:
+        model, _ = EXPORT_TABLES[table]
+        return pa.schema(
+            [pa.field(column.name, arrow_type(column)) for column in model.__table__.columns]
+        )
+
+    def watermark(self) -> datetime:
+        """Returns the upper bound of an export started now. Rows older than the maximum replica
+        lag are on every replica in the read rotation, and rows older than commit_lag are
+        committed."""
+        with self.db_utils.session_manager() as session:
+            now = session.execute(select(func.now())).scalar()
+        now -= timedelta(seconds=self.commit_lag)
+        if self.db_utils.replica_engines:
+            now -= timedelta(seconds=self.db_utils.max_replica_lag)
+        return now.replace(microsecond=0)
+
+    def batches(
+        self,
+        table: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 5000,
+    ) -> Iterator[Any]:
+        """Yields the rows of a table written in [since, until) as Arrow record batches."""
+        model, timestamp = EXPORT_TABLES[table]
+        columns = list(model.__table__.columns)
+        statement = select(*columns)
+        if since is not None:
+            statement = statement.where(getattr(model, timestamp) >= since)
+        if until is not None:
+            statement = statement.where(getattr(model, timestamp) < until)
+        schema = self.schema(table)
+        encoders = {
+            column.name: DictionaryEncoder()
+            for column in columns
+            if column.name in DICTIONARY_COLUMNS
+        }
+        with self.db_utils.read_session_manager() as session:
+            result = session.execute(statement, execution_options={"stream_results": True})
+            for partition in result.partitions(batch_size):
+                if table == "articles" and self.db_utils.content_store is not None:
+                    # Content moved out of the articles rows is exported from the content store
+                    articles = [article._asdict() for article in partition]
+                    self.db_utils.fill_contents(articles)
+                    partition = [
+                        [article[column.name] for column in columns] for article in articles
+                    ]
+                arrays = []
+                for position, column in enumerate(columns):
+                    values = [row[position] for row in partition]
+                    if column.name in encoders:
+                        arrays.append(encoders[column.name].encode(values))
+                    else:
+                        arrays.append(pa.array(values, schema.field(column.name).type))
+                yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def write(
+        self,
+        table: str,
+        sink: BinaryIO,
+        file_format: str = "arrow",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 5000,
+    ) -> Iterator[int]:
+        """Writes the rows of a table written in [since, until) to sink as an Arrow IPC or Parquet
+        file. Yields the number of rows written so far after every batch, the file being complete
+        once exhausted."""
+        check_pyarrow()
+        schema = self.schema(table)
+        if file_format == "parquet":
+            writer = pq.ParquetWriter(sink, schema)
+
+            def write_batch(batch: Any) -> None:
+                writer.write_table(pa.Table.from_batches([batch]))
+
+        else:
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            writer = pa.ipc.new_file(sink, schema, options=options)
+            write_batch = writer.write_batch
+        rows = 0
+        try:
+            for batch in self.batches(table, since, until, batch_size):
+                write_batch(batch)
+                rows += batch.num_rows
+                yield rows
+        finally:
+            writer.close()
+
+    def stream(
+        self,
+        table: str,
+        file_format: str = "arrow",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 5000,
+    ) -> Iterator[bytes]:
+        """Yields an export file of a table as chunks of bytes, one per batch."""
+        sink = ChunkSink()
+        for _ in self.write(table, sink, file_format, since, until, batch_size):
+            yield sink.drain()
+        yield sink.drain()
+
+    def load_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {"watermarks": {}, "exports": []}
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+
+    def export(
+        self,
+        tables: List[str],
+        file_format: str = "arrow",
+        incremental: bool = False,
+        batch_size: int = 5000,
+    ) -> Dict[str, Any]:
+        """Exports tables to files of the export directory. Incremental exports only hold the rows
+        written since the watermark of the previous export of each table, recorded in the
+        manifest of the directory.
+        Returns the manifest entry of the export, listing the file and row count of every
+        table."""
+        check_pyarrow()
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.load_manifest()
+        until = self.watermark()
+        entry = {"until": until.isoformat(), "format": file_format, "tables": {}}
+        for table in tables:
+            since = None
+            if incremental and table in manifest["watermarks"]:
+                since = datetime.fromisoformat(manifest["watermarks"][table])
+            name = f"{table}-{until:%Y%m%dT%H%M%S}.{file_format}"
+            path = os.path.join(self.directory, name)
+            rows = 0
+            # Written under a temporary name, so readers never see a partial file
+            with open(path + ".tmp", "wb") as export_file:
+                for rows in self.write(table, export_file, file_format, since, until, batch_size):
+                    self.logger.info(f"{rows} rows of {table} exported.")
+            os.replace(path + ".tmp", path)
+            entry["tables"][table] = {
+                "file": name,
+                "rows": rows,
+                "since": since.isoformat() if since else None,
+            }
+            manifest["watermarks"][table] = until.isoformat()
+        manifest["exports"].append(entry)
+        with open(os.path.join(self.directory, MANIFEST), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        return entry
+
+
+if __name__ == "__main__":
+    # EXPORTS TABLES TO COLUMNAR FILES, RUN FROM THE SRC FOLDER
+    # Ex: python -m utils.export --directory exports --format parquet --incremental
+    from utils.init_logger import init_logger
+
+    parser = argparse.ArgumentParser(description="Exports tables to Arrow IPC or Parquet files.")
+    parser.add_argument("--directory", default="exports")
+    parser.add_argument("--tables", default=",".join(EXPORT_TABLES))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="arrow")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only exports rows written since the previous export to the directory",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--commit-lag",
+        type=float,
+        default=60.0,
+        help="Seconds a transaction may take to commit, rows this recent wait for the next export",
+    )
+    args = parser.parse_args()
+    tables = args.tables.split(",")
+    unknown = [table for table in tables if table not in EXPORT_TABLES]
+    if unknown:
+        parser.error(f"Unknown tables: {unknown}")
+    init_logger()
+    exporter = Exporter(
+        DatabaseUtilities(
+            host=os.getenv("DATABASE_CONTAINER"), database=os.getenv("MYSQL_DATABASE")
+        ),
+        args.directory,
+        args.commit_lag,
+    )
+    print(json.dumps(exporter.export(tables, args.format, args.incremental, args.batch_size)))
@@ -0,0 +1,210 @@
+from collections import Counter
+import heapq
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select
+
+from models.db_models import Article, Entity, Tag
+from utils.database_utilities import DatabaseUtilities
+from utils.request_parser import parse_article_filters, parse_limit
+from utils.search_engine import SearchEngine
+
+
+def tag_counts_statement(matched: Optional[Any] = None, facet_limit: Optional[int] = None) -> Any:
+    """Builds the statement counting articles by tag, restricted to the article ids of the matched
+    subquery if given. Rows are (value, article_count) by descending count, at most facet_limit
+    of them."""
+    # Not labelled count, which rows already have as a tuple method
+    count = func.count().label("article_count")
+    statement = select(Tag.tag.label("value"), count)
+    if matched is not None:
+        statement = statement.join(matched, Tag.article_id == matched.c.article_id)
+    statement = statement.group_by(Tag.tag)
+    if facet_limit is not None:
+        statement = statement.order_by(count.desc(), Tag.tag).limit(facet_limit)
+    return statement
+
+
+def entity_counts_statement(
+    matched: Optional[Any] = None, facet_limit: Optional[int] = None
+) -> Any:
+    """Builds the statement counting articles by entity and entity value, restricted to the
+    article ids of the matched subquery if given. Rows are (entity, value, article_count), at most
+    facet_limit of them per entity ranked by descending count."""
+    columns = [
+        Entity.entity,
+        Entity.entity_value.label("value"),
+        func.count().label("article_count"),
+    ]
+    if facet_limit is not None:
+        columns.append(
+            func.row_number()
+            .over(partition_by=Entity.entity, order_by=(func.count().desc(), Entity.entity_value))
+            .label("facet_rank")
+        )
+    statement = select(*columns)
+    if matched is not None:
+        statement = statement.join(matched, Entity.article_id == matched.c.article_id)
+    statement = statement.group_by(Entity.entity, Entity.entity_value)
+    if facet_limit is None:
+        return statement
+    # Window functions cannot be filtered on in the query computing them
+    ranked = statement.subquery("entity_counts")
+    return (
+        select(ranked.c.entity, ranked.c.value, ranked.c.article_count)
+        .where(ranked.c.facet_rank <= facet_limit)
+        .order_by(ranked.c.entity, ranked.c.facet_rank)
+    )
+
+
+def top_counts(counts: Dict[str, int], facet_limit: int) -> List[Dict[str, Any]]:
+    """Returns the facet_limit largest counts as {"value", "count"} dicts, ties broken on value."""
+    top = heapq.nsmallest(facet_limit, counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{"value": value, "count": count} for value, count in top]
+
+
+def format_facets(
+    total: int,
+    tag_counts: Dict[str, int],
+    entity_counts: Dict[str, Dict[str, int]],
+    facet_limit: int,
+) -> Dict[str, Any]:
+    """Builds the facets response from full counts, keeping the top facet_limit of each facet."""
+    return {
+        "total": total,
+        "tags": top_counts(tag_counts, facet_limit),
+        "entity": {
+            entity: top_counts(values, facet_limit) for entity, values in entity_counts.items()
+        },
+    }
+
+
+def format_rows(total: int, tag_rows: Iterable[Any], entity_rows: Iterable[Any]) -> Dict[str, Any]:
+    """Builds the facets response from rows of statements already limited to the top counts."""
+    entity_facets: Dict[str, List[Dict[str, Any]]] = {}
+    for row in entity_rows:
+        entity_facets.setdefault(row.entity, []).append(
+            {"value": row.value, "count": row.article_count}
+        )
+    return {
+        "total": total,
+        "tags": [{"value": row.value, "count": row.article_count} for row in tag_rows],
+        "entity": entity_facets,
+    }
+
+
+class GlobalFacets:
+    """Cached tag and entity value counts over all articles. Built with grouped queries, kept
+    up to date as rows are inserted through the API with add_tags, add_entities and add_articles,
+    and rebuilt periodically with build to pick up other changes."""
+
+    def __init__(self, db_utils: DatabaseUtilities) -> None:
+        self.db_utils = db_utils
+        self.logger = logging.getLogger("GlobalFacetsLogs")
+        self.lock = threading.Lock()
+        self.total = 0
+        self.tag_counts: Counter = Counter()
+        self.entity_counts: Dict[str, Counter] = {}
+
+    def build(self) -> None:
+        """Counts articles, tags and entity values in the database."""
+        with self.db_utils.session_manager() as session:
+            total = session.execute(select(func.count()).select_from(Article)).scalar()
+            tag_rows = session.execute(tag_counts_statement()).all()
+            entity_rows = session.execute(entity_counts_statement()).all()
+        tag_counts = Counter({row.value: row.article_count for row in tag_rows})
+        entity_counts: Dict[str, Counter] = {}
+        for row in entity_rows:
+            entity_counts.setdefault(row.entity, Counter())[row.value] = row.article_count
+        with self.lock:
+            self.total = total
+            self.tag_counts = tag_counts
+            self.entity_counts = entity_counts
+        self.logger.info(f"Global facets built with {len(tag_counts)} tags.")
+        return
+
+    def add_tags(self, tags: List[Dict[str, str]]) -> None:
+        """Counts newly inserted tag mappings."""
+        with self.lock:
+            self.tag_counts.update(tag["tag"] for tag in tags)
+        return
+
+    def add_entities(self, entities: List[Dict[str, str]]) -> None:
+        """Counts newly inserted entity mappings."""
+        with self.lock:
+            for entity in entities:
+                values = self.entity_counts.setdefault(entity["entity"], Counter())
+                values[entity["entity_value"]] += 1
+        return
+
+    def add_articles(self, inserted: int) -> None:
+        """Counts newly inserted articles."""
+        with self.lock:
+            self.total += inserted
+        return
+
+    def top(self, facet_limit: int) -> Dict[str, Any]:
+        """Returns the top facet_limit tags and values of every entity over all articles."""
+        with self.lock:
+            return format_facets(self.total, self.tag_counts, self.entity_counts, facet_limit)
+
+
+class FacetEngine:
+    """Counts tags and entity values over the articles matching a search, without fetching any
+    article row. Tag and entity only searches are counted from the filter index bitmaps when one
+    is configured, other searches with grouped queries joined on the search match statement.
+    Searches without criteria are answered from the cached global facets when available."""
+
+    def __init__(
+        self, search_engine: SearchEngine, global_facets: Optional[GlobalFacets] = None
+    ) -> None:
+        self.search_engine = search_engine
+        self.db_utils = search_engine.db_utils
+        self.global_facets = global_facets
+        self.logger = logging.getLogger("FacetEngineLogs")
+
+    def facets(self, searched: Dict[str, Any], facet_limit: int = 10) -> Dict[str, Any]:
+        """Returns the number of matching articles under "total", and the top facet_limit tags
+        and values of every entity by number of matching articles under "tags" and "entity".
+        Raises ValueError on malformed published times or an invalid limit."""
+        limit = parse_limit(searched)
+        filter_index = self.search_engine.filter_index
+        if filter_index is not None and self._filter_only(searched, limit):
+            matched = filter_index.match(searched)
+            tag_counts, entity_counts = filter_index.count_facets(matched)
+            return format_facets(len(matched), tag_counts, entity_counts, facet_limit)
+
+        criteria = self.search_engine.build_criteria(searched)
+        if criteria is None:
+            return format_rows(0, [], [])
+        if not criteria and self.global_facets is not None:
+            return self.global_facets.top(facet_limit)
+
+        matched = None
+        if criteria:
+            matched = self.search_engine.build_match_statement(criteria, searched, limit)
+            matched = matched.subquery("matched")
+        with self.db_utils.read_session_manager() as session:
+            if matched is None:
+                total_statement = select(func.count()).select_from(Article)
+            else:
+                total_statement = select(func.count()).select_from(matched)
+            total = session.execute(total_statement).scalar()
+            tag_rows, entity_rows = [], []
+            if total:
+                tag_rows = session.execute(tag_counts_statement(matched, facet_limit)).all()
+                entity_rows = session.execute(entity_counts_statement(matched, facet_limit)).all()
+        return format_rows(total, tag_rows, entity_rows)
+
+    @staticmethod
+    def _filter_only(searched: Dict[str, Any], limit: Optional[int]) -> bool:
+        """Whether the search only has tag and entity criteria."""
+        has_filters = bool(searched.get("tag") or searched.get("entity"))
+        return (
+            has_filters
+            and limit is None
+            and not searched.get("text")
+            and not parse_article_filters(searched)
+        )
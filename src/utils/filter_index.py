@@ -0,0 +1,217 @@
+from datetime import datetime
+import logging
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from models.db_models import Entity, Tag
+from utils.database_utilities import DatabaseUtilities
+
+
+CHUNK_BITS = 16
+
+
+class Bitmap:
+    """Compressed bitmap of article ordinals in the spirit of roaring bitmaps. Ordinals are split
+    into chunks of 2^16 by their high bits, and each non-empty chunk is stored as a Python int
+    bitset. Empty chunks take no space, and AND/OR run chunk by chunk as native int operations."""
+
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks: Optional[Dict[int, int]] = None) -> None:
+        self.chunks = chunks if chunks is not None else {}
+
+    def add(self, ordinal: int) -> None:
+        key = ordinal >> CHUNK_BITS
+        self.chunks[key] = self.chunks.get(key, 0) | (1 << (ordinal & ((1 << CHUNK_BITS) - 1)))
+        return
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        if len(other.chunks) < len(self.chunks):
+            return other & self
+        chunks = {}
+        for key, bits in self.chunks.items():
+            common = bits & other.chunks.get(key, 0)
+            if common:
+                chunks[key] = common
+        return Bitmap(chunks)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        chunks = dict(self.chunks)
+        for key, bits in other.chunks.items():
+            chunks[key] = chunks.get(key, 0) | bits
+        return Bitmap(chunks)
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def __len__(self) -> int:
+        return sum(bin(bits).count("1") for bits in self.chunks.values())
+
+    def __iter__(self) -> Iterator[int]:
+        for key in sorted(self.chunks):
+            base = key << CHUNK_BITS
+            bits = self.chunks[key]
+            while bits:
+                lowest = bits & -bits
+                yield base + lowest.bit_length() - 1
+                bits ^= lowest
+
+    @classmethod
+    def union(cls, bitmaps: Iterable["Bitmap"]) -> "Bitmap":
+        result = cls()
+        for bitmap in bitmaps:
+            result = result | bitmap
+        return result
+
+
+class FilterIndex:
+    """In-memory index answering tag and entity search criteria without querying the database.
+    Articles are mapped to dense integer ordinals, with one bitmap per tag and one per
+    (entity, entity_value) pair. Warmed with build and kept fresh with refresh, which polls
+    tags.tagged_at and entities.updated_at for rows written since the last build/refresh, the
+    watermarks staying the commit lag of db_utils behind to pick up late commits."""
+
+    def __init__(self, db_utils: DatabaseUtilities) -> None:
+        self.db_utils = db_utils
+        self.logger = logging.getLogger("FilterIndexLogs")
+        self.lock = threading.RLock()
+        self.ordinals: Dict[str, int] = {}
+        self.article_ids: List[str] = []
+        self.tag_bitmaps: Dict[str, Bitmap] = {}
+        self.entity_bitmaps: Dict[Tuple[str, str], Bitmap] = {}
+        self.tags_watermark: Optional[datetime] = None
+        self.entities_watermark: Optional[datetime] = None
+
+    def ordinal(self, article_id: str) -> int:
+        """Returns the ordinal of an article, assigning the next one if it is not yet indexed."""
+        ordinal = self.ordinals.get(article_id)
+        if ordinal is None:
+            ordinal = len(self.article_ids)
+            self.ordinals[article_id] = ordinal
+            self.article_ids.append(article_id)
+        return ordinal
+
+    def add_tags(self, tags: List[Dict[str, Any]]) -> None:
+        """Indexes tag mappings containing "article_id" and "tag" keys."""
+        with self.lock:
+            for tag in tags:
+                bitmap = self.tag_bitmaps.setdefault(tag["tag"], Bitmap())
+                bitmap.add(self.ordinal(tag["article_id"]))
+        return
+
+    def add_entities(self, entities: List[Dict[str, Any]]) -> None:
+        """Indexes entity mappings containing "article_id", "entity" and "entity_value" keys."""
+        with self.lock:
+            for entity in entities:
+                key = (entity["entity"], entity["entity_value"])
+                bitmap = self.entity_bitmaps.setdefault(key, Bitmap())
+                bitmap.add(self.ordinal(entity["article_id"]))
+        return
+
+    def build(self) -> None:
+        """Indexes every row of the tags and entities tables."""
+        self.refresh()
+        self.logger.info(
+            f"Filter index built with {len(self.article_ids)} articles, "
+            f"{len(self.tag_bitmaps)} tags and {len(self.entity_bitmaps)} entity values."
+        )
+        return
+
+    def refresh(self) -> None:
+        """Indexes tags and entities written since the last build or refresh. Bounds are
+        inclusive since timestamps have a one second resolution, re-indexing a row is a no-op."""
+        tags_statement = select(Tag.article_id, Tag.tag, Tag.tagged_at)
+        if self.tags_watermark is not None:
+            tags_statement = tags_statement.where(Tag.tagged_at >= self.tags_watermark)
+        entities_statement = select(
+            Entity.article_id, Entity.entity, Entity.entity_value, Entity.updated_at
+        )
+        if self.entities_watermark is not None:
+            entities_statement = entities_statement.where(
+                Entity.updated_at >= self.entities_watermark
+            )
+
+        with self.db_utils.session_manager() as session:
+            tags = session.execute(tags_statement).all()
+            entities = session.execute(entities_statement).all()
+            if tags:
+                tags_watermark = self.db_utils.lagged_watermark(
+                    session, max(tag.tagged_at for tag in tags)
+                )
+            if entities:
+                entities_watermark = self.db_utils.lagged_watermark(
+                    session, max(entity.updated_at for entity in entities)
+                )
+
+        self.add_tags([tag._asdict() for tag in tags])
+        self.add_entities([entity._asdict() for entity in entities])
+        if tags:
+            self.tags_watermark = tags_watermark
+        if entities:
+            self.entities_watermark = entities_watermark
+        return
+
+    def match(self, searched: Dict[str, Any]) -> Optional[Bitmap]:
+        """Evaluates the tag and entity criteria of a search. Articles must have any of the
+        searched tags, and for every searched entity any of its searched values.
+        Returns None if the search has no tag or entity criteria."""
+        tags = searched.get("tag")
+        entities = searched.get("entity") or {}
+        if not tags and not entities:
+            return None
+
+        with self.lock:
+            criteria = []
+            if tags:
+                criteria.append(
+                    Bitmap.union(self.tag_bitmaps[tag] for tag in tags if tag in self.tag_bitmaps)
+                )
+            for entity, entity_values in entities.items():
+                criteria.append(
+                    Bitmap.union(
+                        self.entity_bitmaps[(entity, entity_value)]
+                        for entity_value in entity_values
+                        if (entity, entity_value) in self.entity_bitmaps
+                    )
+                )
+
+            # Intersect smallest bitmaps first so intermediate results stay small
+            criteria.sort(key=lambda bitmap: len(bitmap.chunks))
+            matched = criteria[0]
+            for bitmap in criteria[1:]:
+                if not matched:
+                    break
+                matched = matched & bitmap
+            return matched
+
+    def count_facets(self, matched: Bitmap) -> Tuple[Dict[str, int], Dict[str, Dict[str, int]]]:
+        """Counts the matched articles having every tag and every entity value, intersecting
+        bitmaps without touching article rows.
+        Returns the non-zero counts by tag, and by entity and entity value."""
+        tag_counts = {}
+        entity_counts: Dict[str, Dict[str, int]] = {}
+        with self.lock:
+            for tag, bitmap in self.tag_bitmaps.items():
+                count = len(matched & bitmap)
+                if count:
+                    tag_counts[tag] = count
+            for (entity, entity_value), bitmap in self.entity_bitmaps.items():
+                count = len(matched & bitmap)
+                if count:
+                    entity_counts.setdefault(entity, {})[entity_value] = count
+        return tag_counts, entity_counts
+
+    def article_ids_for(self, bitmap: Bitmap) -> List[str]:
+        """Maps a bitmap of ordinals back to article ids."""
+        with self.lock:
+            return [self.article_ids[ordinal] for ordinal in bitmap]
+
+    def search(self, searched: Dict[str, Any]) -> Optional[List[str]]:
+        """Returns the ids of articles satisfying the tag and entity criteria of a search, or
+        None if the search has no tag or entity criteria."""
+        matched = self.match(searched)
+        if matched is None:
+            return None
+        return self.article_ids_for(matched)
@@ -0,0 +1,224 @@
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import DateTime
+
+from models.db_models import Article, Entity
+from utils.database_utilities import DatabaseUtilities
+from utils.request_parser import parse_time
+
+
+logger = logging.getLogger("IngestLogs")
+
+# Fields accepted on every NDJSON line, validated against the model columns
+ARTICLE_INGEST_FIELDS = (
+    "article_id",
+    "headline",
+    "published_time",
+    "publisher_timezone",
+    "article_content",
+)
+ENTITY_INGEST_FIELDS = ("article_id", "entity", "entity_value")
+
+
+def iter_lines(stream: Any, max_line_bytes: int) -> Iterator[Tuple[int, Optional[bytes]]]:
+    """Reads a binary stream one line at a time, without reading the whole body in memory.
+    Yields (line number, line) tuples for non blank lines, the line being None when it is longer
+    than max_line_bytes (the rest of it is skipped)."""
+    line_number = 0
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_line_bytes and not line.endswith(b"\n"):
+            # Skips the remainder of the overlong line
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line_bytes)
+            yield line_number, None
+        elif line.strip():
+            yield line_number, line
+
+
+def validate_row(
+    model: Any, fields: Tuple[str, ...], item: Any, audit_column: str, username: str
+) -> Dict[str, Any]:
+    """Validates a decoded NDJSON line against the columns of model: required columns must be
+    given, strings must fit their column and datetimes must be ISO 8601 (converted to naive UTC).
+    Raises ValueError describing the first invalid field.
+    Returns the row to insert, audit_column set to username."""
+    if not isinstance(item, dict):
+        raise ValueError("Line must be a JSON object")
+    unknown = sorted(set(item) - set(fields))
+    if unknown:
+        raise ValueError(f"Unknown fields: {unknown}")
+    row = {}
+    for field in fields:
+        column = model.__table__.columns[field]
+        value = item.get(field)
+        if value is None or value == "":
+            if not column.nullable:
+                raise ValueError(f"Missing {field}")
+            row[field] = None
+            continue
+        if isinstance(column.type, DateTime):
+            value = parse_time(value)
+        elif not isinstance(value, str):
+            raise ValueError(f"{field} must be a string")
+        elif getattr(column.type, "length", None) and len(value) > column.type.length:
+            raise ValueError(f"{field} is longer than {column.type.length} characters")
+        row[field] = value
+    row[audit_column] = username
+    return row
+
+
+def validate_article(item: Any, username: str) -> Dict[str, Any]:
+    return validate_row(Article, ARTICLE_INGEST_FIELDS, item, "updated_by", username)
+
+
+def validate_entity(item: Any, username: str) -> Dict[str, Any]:
+    return validate_row(Entity, ENTITY_INGEST_FIELDS, item, "updated_by", username)
+
+
+class Ingestion:
+    """Ingests an NDJSON stream of rows: every line is decoded and validated as it is read, and
+    valid rows are written batch_size at a time, every batch in its own transaction. A batch is
+    written early once its lines add up to max_batch_bytes, so a batch of long lines (up to
+    INGEST_MAX_LINE_BYTES each) does not hold batch_size of them in memory. Lines failing
+    validation and rows of failed batches are rejected without aborting the ingestion.
+
+    write takes a batch and returns a dictionary mapping outcome (i.e. "inserted") to the rows or
+    keys it applies to, "rejected" listing (row, reason) tuples. on_written is then called with
+    the batch and its outcomes. The summary counts every outcome listed in outcomes. Rows
+    repeated within a batch, by key, are written once (the last wins)."""
+
+    def __init__(
+        self,
+        validate: Callable[[Any], Dict[str, Any]],
+        write: Callable[[List[Dict[str, Any]]], Dict[str, List[Any]]],
+        key: Callable[[Dict[str, Any]], Any],
+        outcomes: Tuple[str, ...] = ("inserted",),
+        batch_size: int = 1000,
+        max_batch_bytes: int = 64 * 1024 * 1024,
+        max_rejected: int = 1000,
+        on_written: Optional[Callable[[List[Dict[str, Any]], Dict[str, List[Any]]], None]] = None,
+    ) -> None:
+        self.validate = validate
+        self.write = write
+        self.key = key
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_rejected = max_rejected
+        self.on_written = on_written
+        self.summary = {"received": 0, "rejected": 0, **dict.fromkeys(outcomes, 0)}
+        # Only the first max_rejected rejections are reported, all of them are counted
+        self.rejected: List[Dict[str, Any]] = []
+
+    def reject(self, line_number: int, reason: str, row: Optional[Dict[str, Any]] = None) -> None:
+        self.summary["rejected"] += 1
+        if len(self.rejected) < self.max_rejected:
+            rejection = {"line": line_number, "reason": reason}
+            if row is not None and "article_id" in row:
+                rejection["article_id"] = row["article_id"]
+            self.rejected.append(rejection)
+        return
+
+    def run(self, lines: Iterable[Tuple[int, Optional[bytes]]]) -> Dict[str, Any]:
+        """Ingests (line number, line) tuples as yielded by iter_lines.
+        Returns the "summary" of counts by outcome and the "rejected" lines with their reason."""
+        batch: Dict[Any, Tuple[int, Dict[str, Any]]] = {}
+        # Bytes of the lines read into the batch, rows replaced by a repeated key included
+        batch_bytes = 0
+        for line_number, line in lines:
+            self.summary["received"] += 1
+            if line is None:
+                self.reject(line_number, "Line too long")
+                continue
+            try:
+                row = self.validate(json.loads(line))
+            except ValueError as error:
+                # JSON decoding errors are ValueErrors too
+                self.reject(line_number, str(error))
+                continue
+            batch.pop(self.key(row), None)
+            batch[self.key(row)] = (line_number, row)
+            batch_bytes += len(line)
+            if len(batch) >= self.batch_size or batch_bytes >= self.max_batch_bytes:
+                self.flush(batch)
+                batch = {}
+                batch_bytes = 0
+        if batch:
+            self.flush(batch)
+        return {"summary": self.summary, "rejected": self.rejected}
+
+    def flush(self, batch: Dict[Any, Tuple[int, Dict[str, Any]]]) -> None:
+        rows = [row for _, row in batch.values()]
+        try:
+            outcomes = self.write(rows)
+        except:
+            logger.warning(f"Ingestion batch of {len(rows)} rows failed!", exc_info=True)
+            for line_number, row in batch.values():
+                self.reject(line_number, "Database error", row)
+            return
+        for outcome, applied in outcomes.items():
+            if outcome == "rejected":
+                for row, reason in applied:
+                    self.reject(batch[self.key(row)][0], reason, row)
+            else:
+                self.summary[outcome] += len(applied)
+        if self.on_written is not None:
+            try:
+                self.on_written(rows, outcomes)
+            except:
+                logger.warning("Ingestion hook failed!", exc_info=True)
+        return
+
+
+def write_articles(
+    db_utils: DatabaseUtilities, articles: List[Dict[str, Any]]
+) -> Dict[str, List[Any]]:
+    """Upserts a batch of articles. Returns the inserted and updated article ids."""
+    inserted, updated = db_utils.upsert_articles(articles)
+    return {"inserted": inserted, "updated": updated}
+
+
+def write_entities(
+    db_utils: DatabaseUtilities, entities: List[Dict[str, Any]]
+) -> Dict[str, List[Any]]:
+    """Inserts a batch of entities. Entities of unknown articles are rejected and entities an
+    article already has are skipped. Returns the inserted and skipped entities, and the rejected
+    (entity, reason) tuples."""
+    existing_article_ids = db_utils.query_existing_article_ids(
+        list({entity["article_id"] for entity in entities})
+    )
+    known = [entity for entity in entities if entity["article_id"] in existing_article_ids]
+    rejected = [
+        (entity, "Unknown article_id")
+        for entity in entities
+        if entity["article_id"] not in existing_article_ids
+    ]
+    inserted, skipped = db_utils.insert_entities(known) if known else ([], [])
+    return {"inserted": inserted, "skipped": skipped, "rejected": rejected}
+
+
+def article_ingestion(db_utils: DatabaseUtilities, **kwargs: Any) -> Ingestion:
+    """Builds the ingestion of an NDJSON stream of articles, written by db_utils' user."""
+    return Ingestion(
+        lambda item: validate_article(item, db_utils.username),
+        lambda articles: write_articles(db_utils, articles),
+        key=lambda article: article["article_id"],
+        outcomes=("inserted", "updated"),
+        **kwargs,
+    )
+
+
+def entity_ingestion(db_utils: DatabaseUtilities, **kwargs: Any) -> Ingestion:
+    """Builds the ingestion of an NDJSON stream of entities, written by db_utils' user."""
+    return Ingestion(
+        lambda item: validate_entity(item, db_utils.username),
+        lambda entities: write_entities(db_utils, entities),
+        key=lambda entity: (entity["article_id"], entity["entity"], entity["entity_value"]),
+        outcomes=("inserted", "skipped"),
+        **kwargs,
+    )
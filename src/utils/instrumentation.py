@@ -0,0 +1,351 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask, Response, g, request
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from base_classes.engine_utils import TimedQueuePool
+
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000, 10000, 100000)
+# Slow requests log at most this many statements
+MAX_LOGGED_STATEMENTS = 50
+
+
+class RequestMetrics:
+    """Database and serialization costs accumulated by a single request. Updated under lock,
+    queries by article ids running chunks of a request in parallel threads."""
+
+    def __init__(self, capture_statements: bool) -> None:
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.serialization_time = 0.0
+        self.checkout_wait = 0.0
+        # (compiled SQL, parameters, duration) of the executed statements, for the slow request log
+        self.captured: Optional[List[Tuple[str, Any, float]]] = [] if capture_statements else None
+
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request", default=None)
+
+
+def record_checkout_wait(waited: float) -> None:
+    """Adds a pool checkout wait to the metrics of the current request."""
+    metrics = current_request.get()
+    if metrics is not None:
+        with metrics.lock:
+            metrics.checkout_wait += waited
+    return
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    labels = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + labels + "}"
+
+
+class Counter:
+    """Prometheus counter with labels."""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+        return
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram with labels and fixed bucket upper bounds."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Iterable[float],
+        label_names: Tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        # Maps label values to (per bucket counts, sum, count)
+        self.values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+        return
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        label_names = self.label_names + ("le",)
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+                for bound, bucket_count in zip(bounds, bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(label_names, label_values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Instrumentation:
+    """Records per request SQL statement counts, database time, fetched rows, serialization time
+    and pool checkout wait from SQLAlchemy engine events and Flask request hooks. Exposes them with
+    the connection pool state in the Prometheus text format.
+
+    Requests slower than slow_request_seconds are logged with the SQL they executed."""
+
+    PREFIX = "article_tagger_"
+
+    def __init__(self, slow_request_seconds: Optional[float] = None) -> None:
+        self.logger = logging.getLogger("InstrumentationLogs")
+        self.slow_logger = logging.getLogger("SlowRequestLogs")
+        self.slow_request_seconds = slow_request_seconds
+        self.engines: List[Tuple[str, Any]] = []
+        if record_checkout_wait not in TimedQueuePool.wait_listeners:
+            TimedQueuePool.wait_listeners.append(record_checkout_wait)
+        self.collectors: List[Callable[[], List[str]]] = []
+        labels = ("endpoint",)
+        self.requests = Counter(
+            self.PREFIX + "requests_total", "Requests served.", ("endpoint", "status")
+        )
+        self.latency = Histogram(
+            self.PREFIX + "request_duration_seconds", "Request latency.", TIME_BUCKETS, labels
+        )
+        self.statements = Histogram(
+            self.PREFIX + "db_statements_per_request",
+            "SQL statements executed per request.",
+            COUNT_BUCKETS,
+            labels,
+        )
+        self.db_time = Histogram(
+            self.PREFIX + "db_time_seconds",
+            "Time spent executing SQL statements per request.",
+            TIME_BUCKETS,
+            labels,
+        )
+        self.rows = Histogram(
+            self.PREFIX + "db_rows_per_request",
+            "Rows fetched from buffered cursors per request.",
+            COUNT_BUCKETS,
+            labels,
+        )
+        self.serialization = Histogram(
+            self.PREFIX + "serialization_seconds",
+            "Time spent serializing the response per request.",
+            TIME_BUCKETS,
+            labels,
+        )
+        self.checkout_wait = Histogram(
+            self.PREFIX + "pool_checkout_wait_seconds",
+            "Time spent waiting for pooled connections per request.",
+            TIME_BUCKETS,
+            labels,
+        )
+
+    def instrument_engine(self, engine: Any, name: str = "primary") -> None:
+        """Listens to statement executions on the engine, and reports its pool state under the
+        given pool label."""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        self.engines.append((name, engine))
+        return
+
+    def add_collector(self, collector: Callable[[], List[str]]) -> None:
+        """Adds a function returning extra metric lines in the Prometheus text format."""
+        self.collectors.append(collector)
+        return
+
+    def init_app(self, app: Flask) -> None:
+        """Registers the request hooks and the /metrics endpoint on the application."""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        make_response = app.make_response
+
+        def timed_make_response(rv: Any) -> Response:
+            start = time.perf_counter()
+            response = make_response(rv)
+            metrics = current_request.get()
+            if metrics is not None:
+                with metrics.lock:
+                    metrics.serialization_time += time.perf_counter() - start
+            return response
+
+        # Flask serializes the dictionaries returned by views in make_response
+        app.make_response = timed_make_response
+        app.add_url_rule("/metrics", "metrics", self.metrics_view, methods=["GET"])
+        return
+
+    def _before_cursor_execute(
+        self,
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+        return
+
+    def _after_cursor_execute(
+        self,
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        duration = time.perf_counter() - conn.info["query_start_time"].pop()
+        metrics = current_request.get()
+        if metrics is None:
+            return
+        # Server side cursors (stream_results) have not fetched anything yet, and SQLite reports -1
+        # on selects
+        streamed = context is not None and context.execution_options.get("stream_results", False)
+        fetched = not streamed and cursor.description is not None
+        with metrics.lock:
+            metrics.statements += 1
+            metrics.db_time += duration
+            if fetched and cursor.rowcount > 0:
+                metrics.rows += cursor.rowcount
+            if metrics.captured is not None and len(metrics.captured) < MAX_LOGGED_STATEMENTS:
+                metrics.captured.append((statement, parameters, duration))
+        return
+
+    def _before_request(self) -> None:
+        g.instrumentation_token = current_request.set(
+            RequestMetrics(capture_statements=self.slow_request_seconds is not None)
+        )
+        return
+
+    def _after_request(self, response: Response) -> Response:
+        metrics = current_request.get()
+        if metrics is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        duration = time.perf_counter() - metrics.started
+        self.requests.inc(endpoint, str(response.status_code))
+        self.latency.observe(duration, endpoint)
+        self.statements.observe(metrics.statements, endpoint)
+        self.db_time.observe(metrics.db_time, endpoint)
+        self.rows.observe(metrics.rows, endpoint)
+        self.serialization.observe(metrics.serialization_time, endpoint)
+        self.checkout_wait.observe(metrics.checkout_wait, endpoint)
+        if self.slow_request_seconds is not None and duration >= self.slow_request_seconds:
+            self._log_slow_request(endpoint, duration, metrics)
+        return response
+
+    def _teardown_request(self, error: Optional[BaseException]) -> None:
+        token = g.pop("instrumentation_token", None)
+        if token is not None:
+            current_request.reset(token)
+        return
+
+    def _log_slow_request(self, endpoint: str, duration: float, metrics: RequestMetrics) -> None:
+        lines = [
+            f"Slow request {request.method} {request.full_path} ({endpoint}) took {duration:.3f}s: "
+            f"{metrics.statements} statements, {metrics.db_time:.3f}s in database, "
+            f"{metrics.rows} rows, {metrics.serialization_time:.3f}s serializing, "
+            f"{metrics.checkout_wait:.3f}s waiting for connections."
+        ]
+        for statement, parameters, statement_duration in metrics.captured:
+            lines.append(f"[{statement_duration:.3f}s] {statement} {parameters!r}")
+        if metrics.statements > len(metrics.captured):
+            lines.append(f"... {metrics.statements - len(metrics.captured)} more statements")
+        self.slow_logger.warning("\n".join(lines))
+        return
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text format."""
+        lines = []
+        for metric in (
+            self.requests,
+            self.latency,
+            self.statements,
+            self.db_time,
+            self.rows,
+            self.serialization,
+            self.checkout_wait,
+        ):
+            lines.extend(metric.render())
+        lines.extend(self._render_pools())
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except:
+                self.logger.warning("Metrics collector failed!", exc_info=True)
+        return "\n".join(lines) + "\n"
+
+    def _render_pools(self) -> List[str]:
+        pools = [(name, engine.pool) for name, engine in self.engines]
+        gauges = (
+            ("pool_size", "Configured pool size.", lambda pool: pool.size()),
+            ("pool_checked_out", "Connections checked out.", lambda pool: pool.checkedout()),
+            ("pool_checked_in", "Idle pooled connections.", lambda pool: pool.checkedin()),
+            ("pool_overflow", "Connections opened beyond pool size.", lambda pool: pool.overflow()),
+        )
+        counters = (
+            ("pool_checkouts_total", "Connection checkouts.", "checkouts"),
+            ("pool_waits_total", "Checkouts which found the pool exhausted.", "waits"),
+            ("pool_wait_seconds_total", "Time spent waiting for connections.", "wait_time"),
+        )
+        lines = []
+        for metric, documentation, value in gauges:
+            lines += [f"# HELP {self.PREFIX}{metric} {documentation}"]
+            lines += [f"# TYPE {self.PREFIX}{metric} gauge"]
+            for name, pool in pools:
+                if isinstance(pool, QueuePool):
+                    lines.append(f'{self.PREFIX}{metric}{{pool="{name}"}} {value(pool)}')
+        for metric, documentation, attribute in counters:
+            lines += [f"# HELP {self.PREFIX}{metric} {documentation}"]
+            lines += [f"# TYPE {self.PREFIX}{metric} counter"]
+            for name, pool in pools:
+                if isinstance(pool, TimedQueuePool):
+                    with pool.stats_lock:
+                        lines.append(
+                            f'{self.PREFIX}{metric}{{pool="{name}"}} {getattr(pool, attribute)}'
+                        )
+        return lines
+
+    def metrics_view(self) -> Response:
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,222 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import literal, select, union_all
+
+from models.db_models import Article, Entity, Tag
+from utils.database_utilities import article_criteria
+from utils.request_parser import (
+    ARTICLE_FIELDS,
+    is_desc,
+    parse_article_filters,
+    parse_fields,
+    parse_limit,
+)
+from utils.search_engine import SearchEngine
+from utils.text_index import MySQLFullTextIndex
+
+
+class MultiSearch:
+    """Runs a batch of searches sharing most of their criteria. Every search is broken down into
+    sub-criteria (its article attributes, its tag list, each of its entity value sets and its free
+    text), each distinct sub-criterion is evaluated once for the whole batch and every search
+    intersects the article ids of its sub-criteria. Limited searches are cut down to their first
+    articles by published time in SQL, and the union of the articles to return is then hydrated in
+    a single pass of the query_*_by_article_id queries."""
+
+    def __init__(self, search_engine: SearchEngine) -> None:
+        self.search_engine = search_engine
+        self.db_utils = search_engine.db_utils
+        self.logger = logging.getLogger("MultiSearchLogs")
+
+    @staticmethod
+    def sub_criteria(searched: Dict[str, Any]) -> List[Tuple[Any, ...]]:
+        """Breaks a search down into hashable sub-criteria, equal for equal criteria regardless of
+        value order. Raises ValueError on malformed published times."""
+        keys = []
+        article_filters = parse_article_filters(searched)
+        if article_filters:
+            keys.append(("article", json.dumps(article_filters, sort_keys=True, default=str)))
+        tags = searched.get("tag")
+        if tags:
+            keys.append(("tag", tuple(sorted(set(tags)))))
+        entities = searched.get("entity") or {}
+        for entity, entity_values in sorted(entities.items()):
+            keys.append(("entity", entity, tuple(sorted(set(entity_values)))))
+        text = searched.get("text")
+        if text:
+            keys.append(("text", text))
+        return keys
+
+    def sub_criterion_statement(self, key: Tuple[Any, ...], position: int) -> Optional[Any]:
+        """Builds the statement selecting the article ids of a sub-criterion, tagged with its
+        position. Returns None for sub-criteria answered by in-memory indexes."""
+        criterion = literal(position).label("position")
+        if key[0] == "article":
+            article_filters = json.loads(key[1])
+            # Times were serialized with str, which parse_time reads back
+            return select(criterion, Article.article_id).where(
+                *article_criteria(parse_article_filters(article_filters))
+            )
+        if key[0] == "tag":
+            if self.search_engine.filter_index is not None:
+                return None
+            return select(criterion, Tag.article_id).where(Tag.tag.in_(key[1]))
+        if key[0] == "entity":
+            if self.search_engine.filter_index is not None:
+                return None
+            return select(criterion, Entity.article_id).where(
+                Entity.entity == key[1], Entity.entity_value.in_(key[2])
+            )
+        if not isinstance(self.search_engine.text_index, MySQLFullTextIndex):
+            return None
+        return select(criterion, Article.article_id).where(
+            self.search_engine.text_index.criterion(key[1])
+        )
+
+    def evaluate(self, keys: List[Tuple[Any, ...]]) -> Dict[Tuple[Any, ...], Set[str]]:
+        """Evaluates distinct sub-criteria. Those needing the database run as one UNION ALL
+        statement, the others in memory.
+        Returns a dictionary mapping every sub-criterion to its set of article ids."""
+        matched = {key: set() for key in keys}
+        statements = []
+        for position, key in enumerate(keys):
+            statement = self.sub_criterion_statement(key, position)
+            if statement is not None:
+                statements.append(statement)
+            elif key[0] == "text":
+                matched[key].update(self.search_engine.text_index.search(key[1]))
+            else:
+                filter_index = self.search_engine.filter_index
+                if key[0] == "tag":
+                    matched[key].update(filter_index.search({"tag": list(key[1])}))
+                else:
+                    matched[key].update(filter_index.search({"entity": {key[1]: list(key[2])}}))
+        if statements:
+            statement = statements[0] if len(statements) == 1 else union_all(*statements)
+            with self.db_utils.read_session_manager() as session:
+                rows = session.execute(statement).all()
+            for row in rows:
+                matched[keys[row.position]].add(row.article_id)
+        return matched
+
+    def search(self, searches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Runs a batch of searches. Returns one result per search, in order, holding either the
+        "content" the search would get from search_articles, or an error "message" and "status"
+        for invalid searches."""
+        results: List[Dict[str, Any]] = []
+        plans = []
+        keys: Dict[Tuple[Any, ...], None] = {}
+        for searched in searches:
+            try:
+                if not isinstance(searched, dict):
+                    raise ValueError("Search must be a JSON object")
+                plan = {
+                    "fields": parse_fields(searched),
+                    "limit": parse_limit(searched),
+                    "desc": is_desc(searched),
+                    "keys": self.sub_criteria(searched),
+                }
+            except ValueError as error:
+                plans.append(None)
+                results.append({"message": f"Invalid search! {error}", "status": 400})
+                continue
+            plans.append(plan)
+            results.append({})
+            keys.update(dict.fromkeys(plan["keys"]))
+
+        matched = self.evaluate(list(keys))
+        for plan in plans:
+            if plan is None:
+                continue
+            plan["article_ids"] = set()
+            if plan["keys"]:
+                # Intersect smallest sets first so intermediate results stay small
+                key_sets = sorted((matched[key] for key in plan["keys"]), key=len)
+                plan["article_ids"] = set.intersection(*key_sets)
+
+        self.limit([plan for plan in plans if plan is not None])
+        articles = self.hydrate([plan for plan in plans if plan is not None])
+        for plan, result in zip(plans, results):
+            if plan is not None:
+                result["content"] = self.assemble(plan, articles)
+        return results
+
+    def limit(self, plans: List[Dict[str, Any]]) -> None:
+        """Keeps the first limit article ids of the searches matching more, by published time,
+        selected together in one UNION ALL statement so that only returned articles are
+        hydrated."""
+        limited = [
+            plan
+            for plan in plans
+            if plan["limit"] is not None and len(plan["article_ids"]) > plan["limit"]
+        ]
+        statements = []
+        for position, plan in enumerate(limited):
+            order = [Article.published_time, Article.article_id]
+            if plan["desc"]:
+                order = [column.desc() for column in order]
+            top = (
+                select(Article.article_id)
+                .where(self.db_utils.id_criterion(Article.article_id, list(plan["article_ids"])))
+                .order_by(*order)
+                .limit(plan["limit"])
+                .subquery()
+            )
+            statements.append(select(literal(position).label("position"), top.c.article_id))
+        if not statements:
+            return
+        statement = statements[0] if len(statements) == 1 else union_all(*statements)
+        with self.db_utils.read_session_manager() as session:
+            rows = session.execute(statement).all()
+        for plan in limited:
+            plan["article_ids"] = set()
+        for row in rows:
+            limited[row.position]["article_ids"].add(row.article_id)
+        return
+
+    def hydrate(self, plans: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Fetches the union of the articles matched by all searches along with the union of their
+        requested fields, in one query per table.
+        Returns a dictionary mapping article id to its attributes, entities and tags."""
+        article_ids = list(set().union(*(plan["article_ids"] for plan in plans)))
+        if not article_ids:
+            return {}
+        fields = set().union(*(plan["fields"] for plan in plans))
+        # Published time is needed to order the results of every search
+        article_fields = [
+            field for field in ARTICLE_FIELDS if field in fields or field == "published_time"
+        ]
+        articles = self.db_utils.query_article_by_article_id(article_ids, True, article_fields)
+        if "entity" in fields:
+            entities = self.db_utils.query_entities_by_article_id(article_ids)
+            for article_id, article_entities in entities.items():
+                if article_id in articles:
+                    articles[article_id]["entity"] = article_entities
+        if "tags" in fields:
+            tags = self.db_utils.query_tag_by_article_id(article_ids)
+            for article_id, article_tags in tags.items():
+                if article_id in articles:
+                    articles[article_id]["tags"] = article_tags
+        return articles
+
+    @staticmethod
+    def assemble(
+        plan: Dict[str, Any], articles: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Orders and limits the articles matched by a search, keeping its requested fields."""
+        matched = [
+            articles[article_id] for article_id in plan["article_ids"] if article_id in articles
+        ]
+        matched.sort(
+            key=lambda article: (article["published_time"], article["article_id"]),
+            reverse=plan["desc"],
+        )
+        if plan["limit"] is not None:
+            matched = matched[: plan["limit"]]
+        keep = set(plan["fields"]) | {"article_id"}
+        return {
+            article["article_id"]: {key: value for key, value in article.items() if key in keep}
+            for article in matched
+        }
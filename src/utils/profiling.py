@@ -0,0 +1,203 @@
+from collections import Counter, OrderedDict
+import cProfile
+from datetime import datetime
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+import uuid
+
+from flask import Flask, Response, g, request, send_file
+
+
+PROFILE_MODES = ("sample", "cprofile")
+# File extension of the profile written by every mode
+PROFILE_EXTENSIONS = {"sample": "folded", "cprofile": "pstats"}
+
+
+class StackSampler:
+    """Low overhead profiler: a background thread samples the stack of the profiled thread every
+    interval seconds and counts identical stacks. Renders them as collapsed stacks, one
+    "outermost;...;innermost count" line per stack, the input of flamegraph.pl and speedscope."""
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="stack_sampler", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        return
+
+    def _sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+        return
+
+    def stop(self) -> str:
+        """Stops sampling. Returns the collapsed stacks."""
+        self.stopped.set()
+        self.thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class Profiler:
+    """Opt-in per-request profiling. A request is profiled when it carries the X-Profile header
+    set to the configured token, or when it is picked at the configured sample rate. Profiles
+    are written to directory keyed by a profile id, returned in the X-Profile-Id response
+    header, and listed and downloaded from /api/profiles with the token. Without a token the
+    endpoints are not registered, profiles being only readable from directory. Only the
+    max_profiles latest profiles are kept.
+
+    Modes are "sample" (default, collapsed stacks from a stack sampler) and "cprofile" (pstats of
+    the deterministic profiler, with a higher overhead). Token authorized requests may pick the
+    mode with the X-Profile-Mode header. Nothing is registered on the application unless a
+    profiler is created, so disabled profiling costs nothing."""
+
+    def __init__(
+        self,
+        directory: str = "profiles",
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        mode: str = "sample",
+        interval: float = 0.005,
+        max_profiles: int = 100,
+    ) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.logger = logging.getLogger("ProfilerLogs")
+        self.lock = threading.Lock()
+        # Maps profile id to its metadata, oldest first
+        self.profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def init_app(self, app: Flask) -> None:
+        """Registers the request hooks on the application, and the /api/profiles endpoints when a
+        token is configured."""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if not self.token:
+            self.logger.info("No profiling token, profiles are not served.")
+            return
+        app.add_url_rule("/api/profiles", "list_profiles", self.list_view, methods=["GET"])
+        app.add_url_rule(
+            "/api/profiles/<profile_id>", "get_profile", self.download_view, methods=["GET"]
+        )
+        return
+
+    def authorized(self) -> bool:
+        """Whether the request carries the profiling token."""
+        header = request.headers.get("X-Profile")
+        return bool(self.token and header and hmac.compare_digest(header, self.token))
+
+    def _before_request(self) -> None:
+        if request.endpoint in ("list_profiles", "get_profile"):
+            return
+        authorized = self.authorized()
+        if not authorized and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return
+        mode = self.mode
+        if authorized and request.headers.get("X-Profile-Mode") in PROFILE_MODES:
+            mode = request.headers["X-Profile-Mode"]
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Only one deterministic profiler may run at a time on recent Python versions
+                self.logger.warning("Another profiler is active, request not profiled.")
+                return
+        else:
+            profiler = StackSampler(threading.get_ident(), self.interval)
+            profiler.start()
+        g.profile = (uuid.uuid4().hex, mode, profiler, time.perf_counter(), datetime.utcnow())
+        return
+
+    def _after_request(self, response: Response) -> Response:
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile_id = self._save(profile, response.status_code)
+            response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    def _teardown_request(self, error: Optional[BaseException]) -> None:
+        # Requests failing with an unhandled exception skip after_request
+        profile = g.pop("profile", None)
+        if profile is not None:
+            self._save(profile, 500)
+        return
+
+    def _save(self, profile: Tuple[str, str, Any, float, datetime], status: int) -> str:
+        profile_id, mode, profiler, started, started_at = profile
+        duration = time.perf_counter() - started
+        name = f"{profile_id}.{PROFILE_EXTENSIONS[mode]}"
+        path = os.path.join(self.directory, name)
+        if mode == "cprofile":
+            profiler.disable()
+            profiler.dump_stats(path)
+        else:
+            with open(path, "w") as profile_file:
+                profile_file.write(profiler.stop())
+        metadata = {
+            "profile_id": profile_id,
+            "mode": mode,
+            "method": request.method,
+            "path": request.full_path,
+            "endpoint": request.endpoint,
+            "status": status,
+            "started_at": started_at.isoformat(),
+            "duration_ms": duration * 1000,
+            "file": name,
+        }
+        with self.lock:
+            self.profiles[profile_id] = metadata
+            while len(self.profiles) > self.max_profiles:
+                _, expired = self.profiles.popitem(last=False)
+                try:
+                    os.remove(os.path.join(self.directory, expired["file"]))
+                except OSError:
+                    self.logger.warning(f"Could not remove profile {expired['file']}!")
+        self.logger.info(f"Request {request.full_path} profiled as {profile_id} ({mode}).")
+        return profile_id
+
+    def list_view(self) -> Tuple[Dict[str, Any], int]:
+        """Lists the kept profiles, latest first."""
+        if not self.authorized():
+            return ({"message": "Profiling token required!"}, 403)
+        with self.lock:
+            profiles = list(reversed(self.profiles.values()))
+        return ({"content": profiles, "message": "Profiles returned"}, 200)
+
+    def download_view(self, profile_id: str) -> Any:
+        """Downloads a profile: collapsed stacks as text, or a pstats file."""
+        if not self.authorized():
+            return ({"message": "Profiling token required!"}, 403)
+        with self.lock:
+            metadata = self.profiles.get(profile_id)
+        if metadata is None:
+            return ({"message": f"Profile {profile_id} not found!"}, 404)
+        path = os.path.abspath(os.path.join(self.directory, metadata["file"]))
+        if metadata["mode"] == "cprofile":
+            return send_file(path, mimetype="application/octet-stream", as_attachment=True)
+        return send_file(path, mimetype="text/plain")
@@ -1,6 +1,9 @@
-from typing import Any, Dict, List, Union
+import base64
+from datetime import datetime, timezone
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from utils.database_utilities import DatabaseUtilities
+from models.db_models import Tag
 
 
 def is_desc(searched: Dict[str, Any]) -> bool:
@@ -15,47 +18,106 @@ def is_desc(searched: Dict[str, Any]) -> bool:
     return desc
 
 
-def parse_searched(db_utils: DatabaseUtilities, searched: Dict[str, Any]) -> List[str]:
-    """Parse JSON request to determine the article id(s) which satisfy all search criteria
-    provided. Does this by querying each table with their respective search criteria and
-    determines the intersection/common article ids."""
-    article_ids = []
-    # Search by article
-    if searched.get("article_id") or searched.get("headline"):
-        article_searched_ids = db_utils.query_by_article(searched)
-        if not article_searched_ids:
-            return []
-        else:
-            article_ids.extend(article_searched_ids)
-
-    # Search by tag
-    if searched.get("tag"):
-        tag_searched_ids = db_utils.query_by_tags(searched.get("tag"))
-        if not tag_searched_ids:
-            return []
-        elif article_ids:
-            # Get intersection
-            article_ids = list(set(article_ids) & set(tag_searched_ids))
-            if not article_ids:
-                # No common articles between search criteria
-                return []
-        else:
-            article_ids.extend(tag_searched_ids)
-
-    # Search by entity
-    if searched.get("entity"):
-        entity_searched_ids = db_utils.query_by_entities(searched.get("entity"))
-        if not entity_searched_ids:
-            return []
-        elif article_ids:
-            # Get intersection
-            article_ids = list(set(article_ids) & set(entity_searched_ids))
-            if not article_ids:
-                # No common articles between search criteria
-                return []
-        else:
-            article_ids.extend(entity_searched_ids)
-    return article_ids
+ARTICLE_FIELDS = ("headline", "published_time", "publisher_timezone", "article_content")
+SEARCH_FIELDS = ARTICLE_FIELDS + ("entity", "tags")
+# Article content is only returned when explicitly asked for, it is fetched on demand otherwise
+DEFAULT_SEARCH_FIELDS = ("headline", "published_time", "publisher_timezone", "entity", "tags")
+RESPONSE_FORMATS = ("records", "columnar")
+MAX_TAG_LENGTH = Tag.__table__.columns["tag"].type.length
+
+
+def parse_fields(searched: Dict[str, Any]) -> List[str]:
+    """Takes JSON request and determines which article attributes are to be returned, from its
+    optional "fields" list. Raises ValueError on unknown attributes.
+    Returns a list of attributes, article_id being always returned."""
+    fields = searched.get("fields")
+    if not fields:
+        return list(DEFAULT_SEARCH_FIELDS)
+    unknown = [field for field in fields if field not in SEARCH_FIELDS and field != "article_id"]
+    if unknown:
+        raise ValueError(f"Unknown fields: {unknown}")
+    return [field for field in SEARCH_FIELDS if field in fields]
+
+
+def parse_time(value: str) -> datetime:
+    """Parses an ISO 8601 date or datetime. Timezone aware datetimes are converted to UTC, like
+    published times are stored. Raises ValueError if the value is malformed."""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, TypeError, ValueError) as error:
+        raise ValueError(f"Invalid time: {value}") from error
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_article_filters(searched: Dict[str, Any]) -> Dict[str, Any]:
+    """Takes JSON request and extracts the criteria on article attributes: "article_id",
+    "headline", "publisher_timezone" and "published_time" lists, and the "published_from"
+    (inclusive) and "published_to" (exclusive) published time range. Raises ValueError on
+    malformed times or an empty range.
+    Returns a dictionary of the given criteria, times parsed to datetimes."""
+    filters = {}
+    for key in ("article_id", "headline", "publisher_timezone"):
+        if searched.get(key):
+            filters[key] = searched[key]
+    if searched.get("published_time"):
+        filters["published_time"] = [parse_time(value) for value in searched["published_time"]]
+    for key in ("published_from", "published_to"):
+        if searched.get(key):
+            filters[key] = parse_time(searched[key])
+    if filters.get("published_from") and filters.get("published_to"):
+        if filters["published_from"] >= filters["published_to"]:
+            raise ValueError("published_from must be before published_to")
+    return filters
+
+
+def parse_limit(searched: Dict[str, Any]) -> Optional[int]:
+    """Takes JSON request and extracts the optional "limit" on the number of returned articles.
+    Raises ValueError if it is not a positive integer."""
+    limit = searched.get("limit")
+    if limit is None:
+        return None
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise ValueError(f"Invalid limit: {limit}")
+    return limit
+
+
+def encode_cursor(published_time: datetime, article_id: str) -> str:
+    """Encodes the position of the last article of a page into an opaque url-safe cursor."""
+    position = json.dumps([published_time.isoformat(), article_id])
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decodes a cursor created by encode_cursor. Raises ValueError if the cursor is malformed.
+    Returns a (published_time, article_id) tuple."""
+    try:
+        published_time, article_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(published_time), article_id
+    except (TypeError, ValueError, UnicodeError) as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
+
+
+def parse_response_format(response_format: Optional[str]) -> str:
+    """Takes the optional "format" query parameter. Raises ValueError on unknown formats.
+    Returns "records" (default, one object per article) or "columnar" (one list per attribute)."""
+    if response_format is None:
+        return "records"
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown format: {response_format}")
+    return response_format
+
+
+def parse_suggest_field(field: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Takes the "field" query parameter of suggestions, "tag" or "entity:<entity>" (i.e.
+    "entity:city"). Raises ValueError on other fields.
+    Returns a (field, entity) tuple, entity being None for tags."""
+    if field == "tag":
+        return "tag", None
+    if field and field.startswith("entity:") and len(field) > len("entity:"):
+        return "entity", field[len("entity:") :]
+    raise ValueError(f"Unknown field: {field}, expected tag or entity:<entity>")
 
 
 def parse_tag_article(
@@ -76,3 +138,60 @@ def parse_tag_article(
         ]
         tags_to_insert.extend(flattened_tagged_article)
     return tags_to_insert
+
+
+def parse_bulk_tag_article(
+    tagged_articles: List[Dict[str, Union[str, List[str]]]],
+    username: str
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """Parse JSON request of a bulk tagging job. Same format as parse_tag_article, but tags
+    repeated within the request are only kept once and malformed items are reported instead of
+    failing the whole request.
+    Returns the list of unique tags to insert and the list of skipped/failed item results."""
+    tags_to_insert = []
+    results = []
+    seen = set()
+    for tagged_article in tagged_articles:
+        article_id = tagged_article.get("article_id") if isinstance(tagged_article, dict) else None
+        tags = tagged_article.get("tags") if isinstance(tagged_article, dict) else None
+        if not isinstance(article_id, str) or not isinstance(tags, list):
+            results.append(
+                {
+                    "article_id": article_id,
+                    "status": "failed",
+                    "reason": "Item must map article_id to a string and tags to a list",
+                }
+            )
+            continue
+        for tag in tags:
+            if not isinstance(tag, str) or not tag:
+                results.append(
+                    {
+                        "article_id": article_id,
+                        "tag": tag,
+                        "status": "failed",
+                        "reason": "Invalid tag",
+                    }
+                )
+            elif len(tag) > MAX_TAG_LENGTH:
+                results.append(
+                    {
+                        "article_id": article_id,
+                        "tag": tag,
+                        "status": "failed",
+                        "reason": f"Tag is longer than {MAX_TAG_LENGTH} characters",
+                    }
+                )
+            elif (article_id, tag) in seen:
+                results.append(
+                    {
+                        "article_id": article_id,
+                        "tag": tag,
+                        "status": "skipped",
+                        "reason": "Duplicate tag in request",
+                    }
+                )
+            else:
+                seen.add((article_id, tag))
+                tags_to_insert.append({"article_id": article_id, "tag": tag, "tagged_by": username})
+    return tags_to_insert, results
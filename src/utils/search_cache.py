@@ -0,0 +1,292 @@
+from collections import OrderedDict
+import json
+import logging
+import socket
+import threading
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from utils.request_parser import is_desc
+from utils.serialization import revive_article, storage_default
+
+
+def canonicalize(searched: Dict[str, Any]) -> str:
+    """Builds a cache key from a search body. Keys and list values are sorted, empty criteria are
+    dropped and the order direction is normalized, so equivalent search bodies share a key."""
+    canonical = {}
+    for key, value in searched.items():
+        if key == "order_by_time" or value in (None, "", [], {}):
+            continue
+        if isinstance(value, dict):
+            value = {entity: sorted(entity_values) for entity, entity_values in value.items()}
+        elif isinstance(value, list):
+            value = sorted(value, key=str)
+        canonical[key] = value
+    canonical["order_by_time"] = "desc" if is_desc(searched) else "asc"
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class LocalCache:
+    """Bounded in-process LRU cache whose entries expire after max_staleness seconds. Every entry
+    remembers the tags it searched on and the article ids it returned, for targeted invalidation."""
+
+    def __init__(self, max_entries: int, max_staleness: float) -> None:
+        self.max_entries = max_entries
+        self.max_staleness = max_staleness
+        self.lock = threading.Lock()
+        # Maps key to (stored_at, content, searched tags, returned article ids)
+        self.entries: "OrderedDict[str, Tuple[float, Any, FrozenSet[str], FrozenSet[str]]]" = (
+            OrderedDict()
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.max_staleness:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(
+        self, key: str, content: Any, tags: FrozenSet[str], article_ids: FrozenSet[str]
+    ) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic(), content, tags, article_ids)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return
+
+    def invalidate(self, article_ids: FrozenSet[str], tags: FrozenSet[str]) -> int:
+        """Drops entries which searched on any of the tags or returned any of the article ids.
+        Returns the number of dropped entries."""
+        with self.lock:
+            stale = [
+                key
+                for key, (_, _, entry_tags, entry_article_ids) in self.entries.items()
+                if entry_tags & tags or entry_article_ids & article_ids
+            ]
+            for key in stale:
+                del self.entries[key]
+        return len(stale)
+
+
+class RespClient:
+    """Minimal client for stores speaking the Redis serialization protocol (RESP)."""
+
+    def __init__(self, host: str, port: int = 6379, timeout: float = 0.1) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection: Optional[socket.socket] = None
+        self.reader = None
+
+    def _connect(self) -> None:
+        self.connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.connection.makefile("rb")
+        return
+
+    def _close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.reader = None
+        return
+
+    def _read_reply(self) -> Any:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode("utf-8")
+        if prefix == b"-":
+            raise RuntimeError(payload.decode("utf-8"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply: {line!r}")
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        encoded = [arg if isinstance(arg, bytes) else str(arg).encode("utf-8") for arg in args]
+        return b"*%d\r\n" % len(encoded) + b"".join(
+            b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in encoded
+        )
+
+    def execute(self, *args: Any) -> Any:
+        """Sends a command and returns its reply. Reconnects on the next call after a failure."""
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        """Sends commands in a single round trip. Returns their replies, in order.
+        Raises RuntimeError on the first error reply, once every reply is read."""
+        payload = b"".join(self._encode(command) for command in commands)
+        with self.lock:
+            try:
+                if self.connection is None:
+                    self._connect()
+                self.connection.sendall(payload)
+                replies = []
+                errors = []
+                for _ in commands:
+                    try:
+                        replies.append(self._read_reply())
+                    except RuntimeError as error:
+                        # Error replies are read in full, the following replies stay in sync
+                        replies.append(None)
+                        errors.append(error)
+            except (OSError, ConnectionError):
+                self._close()
+                raise
+        if errors:
+            raise errors[0]
+        return replies
+
+
+class SharedCache:
+    """Cache tier shared between application instances, stored in a RESP store. Invalidation
+    sets index cache keys by searched tag and returned article id."""
+
+    PREFIX = "article_tagger:search:"
+
+    def __init__(self, client: RespClient, max_staleness: float) -> None:
+        self.client = client
+        self.max_staleness = max(int(max_staleness), 1)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.execute("GET", self.PREFIX + key)
+        if value is None:
+            return None
+        content = json.loads(value, object_pairs_hook=OrderedDict)
+        for article in content.values():
+            revive_article(article)
+        return content
+
+    def set(
+        self, key: str, content: Any, tags: FrozenSet[str], article_ids: FrozenSet[str]
+    ) -> None:
+        value = json.dumps(content, default=storage_default)
+        commands = [("SET", self.PREFIX + key, value, "EX", self.max_staleness)]
+        index_keys = [self.PREFIX + "tag:" + tag for tag in tags]
+        index_keys += [self.PREFIX + "article:" + article_id for article_id in article_ids]
+        for index_key in index_keys:
+            commands.append(("SADD", index_key, self.PREFIX + key))
+            commands.append(("EXPIRE", index_key, self.max_staleness))
+        self.client.pipeline(commands)
+        return
+
+    def invalidate(self, article_ids: FrozenSet[str], tags: FrozenSet[str]) -> int:
+        index_keys = [self.PREFIX + "tag:" + tag for tag in tags]
+        index_keys += [self.PREFIX + "article:" + article_id for article_id in article_ids]
+        stale = set()
+        if index_keys:
+            members = self.client.pipeline([("SMEMBERS", index_key) for index_key in index_keys])
+            for index_members in members:
+                stale.update(index_members or [])
+        if stale:
+            self.client.execute("DEL", *stale)
+        return len(stale)
+
+
+class SearchCache:
+    """Read-through cache of search results keyed on the canonicalized search body. Looks up a
+    bounded in-process tier first, then the optional shared tier. Results may be up to
+    max_staleness seconds old, entries touched by new tags are invalidated as they are written."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_staleness: float = 60,
+        shared_client: Optional[RespClient] = None,
+    ) -> None:
+        self.logger = logging.getLogger("SearchCacheLogs")
+        self.local = LocalCache(max_entries, max_staleness)
+        self.shared = SharedCache(shared_client, max_staleness) if shared_client else None
+        # Counted by request threads, under lock
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "local_hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0}
+
+    def count(self, *stats: str, amount: int = 1) -> None:
+        with self.lock:
+            for stat in stats:
+                self.stats[stat] += amount
+        return
+
+    def get(self, searched: Dict[str, Any]) -> Optional[Any]:
+        """Returns the cached search result or None on a miss."""
+        key = canonicalize(searched)
+        content = self.local.get(key)
+        if content is not None:
+            self.count("hits", "local_hits")
+            return content
+        if self.shared is not None:
+            try:
+                content = self.shared.get(key)
+            except (OSError, ConnectionError, RuntimeError):
+                self.logger.warning("Shared search cache unavailable!", exc_info=True)
+            if content is not None:
+                self.local.set(key, content, self._tags(searched), frozenset(content))
+                self.count("hits", "shared_hits")
+                return content
+        self.count("misses")
+        return None
+
+    def set(self, searched: Dict[str, Any], content: Dict[str, Any]) -> None:
+        """Stores a search result, content being the dictionary mapping article ids to articles."""
+        key = canonicalize(searched)
+        tags = self._tags(searched)
+        article_ids = frozenset(content)
+        self.local.set(key, content, tags, article_ids)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, content, tags, article_ids)
+            except (OSError, ConnectionError, RuntimeError):
+                self.logger.warning("Shared search cache unavailable!", exc_info=True)
+        return
+
+    def invalidate(self, article_ids: Iterable[str], tags: Iterable[str]) -> None:
+        """Drops cached results which searched on any of the tags or returned any of the
+        articles."""
+        article_ids = frozenset(article_ids)
+        tags = frozenset(tags)
+        invalidated = self.local.invalidate(article_ids, tags)
+        if self.shared is not None:
+            try:
+                invalidated += self.shared.invalidate(article_ids, tags)
+            except (OSError, ConnectionError, RuntimeError):
+                self.logger.warning("Shared search cache unavailable!", exc_info=True)
+        self.count("invalidations", amount=invalidated)
+        return
+
+    def invalidate_tags(self, tags: List[Dict[str, str]]) -> None:
+        """Invalidates results affected by inserted tag mappings."""
+        self.invalidate([tag["article_id"] for tag in tags], [tag["tag"] for tag in tags])
+        return
+
+    def metrics(self) -> List[str]:
+        """Returns the cache statistics as counters in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            stats = dict(self.stats)
+        for stat, value in stats.items():
+            name = f"article_tagger_search_cache_{stat}_total"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        return lines
+
+    @staticmethod
+    def _tags(searched: Dict[str, Any]) -> FrozenSet[str]:
+        return frozenset(searched.get("tag") or [])
@@ -0,0 +1,185 @@
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, union
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models.db_models import Article, Entity, SearchDocument, Tag
+from utils.database_utilities import DatabaseUtilities
+from utils.serialization import revive_article, storage_default
+
+
+# Article attributes embedded in search documents, content is fetched on demand instead
+DOCUMENT_FIELDS = ("headline", "published_time", "publisher_timezone")
+
+
+class SearchDocumentStore:
+    """Materialized search documents, one row per article in the search_documents table holding
+    the JSON an article is served as by search_articles: its attributes (except its content) with
+    its entities and tags embedded. Hydrating search results is then a primary key fetch.
+
+    Documents are rebuilt right after tags are written with refresh_articles, and by refresh for
+    articles, entities or tags written since the last refresh, the watermark staying the commit
+    lag of db_utils behind to pick up late commits. rebuild backfills every document."""
+
+    def __init__(self, db_utils: DatabaseUtilities) -> None:
+        self.db_utils = db_utils
+        self.logger = logging.getLogger("SearchDocumentStoreLogs")
+        self.watermark: Optional[datetime] = None
+
+    def build_documents(self, article_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Builds the documents of the given articles from the articles, entities and tags tables.
+        Returns a dictionary mapping article id to its document."""
+        if not article_ids:
+            return {}
+        columns = [getattr(Article, field) for field in DOCUMENT_FIELDS]
+        with self.db_utils.session_manager() as session:
+            articles = session.execute(
+                select(Article.article_id, *columns).where(
+                    self.db_utils.id_criterion(Article.article_id, article_ids)
+                )
+            ).all()
+            entities = session.execute(
+                select(Entity.article_id, Entity.entity, Entity.entity_value)
+                .where(self.db_utils.id_criterion(Entity.article_id, article_ids))
+                .order_by(Entity.entity_id)
+            ).all()
+            tags = session.execute(
+                select(Tag.article_id, Tag.tag)
+                .where(self.db_utils.id_criterion(Tag.article_id, article_ids))
+                .order_by(Tag.tag_id)
+            ).all()
+        documents = {article.article_id: article._asdict() for article in articles}
+        for entity in entities:
+            document = documents.get(entity.article_id)
+            if document is not None:
+                entity_values = document.setdefault("entity", {}).setdefault(entity.entity, [])
+                entity_values.append(entity.entity_value)
+        for tag in tags:
+            document = documents.get(tag.article_id)
+            if document is not None:
+                document.setdefault("tags", []).append(tag.tag)
+        return documents
+
+    def refresh_articles(self, article_ids: Iterable[str], batch_size: int = 1000) -> int:
+        """Rebuilds and stores the documents of the given articles, batch_size at a time.
+        Returns the number of stored documents."""
+        article_ids = list(set(article_ids))
+        stored = 0
+        for start in range(0, len(article_ids), batch_size):
+            documents = self.build_documents(article_ids[start : start + batch_size])
+            rows = [
+                {
+                    "article_id": article_id,
+                    "document": json.dumps(document, default=storage_default),
+                }
+                for article_id, document in documents.items()
+            ]
+            if rows:
+                self._upsert(rows)
+            stored += len(rows)
+        return stored
+
+    def _upsert(self, rows: List[Dict[str, Any]]) -> None:
+        with self.db_utils.session_manager() as session:
+            if self.db_utils.engine.dialect.name == "sqlite":
+                statement = sqlite_insert(SearchDocument).values(rows)
+                statement = statement.on_conflict_do_update(
+                    index_elements=[SearchDocument.article_id],
+                    set_={"document": statement.excluded.document, "updated_at": func.now()},
+                )
+            else:
+                statement = mysql_insert(SearchDocument).values(rows)
+                statement = statement.on_duplicate_key_update(
+                    document=statement.inserted.document, updated_at=func.now()
+                )
+            session.execute(statement)
+        return
+
+    def start(self) -> None:
+        """Sets the refresh watermark to the time the latest document was stored, so refresh
+        picks up the writes made since."""
+        with self.db_utils.session_manager() as session:
+            latest = session.execute(select(func.max(SearchDocument.updated_at))).scalar()
+            if latest is not None:
+                self.watermark = self.db_utils.lagged_watermark(session, latest)
+        if self.watermark is None:
+            self.logger.warning("No search documents found, run the rebuild command to backfill!")
+        return
+
+    def refresh(self, batch_size: int = 1000) -> None:
+        """Rebuilds the documents of articles whose article, entity or tag rows were written since
+        the last refresh. The bound is inclusive since timestamps have a one second resolution."""
+        with self.db_utils.session_manager() as session:
+            now = session.execute(select(func.now())).scalar()
+            # Rows committed up to commit_lag seconds late are picked up by the next refresh
+            watermark = now - timedelta(seconds=self.db_utils.commit_lag)
+            if self.watermark is None:
+                self.watermark = watermark
+                return
+            article_ids = session.execute(
+                union(
+                    select(Article.article_id).where(Article.updated_at >= self.watermark),
+                    select(Entity.article_id).where(Entity.updated_at >= self.watermark),
+                    select(Tag.article_id).where(Tag.tagged_at >= self.watermark),
+                )
+            ).scalars().all()
+        self.refresh_articles(article_ids, batch_size)
+        self.watermark = watermark
+        return
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        """Rebuilds the documents of every article, walking article ids in batch_size pages.
+        Returns the number of stored documents."""
+        stored = 0
+        last_article_id = None
+        with self.db_utils.session_manager() as session:
+            now = session.execute(select(func.now())).scalar()
+        watermark = now - timedelta(seconds=self.db_utils.commit_lag)
+        while True:
+            statement = select(Article.article_id).order_by(Article.article_id).limit(batch_size)
+            if last_article_id is not None:
+                statement = statement.where(Article.article_id > last_article_id)
+            with self.db_utils.session_manager() as session:
+                article_ids = session.execute(statement).scalars().all()
+            if not article_ids:
+                break
+            stored += self.refresh_articles(article_ids, batch_size)
+            last_article_id = article_ids[-1]
+            self.logger.info(f"{stored} search documents rebuilt.")
+        self.watermark = watermark
+        return stored
+
+    @staticmethod
+    def project(document: str, fields: List[str]) -> Dict[str, Any]:
+        """Decodes a stored document, keeping article_id and the requested fields."""
+        return revive_article(
+            {
+                key: value
+                for key, value in json.loads(document).items()
+                if key == "article_id" or key in fields
+            }
+        )
+
+
+if __name__ == "__main__":
+    # REBUILDS EVERY SEARCH DOCUMENT, RUN FROM THE SRC FOLDER
+    # Ex: python -m utils.search_documents --batch-size 1000
+    import os
+
+    from utils.init_logger import init_logger
+
+    parser = argparse.ArgumentParser(description="Backfills the search_documents table.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    init_logger()
+    store = SearchDocumentStore(
+        DatabaseUtilities(
+            host=os.getenv("DATABASE_CONTAINER"), database=os.getenv("MYSQL_DATABASE")
+        )
+    )
+    store.rebuild(args.batch_size)
@@ -0,0 +1,329 @@
+from collections import OrderedDict
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import literal, null, select, union_all
+
+from models.db_models import Article, Entity, SearchDocument, Tag
+from utils.database_utilities import DatabaseUtilities, article_criteria
+from utils.filter_index import FilterIndex
+from utils.request_parser import (
+    ARTICLE_FIELDS,
+    is_desc,
+    parse_article_filters,
+    parse_fields,
+    parse_limit,
+)
+from utils.search_documents import SearchDocumentStore
+from utils.text_index import MySQLFullTextIndex, TextIndex
+
+
+class SearchEngine:
+    """Compiles a search request body into a single SQL statement. Every search criterion becomes
+    a semi-join (EXISTS) on the articles table so the database intersects criteria in one pass.
+    Entities and tags of the matching articles are then pulled in a single hydration query.
+
+    Published time range and timezone criteria are plain conditions on the articles table, so
+    they are answered by its indexes. When a search has a time range or a limit, the tag and
+    entity semi-joins are probed article by article along publish_time_idx instead of being
+    materialized, which lets "latest N" searches stop after N matches."""
+
+    def __init__(
+        self,
+        db_utils: DatabaseUtilities,
+        text_index: Optional[TextIndex] = None,
+        filter_index: Optional[FilterIndex] = None,
+        documents: Optional[SearchDocumentStore] = None,
+    ) -> None:
+        self.db_utils = db_utils
+        self.text_index = text_index or MySQLFullTextIndex(db_utils)
+        self.filter_index = filter_index
+        self.documents = documents
+        self.logger = logging.getLogger("SearchEngineLogs")
+
+    def build_criteria(self, searched: Dict[str, Any]) -> Optional[List[Any]]:
+        """Translates search attributes into a list of SQL clauses on the articles table.
+        Raises ValueError on malformed published times.
+        Returns an empty list if no search attribute was provided, and None if the filter index
+        already determined that no article can match."""
+        article_filters = parse_article_filters(searched)
+        criteria = article_criteria(article_filters)
+        # Time bounded and top-k searches are driven by the published time order of articles
+        probe = bool(
+            article_filters.get("published_from")
+            or article_filters.get("published_to")
+            or parse_limit(searched)
+        )
+
+        if self.filter_index is not None:
+            # Tag and entity criteria are answered in memory without querying the database
+            filtered_ids = self.filter_index.search(searched)
+            if filtered_ids is not None:
+                if not filtered_ids:
+                    return None
+                criteria.append(self.db_utils.id_criterion(Article.article_id, filtered_ids))
+        else:
+            criteria.extend(self.build_filter_criteria(searched, probe=probe))
+
+        text = searched.get("text")
+        if text:
+            criteria.append(self.text_index.criterion(text))
+        return criteria
+
+    def build_filter_criteria(self, searched: Dict[str, Any], probe: bool = False) -> List[Any]:
+        """Translates tag and entity search attributes into semi-joins on the articles table.
+        With probe set, MySQL is told not to turn them into joins so they are checked for every
+        candidate article in the order articles are scanned."""
+        criteria = []
+        tags = searched.get("tag")
+        if tags:
+            criteria.append(
+                self._exists(probe, Tag.article_id == Article.article_id, Tag.tag.in_(tags))
+            )
+
+        # One semi-join per entity, articles must satisfy all of them
+        entities = searched.get("entity") or {}
+        for entity, entity_values in entities.items():
+            criteria.append(
+                self._exists(
+                    probe,
+                    Entity.article_id == Article.article_id,
+                    Entity.entity == entity,
+                    Entity.entity_value.in_(entity_values),
+                )
+            )
+        return criteria
+
+    @staticmethod
+    def _exists(probe: bool, *clauses: Any) -> Any:
+        subquery = select(literal(1)).where(*clauses)
+        if probe:
+            subquery = subquery.prefix_with("/*+ NO_SEMIJOIN() */", dialect="mysql")
+        return subquery.exists()
+
+    @staticmethod
+    def order_by(searched: Dict[str, Any]) -> List[Any]:
+        """Returns the published time ordering of the search. Ties are broken on article id, so
+        that a limited search always selects the same articles."""
+        if is_desc(searched):
+            return [Article.published_time.desc(), Article.article_id.desc()]
+        return [Article.published_time.asc(), Article.article_id.asc()]
+
+    def build_match_statement(
+        self,
+        criteria: List[Any],
+        searched: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        """Builds the statement selecting the article ids satisfying all search criteria, only
+        the first limit of them by published time if a limit is given."""
+        statement = select(Article.article_id).where(*criteria)
+        if limit is not None:
+            statement = statement.order_by(*self.order_by(searched or {})).limit(limit)
+        return statement
+
+    def build_article_statement(
+        self,
+        searched: Dict[str, Any],
+        criteria: List[Any],
+        fields: List[str],
+        limit: Optional[int] = None,
+    ) -> Any:
+        """Builds the statement returning the requested attributes of every article satisfying all
+        search criteria, ordered by published time and stopping after limit articles."""
+        columns = [getattr(Article, field) for field in ARTICLE_FIELDS if field in fields]
+        statement = select(Article.article_id, *columns).where(*criteria)
+        statement = statement.order_by(*self.order_by(searched))
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def build_document_statement(
+        self, searched: Dict[str, Any], criteria: List[Any], limit: Optional[int] = None
+    ) -> Any:
+        """Builds the statement returning the stored search document of every article satisfying
+        all search criteria, ordered by published time. Rows are (article_id, document), document
+        being NULL for articles without a stored document yet."""
+        statement = (
+            select(Article.article_id, SearchDocument.document)
+            .outerjoin(SearchDocument, SearchDocument.article_id == Article.article_id)
+            .where(*criteria)
+            .order_by(*self.order_by(searched))
+        )
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def build_entity_statement(
+        self,
+        criteria: List[Any],
+        searched: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        """Builds the statement returning the entities of every article satisfying all search
+        criteria. Rows are ("entity", article_id, entity, entity_value)."""
+        # Joined as a derived table, since MySQL does not support LIMIT in IN subqueries
+        matched = self.build_match_statement(criteria, searched, limit).subquery("matched")
+        return select(
+            literal("entity").label("kind"),
+            Entity.article_id,
+            Entity.entity.label("name"),
+            Entity.entity_value.label("value"),
+        ).join(matched, Entity.article_id == matched.c.article_id)
+
+    def build_tag_statement(
+        self,
+        criteria: List[Any],
+        searched: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        """Builds the statement returning the tags of every article satisfying all search
+        criteria. Rows are ("tag", article_id, tag, NULL)."""
+        matched = self.build_match_statement(criteria, searched, limit).subquery("matched")
+        return select(
+            literal("tag").label("kind"),
+            Tag.article_id,
+            Tag.tag.label("name"),
+            null().label("value"),
+        ).join(matched, Tag.article_id == matched.c.article_id)
+
+    def build_hydration_statements(
+        self,
+        criteria: List[Any],
+        fields: List[str],
+        searched: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Any]:
+        """Builds the entity and tag statements of the requested fields."""
+        statements = []
+        if "entity" in fields:
+            statements.append(self.build_entity_statement(criteria, searched, limit))
+        if "tags" in fields:
+            statements.append(self.build_tag_statement(criteria, searched, limit))
+        return statements
+
+    def build_hydration_statement(
+        self,
+        criteria: List[Any],
+        fields: List[str],
+        searched: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> Optional[Any]:
+        """Builds a single statement returning the requested entities and tags of every article
+        satisfying all search criteria, or of the first limit of them. Rows are
+        (kind, article_id, name, value) where kind is either "entity" or "tag". Returns None if
+        neither entities nor tags are requested."""
+        statements = self.build_hydration_statements(criteria, fields, searched, limit)
+        if not statements:
+            return None
+        if len(statements) == 1:
+            return statements[0]
+        return union_all(*statements)
+
+    @staticmethod
+    def assemble(articles: List[Any], hydration: List[Any]) -> Dict[str, Dict[str, Any]]:
+        """Attaches hydration rows to their article.
+        Returns a dictionary mapping article id to its attributes, entities and tags."""
+        # Dictionary of article ids mapped to article dict object
+        # i.e. { article_id: { article_id: abc123, headline: headline1, entity: {}, tags: [] } }
+        articles_dict = OrderedDict()
+        for article in articles:
+            articles_dict[article.article_id] = article._asdict()
+        for row in hydration:
+            article_dict = articles_dict.get(row.article_id)
+            if article_dict is None:
+                continue
+            if row.kind == "entity":
+                article_dict.setdefault("entity", {}).setdefault(row.name, []).append(row.value)
+            else:
+                article_dict.setdefault("tags", []).append(row.name)
+        return articles_dict
+
+    def assemble_documents(
+        self, articles: List[Any], fields: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Decodes the stored documents of search results. Documents not stored yet are built
+        from the articles, entities and tags tables.
+        Returns a dictionary mapping article id to its requested attributes, entities and tags."""
+        missing = [article.article_id for article in articles if article.document is None]
+        built = self.documents.build_documents(missing)
+        articles_dict = OrderedDict()
+        for article in articles:
+            if article.document is not None:
+                articles_dict[article.article_id] = self.documents.project(article.document, fields)
+            elif article.article_id in built:
+                articles_dict[article.article_id] = {
+                    key: value
+                    for key, value in built[article.article_id].items()
+                    if key == "article_id" or key in fields
+                }
+        return articles_dict
+
+    def explain_statement(self, statement: Any) -> Dict[str, Any]:
+        """Compiles a statement against the engine dialect. Returns the SQL string and its
+        bound parameters."""
+        compiled = statement.compile(
+            dialect=self.db_utils.engine.dialect, compile_kwargs={"render_postcompile": True}
+        )
+        return {"sql": str(compiled), "params": compiled.params}
+
+    def search(
+        self, searched: Dict[str, Any], explain: bool = False
+    ) -> Tuple[Dict[str, Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Runs a search in two round trips on a single session: one statement to find and fetch
+        the matching articles and one statement to hydrate their entities and tags. With a search
+        document store, unless article content is requested, the matching articles are fetched
+        with their stored documents in a single round trip instead. Only the
+        attributes listed in the optional "fields" key of the search are returned, and only the
+        first "limit" articles by published time if given.
+        Raises ValueError on unknown fields, malformed published times or an invalid limit.
+        Returns a dictionary mapping article id to its attributes, and the generated SQL and
+        timings if explain is set."""
+        start = time.perf_counter()
+        fields = parse_fields(searched)
+        limit = parse_limit(searched)
+        criteria = self.build_criteria(searched)
+        statements = []
+        use_documents = self.documents is not None and "article_content" not in fields
+        if criteria:
+            if use_documents:
+                article_statement = self.build_document_statement(searched, criteria, limit)
+                hydration_statement = None
+            else:
+                article_statement = self.build_article_statement(searched, criteria, fields, limit)
+                hydration_statement = self.build_hydration_statement(
+                    criteria, fields, searched, limit
+                )
+            statements = [article_statement]
+            if hydration_statement is not None:
+                statements.append(hydration_statement)
+        timings = {"compile_ms": (time.perf_counter() - start) * 1000}
+
+        articles, hydration = [], []
+        if statements:
+            with self.db_utils.read_session_manager() as session:
+                step = time.perf_counter()
+                articles = session.execute(article_statement).all()
+                timings["search_ms"] = (time.perf_counter() - step) * 1000
+
+                if articles and hydration_statement is not None:
+                    step = time.perf_counter()
+                    hydration = session.execute(hydration_statement).all()
+                    timings["hydrate_ms"] = (time.perf_counter() - step) * 1000
+        if use_documents:
+            articles_dict = self.assemble_documents(articles, fields)
+        else:
+            articles_dict = self.assemble(articles, hydration)
+            if "article_content" in fields:
+                self.db_utils.fill_contents(list(articles_dict.values()))
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        self.logger.debug("Search timings: %s", timings)
+
+        if not explain:
+            return articles_dict, None
+        explained = {
+            "timings": timings,
+            "statements": [self.explain_statement(statement) for statement in statements],
+        }
+        return articles_dict, explained
@@ -0,0 +1,83 @@
+from datetime import date, datetime
+import json
+from typing import Any, Dict, Iterable, List, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Attributes returned for articles missing them in the columnar format
+COLUMN_DEFAULTS = {"entity": {}, "tags": []}
+
+
+def response_default(value: Any) -> str:
+    """Encodes dates as ISO 8601 strings. Published times are stored as naive UTC datetimes, so
+    naive datetimes are given a UTC offset, the same way as orjson with OPT_NAIVE_UTC."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.isoformat() + "+00:00"
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def storage_default(value: Any) -> str:
+    """Encodes dates as ISO 8601 strings which revive_article parses back, for JSON stored in
+    caches and search documents."""
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def revive_article(article: Dict[str, Any]) -> Dict[str, Any]:
+    """Parses the published time of an article decoded from stored JSON back to a datetime, so
+    it is encoded like articles fetched from the database. Returns the article."""
+    published_time = article.get("published_time")
+    if isinstance(published_time, str):
+        try:
+            article["published_time"] = datetime.fromisoformat(published_time)
+        except ValueError:
+            # Stored in an older format, served as is until rebuilt
+            pass
+    return article
+
+
+def dumps(content: Any) -> bytes:
+    """Encodes a response body to UTF-8 JSON with ISO 8601 datetimes. Uses orjson when it is
+    installed, the standard library encoder otherwise."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NAIVE_UTC)
+    return json.dumps(
+        content, default=response_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def records(keys: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+    """Zips result tuples with their column names, i.e. keys of a SQLAlchemy result, into one
+    dictionary per row."""
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def columns(keys: Sequence[str], rows: Iterable[Sequence[Any]]) -> Dict[str, List[Any]]:
+    """Transposes result tuples into one list of values per column, in the compact columnar
+    format."""
+    transposed = list(zip(*rows))
+    if not transposed:
+        return {key: [] for key in keys}
+    return {key: list(values) for key, values in zip(keys, transposed)}
+
+
+def columnar_articles(
+    articles_dict: Dict[str, Dict[str, Any]], fields: List[str]
+) -> Dict[str, List[Any]]:
+    """Turns a dictionary mapping article id to article attributes, as returned by searches, into
+    the columnar format: one list per attribute holding the value of every article in order."""
+    articles = list(articles_dict.values())
+    content = {"article_id": list(articles_dict)}
+    for field in fields:
+        default = COLUMN_DEFAULTS.get(field)
+        content[field] = [article.get(field, default) for article in articles]
+    return content
@@ -0,0 +1,154 @@
+from bisect import bisect_left
+import heapq
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.database_utilities import DatabaseUtilities
+from utils.facets import entity_counts_statement, tag_counts_statement
+
+
+# Sorts after every character a value may hold, bounding the range of values starting with a prefix
+MAX_CHARACTER = chr(0x10FFFF)
+# Values added since the index was built are merged into its sorted array past this many
+MAX_PENDING = 1024
+
+
+def suggestion_key(item: Tuple[str, int]) -> Tuple[int, str]:
+    """Orders (value, count) suggestions by descending count, ties broken on value."""
+    return (-item[1], item[0])
+
+
+class PrefixIndex:
+    """Values of a field with the number of articles holding them, in an array sorted on the
+    casefolded value. The values starting with a prefix are the contiguous range found by
+    bisection. The top max_limit values of every prefix up to precomputed_length characters are
+    kept, since short prefixes match too many values to rank on every keystroke. Values added
+    after the build are buffered unsorted, scanned by searches and merged into the array in bulk
+    past MAX_PENDING, instead of an O(n) insertion per value."""
+
+    def __init__(
+        self, counts: Dict[str, int], max_limit: int = 50, precomputed_length: int = 2
+    ) -> None:
+        self.max_limit = max_limit
+        self.precomputed_length = precomputed_length
+        self.counts = dict(counts)
+        # (casefolded value, value) tuples, sorted
+        self.entries = sorted((value.casefold(), value) for value in self.counts)
+        # (casefolded value, value) tuples of the values added since, unsorted
+        self.pending: List[Tuple[str, str]] = []
+        # Maps prefixes of up to precomputed_length characters to their top (value, count) items
+        self.top: Dict[str, List[Tuple[str, int]]] = {}
+        candidates: Dict[str, List[Tuple[str, int]]] = {}
+        for key, value in self.entries:
+            for length in range(min(len(key), precomputed_length) + 1):
+                candidates.setdefault(key[:length], []).append((value, self.counts[value]))
+        for prefix, items in candidates.items():
+            self.top[prefix] = heapq.nsmallest(max_limit, items, key=suggestion_key)
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """Returns the limit most frequent (value, count) items starting with prefix, ignoring
+        case."""
+        prefix = prefix.casefold()
+        if len(prefix) <= self.precomputed_length:
+            return self.top.get(prefix, [])[:limit]
+        start = bisect_left(self.entries, (prefix,))
+        end = bisect_left(self.entries, (prefix + MAX_CHARACTER,), start)
+        values = [value for _, value in self.entries[start:end]]
+        values.extend(value for key, value in self.pending if key.startswith(prefix))
+        items = ((value, self.counts[value]) for value in values)
+        return heapq.nsmallest(limit, items, key=suggestion_key)
+
+    def add(self, value: str, count: int = 1) -> None:
+        """Counts count more articles holding value. Counts only grow between builds, so a value
+        only enters the top values of a prefix when its own count grows."""
+        if value not in self.counts:
+            self.counts[value] = 0
+            self.pending.append((value.casefold(), value))
+            if len(self.pending) > MAX_PENDING:
+                self.entries = list(heapq.merge(self.entries, sorted(self.pending)))
+                self.pending = []
+        self.counts[value] += count
+        key = value.casefold()
+        item = (value, self.counts[value])
+        for length in range(min(len(key), self.precomputed_length) + 1):
+            top = [existing for existing in self.top.get(key[:length], []) if existing[0] != value]
+            top.append(item)
+            top.sort(key=suggestion_key)
+            self.top[key[:length]] = top[: self.max_limit]
+        return
+
+
+class SuggestIndex:
+    """In-memory typeahead over tag names and the values of every entity, ranked by the number of
+    articles holding them. Built with grouped queries, kept up to date as tags and entities are
+    inserted through the API with add_tags and add_entities, and rebuilt periodically with build
+    to pick up other changes."""
+
+    def __init__(
+        self, db_utils: DatabaseUtilities, max_limit: int = 50, precomputed_length: int = 2
+    ) -> None:
+        self.db_utils = db_utils
+        self.max_limit = max_limit
+        self.precomputed_length = precomputed_length
+        self.logger = logging.getLogger("SuggestIndexLogs")
+        self.lock = threading.Lock()
+        self.tags = PrefixIndex({}, max_limit, precomputed_length)
+        self.entities: Dict[str, PrefixIndex] = {}
+
+    def build(self) -> None:
+        """Indexes the distinct tags and entity values in the database."""
+        with self.db_utils.session_manager() as session:
+            tag_rows = session.execute(tag_counts_statement()).all()
+            entity_rows = session.execute(entity_counts_statement()).all()
+        entity_counts: Dict[str, Dict[str, int]] = {}
+        for row in entity_rows:
+            entity_counts.setdefault(row.entity, {})[row.value] = row.article_count
+        tags = PrefixIndex(
+            {row.value: row.article_count for row in tag_rows},
+            self.max_limit,
+            self.precomputed_length,
+        )
+        entities = {
+            entity: PrefixIndex(counts, self.max_limit, self.precomputed_length)
+            for entity, counts in entity_counts.items()
+        }
+        with self.lock:
+            self.tags = tags
+            self.entities = entities
+        self.logger.info(
+            f"Suggest index built with {len(tags.counts)} tags and {len(entities)} entities."
+        )
+        return
+
+    def add_tags(self, tags: List[Dict[str, str]]) -> None:
+        """Counts newly inserted tag mappings."""
+        with self.lock:
+            for tag in tags:
+                self.tags.add(tag["tag"])
+        return
+
+    def add_entities(self, entities: List[Dict[str, str]]) -> None:
+        """Counts newly inserted entity mappings."""
+        with self.lock:
+            for entity in entities:
+                index = self.entities.get(entity["entity"])
+                if index is None:
+                    index = PrefixIndex({}, self.max_limit, self.precomputed_length)
+                    self.entities[entity["entity"]] = index
+                index.add(entity["entity_value"])
+        return
+
+    def suggest(self, field: str, entity: Optional[str], prefix: str, limit: int) -> List[Any]:
+        """Returns the limit most frequent values of the field ("tag" or "entity", of the given
+        entity) starting with prefix as {"value", "count"} dicts by descending count.
+        Raises ValueError if limit is larger than max_limit."""
+        if limit > self.max_limit:
+            raise ValueError(f"Invalid limit: {limit}, at most {self.max_limit}")
+        with self.lock:
+            if field == "tag":
+                index = self.tags
+            else:
+                index = self.entities.get(entity)
+            items = index.suggest(prefix, limit) if index is not None else []
+        return [{"value": value, "count": count} for value, count in items]
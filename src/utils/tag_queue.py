@@ -0,0 +1,247 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import uuid
+
+from utils.bulk_tagger import DATABASE_ERROR, bulk_tag, summarize, tag_result
+from utils.database_utilities import DatabaseUtilities
+
+
+class TagWriteQueue:
+    """Write-behind queue for tagging requests. Jobs are appended to a local SQLite journal and
+    acknowledged right away, then a background worker group-commits the tags of all queued jobs
+    in large batches. Jobs left in progress by a crash are picked up again on start up, and tags
+    failing on a transient database error are queued again, retried after an exponential backoff
+    of retry_delay seconds up to max_retry_delay, and reported as failed after max_attempts."""
+
+    def __init__(
+        self,
+        db_utils: DatabaseUtilities,
+        path: str,
+        batch_size: int = 1000,
+        max_group_size: int = 50000,
+        interval: float = 1.0,
+        retention: float = 86400,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 300.0,
+        max_attempts: int = 10,
+        on_commit: Optional[
+            Callable[[List[Dict[str, str]], List[Dict[str, str]]], None]
+        ] = None,
+    ) -> None:
+        self.db_utils = db_utils
+        self.batch_size = batch_size
+        self.max_group_size = max_group_size
+        self.interval = interval
+        self.retention = retention
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.on_commit = on_commit
+        self.logger = logging.getLogger("TagWriteQueueLogs")
+        self.lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.journal = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.journal.execute("PRAGMA journal_mode=WAL")
+            self.journal.execute("PRAGMA synchronous=FULL")
+            self.journal.execute(
+                "CREATE TABLE IF NOT EXISTS tag_jobs ("
+                "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, tags TEXT NOT NULL, "
+                "results TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.journal.execute(
+                "CREATE INDEX IF NOT EXISTS tag_jobs_status_idx ON tag_jobs (status, created_at)"
+            )
+            # Retry columns, added to journals created before them
+            columns = {row[1] for row in self.journal.execute("PRAGMA table_info(tag_jobs)")}
+            if "attempts" not in columns:
+                self.journal.execute(
+                    "ALTER TABLE tag_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+                )
+                self.journal.execute(
+                    "ALTER TABLE tag_jobs ADD COLUMN retry_at REAL NOT NULL DEFAULT 0"
+                )
+            # Recover jobs interrupted mid-commit, inserting their tags again is idempotent
+            self.journal.execute(
+                "UPDATE tag_jobs SET status = 'queued' WHERE status = 'processing'"
+            )
+        self.worker = None
+
+    def start(self) -> None:
+        """Starts the background worker thread."""
+        self.worker = threading.Thread(target=self._run, name="tag_write_queue", daemon=True)
+        self.worker.start()
+        return
+
+    def enqueue(self, tags: List[Dict[str, str]], results: List[Dict[str, str]]) -> str:
+        """Durably appends a tagging job. results holds the items already rejected when parsing
+        the request. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.journal.execute(
+                "INSERT INTO tag_jobs (job_id, status, tags, results, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(tags), json.dumps(results), now, now),
+            )
+        self.wake_up.set()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the status of a job, with its summary and results once it is done, or None if
+        the job does not exist."""
+        with self.lock:
+            row = self.journal.execute(
+                "SELECT status, tags, results, created_at, updated_at, attempts FROM tag_jobs "
+                "WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        status, tags, results, created_at, updated_at, attempts = row
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+        if status == "done":
+            results = json.loads(results)
+            job["summary"] = summarize(results)
+            job["results"] = results
+        else:
+            job["queued_tags"] = len(json.loads(tags))
+            if attempts:
+                job["failed_attempts"] = attempts
+        return job
+
+    def _run(self) -> None:
+        while True:
+            self.wake_up.wait(self.interval)
+            self.wake_up.clear()
+            try:
+                while self._commit_group():
+                    pass
+                self._purge()
+            except:
+                self.logger.error("Tag write queue worker failed!", exc_info=True)
+
+    def _commit_group(self) -> bool:
+        """Commits the tags of the oldest queued jobs, up to max_group_size tags, together.
+        Jobs waiting for a retry are left out until their backoff expires.
+        Returns True if jobs were committed."""
+        with self.lock:
+            rows = self.journal.execute(
+                "SELECT job_id, tags, results, attempts FROM tag_jobs "
+                "WHERE status = 'queued' AND retry_at <= ? ORDER BY created_at",
+                (time.time(),),
+            )
+            jobs = []
+            attempts = {}
+            group_size = 0
+            for job_id, tags, results, job_attempts in rows:
+                tags = json.loads(tags)
+                if jobs and group_size + len(tags) > self.max_group_size:
+                    break
+                jobs.append((job_id, tags, json.loads(results)))
+                attempts[job_id] = job_attempts
+                group_size += len(tags)
+            self._set_status([job_id for job_id, _, _ in jobs], "processing")
+        if not jobs:
+            return False
+
+        # The same tag may be queued by several jobs, only its first job writes it
+        owners = {}
+        group_tags = []
+        for job_id, tags, _ in jobs:
+            for tag in tags:
+                if owners.setdefault((tag["article_id"], tag["tag"]), job_id) == job_id:
+                    group_tags.append(tag)
+        try:
+            tagged = bulk_tag(self.db_utils, group_tags, self.batch_size)
+        except:
+            self.logger.error(f"Group commit of {len(jobs)} tag jobs failed!", exc_info=True)
+            with self.lock:
+                for job_id, tags, results in jobs:
+                    self._retry(job_id, tags, results, attempts[job_id])
+            return False
+        if self.on_commit is not None:
+            # The tags are written, their results are recorded even if the hook fails
+            try:
+                self.on_commit(tagged["written"], tagged["inserted"])
+            except:
+                self.logger.error("Tag write queue commit hook failed!", exc_info=True)
+
+        tag_results = {
+            (result["article_id"], result["tag"]): result for result in tagged["results"]
+        }
+        retried = 0
+        with self.lock:
+            for job_id, tags, results in jobs:
+                failed = []
+                for tag in tags:
+                    pair = (tag["article_id"], tag["tag"])
+                    if owners[pair] != job_id:
+                        results.append(tag_result(tag, "skipped", "Duplicate tag in queue"))
+                    elif tag_results[pair].get("reason") == DATABASE_ERROR:
+                        # Chunks failing on the database are retried, not reported as failed
+                        failed.append(tag)
+                    else:
+                        results.append(tag_results[pair])
+                if failed:
+                    self._retry(job_id, failed, results, attempts[job_id])
+                    retried += len(failed)
+                    continue
+                self.journal.execute(
+                    "UPDATE tag_jobs SET status = 'done', results = ?, updated_at = ? "
+                    "WHERE job_id = ?",
+                    (json.dumps(results), time.time(), job_id),
+                )
+        self.logger.info(f"Group committed {len(group_tags) - retried} tags of {len(jobs)} jobs.")
+        if retried:
+            self.logger.warning(f"{retried} tags failed on a database error, queued for retry.")
+        return True
+
+    def _retry(
+        self, job_id: str, tags: List[Dict[str, str]], results: List[Dict[str, str]], attempts: int
+    ) -> None:
+        """Queues the remaining tags of a job again, with the results of its other tags, after an
+        exponential backoff. Past max_attempts, the job is done with the remaining tags failed."""
+        now = time.time()
+        if attempts + 1 >= self.max_attempts:
+            results = results + [tag_result(tag, "failed", DATABASE_ERROR) for tag in tags]
+            self.journal.execute(
+                "UPDATE tag_jobs SET status = 'done', results = ?, attempts = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                (json.dumps(results), attempts + 1, now, job_id),
+            )
+            self.logger.warning(f"Tag job {job_id} given up after {attempts + 1} attempts.")
+            return
+        delay = min(self.retry_delay * 2 ** attempts, self.max_retry_delay)
+        self.journal.execute(
+            "UPDATE tag_jobs SET status = 'queued', tags = ?, results = ?, attempts = ?, "
+            "retry_at = ?, updated_at = ? WHERE job_id = ?",
+            (json.dumps(tags), json.dumps(results), attempts + 1, now + delay, now, job_id),
+        )
+        return
+
+    def _set_status(self, job_ids: List[str], status: str) -> None:
+        now = time.time()
+        self.journal.executemany(
+            "UPDATE tag_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            [(status, now, job_id) for job_id in job_ids],
+        )
+        return
+
+    def _purge(self) -> None:
+        """Deletes finished jobs older than the retention period."""
+        with self.lock:
+            self.journal.execute(
+                "DELETE FROM tag_jobs WHERE status = 'done' AND updated_at < ?",
+                (time.time() - self.retention,),
+            )
+        return
@@ -0,0 +1,183 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime
+import logging
+import math
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import match
+
+from models.db_models import Article
+from utils.database_utilities import DatabaseUtilities
+
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the to was were will with"
+    .split()
+)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Splits text into lowercase word tokens, dropping stopwords."""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class TextIndex(ABC):
+    """Base class for free text search over article headlines and content. Subclasses set
+    db_utils, implement search, and may override criterion to push the text search down into
+    SQL."""
+
+    @abstractmethod
+    def search(self, text: str) -> List[str]:
+        """Returns the ids of articles matching the searched text."""
+        raise NotImplementedError
+
+    def criterion(self, text: str) -> Any:
+        """Returns a SQL clause on the articles table matching the searched text."""
+        return self.db_utils.id_criterion(Article.article_id, self.search(text))
+
+
+class MySQLFullTextIndex(TextIndex):
+    """Text search backed by the headline_content_ftidx FULLTEXT index of the articles table."""
+
+    def __init__(self, db_utils: DatabaseUtilities) -> None:
+        self.db_utils = db_utils
+
+    def criterion(self, text: str) -> Any:
+        return match(Article.headline, Article.article_content, against=text)
+
+    def search(self, text: str) -> List[str]:
+        with self.db_utils.read_session_manager() as session:
+            articles = session.execute(
+                select(Article.article_id).where(self.criterion(text))
+            ).all()
+        return [article.article_id for article in articles]
+
+
+class InvertedIndex(TextIndex):
+    """In-process inverted index ranking articles with BM25. Built from the articles table and
+    kept up to date by refresh, which only reads articles updated since the last build/refresh,
+    the watermark staying the commit lag of db_utils behind to pick up late commits.
+
+    Articles are stored as dense integer ordinals. Postings map a term to the ordinals of the
+    articles containing it along with the term frequency in that article."""
+
+    def __init__(self, db_utils: DatabaseUtilities, k1: float = 1.2, b: float = 0.75) -> None:
+        self.db_utils = db_utils
+        self.k1 = k1
+        self.b = b
+        self.logger = logging.getLogger("InvertedIndexLogs")
+        self.lock = threading.RLock()
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.ordinals: Dict[str, int] = {}
+        self.article_ids: List[str] = []
+        # Distinct terms and length of every indexed article, by ordinal
+        self.doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.watermark: Optional[datetime] = None
+
+    def add_article(self, article_id: str, headline: Optional[str], content: Optional[str]) -> None:
+        """Indexes an article, replacing its previous postings if it was already indexed."""
+        term_counts = Counter(tokenize(headline) + tokenize(content))
+        with self.lock:
+            ordinal = self.ordinals.get(article_id)
+            if ordinal is None:
+                ordinal = len(self.article_ids)
+                self.ordinals[article_id] = ordinal
+                self.article_ids.append(article_id)
+            else:
+                self._remove_postings(ordinal)
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, {})[ordinal] = count
+            self.doc_terms[ordinal] = tuple(term_counts)
+            self.doc_lengths[ordinal] = sum(term_counts.values())
+            self.total_length += self.doc_lengths[ordinal]
+        return
+
+    def remove_article(self, article_id: str) -> None:
+        """Removes an article from the index. Its ordinal is not reused."""
+        with self.lock:
+            ordinal = self.ordinals.get(article_id)
+            if ordinal is not None and ordinal in self.doc_terms:
+                self._remove_postings(ordinal)
+        return
+
+    def _remove_postings(self, ordinal: int) -> None:
+        for term in self.doc_terms.pop(ordinal, ()):
+            term_postings = self.postings.get(term)
+            if term_postings is not None:
+                term_postings.pop(ordinal, None)
+                if not term_postings:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(ordinal, 0)
+        return
+
+    def build(self, batch_size: int = 1000) -> None:
+        """Indexes every article of the articles table."""
+        self._load(since=None, batch_size=batch_size)
+        self.logger.info(f"Inverted index built with {len(self.doc_terms)} articles.")
+        return
+
+    def refresh(self, batch_size: int = 1000) -> None:
+        """Indexes articles updated since the last build or refresh."""
+        self._load(since=self.watermark, batch_size=batch_size)
+        return
+
+    def _load(self, since: Optional[datetime], batch_size: int) -> None:
+        statement = select(
+            Article.article_id, Article.headline, Article.article_content, Article.updated_at
+        )
+        if since is not None:
+            # Inclusive bound since updated_at has a one second resolution, re-indexing is a no-op
+            statement = statement.where(Article.updated_at >= since)
+        latest = None
+        with self.db_utils.session_manager() as session:
+            result = session.execute(statement, execution_options={"stream_results": True})
+            for partition in result.partitions(batch_size):
+                articles = [article._asdict() for article in partition]
+                # Content moved out of the articles rows is indexed from the content store
+                self.db_utils.fill_contents(articles)
+                for article in articles:
+                    self.add_article(
+                        article["article_id"], article["headline"], article["article_content"]
+                    )
+                    if latest is None or article["updated_at"] > latest:
+                        latest = article["updated_at"]
+            if latest is not None:
+                self.watermark = self.db_utils.lagged_watermark(session, latest)
+        return
+
+    def rank(self, text: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Scores articles containing any of the searched terms with BM25.
+        Returns a list of (article_id, score) tuples by descending score."""
+        terms = set(tokenize(text))
+        scores: Dict[int, float] = {}
+        with self.lock:
+            doc_count = len(self.doc_terms)
+            if not doc_count:
+                return []
+            average_length = self.total_length / doc_count
+            for term in terms:
+                term_postings = self.postings.get(term)
+                if not term_postings:
+                    continue
+                frequency = len(term_postings)
+                idf = math.log(1 + (doc_count - frequency + 0.5) / (frequency + 0.5))
+                for ordinal, count in term_postings.items():
+                    length_norm = 1 - self.b + self.b * self.doc_lengths[ordinal] / average_length
+                    score = idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+                    scores[ordinal] = scores.get(ordinal, 0.0) + score
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            if limit is not None:
+                ranked = ranked[:limit]
+            return [(self.article_ids[ordinal], score) for ordinal, score in ranked]
+
+    def search(self, text: str) -> List[str]:
+        return [article_id for article_id, _ in self.rank(text)]
@@ -0,0 +1,65 @@
+import itertools
+import random
+from typing import List, Sequence
+
+# Shared vocabulary of the synthetic corpus, so the load driver can build searches that hit it
+
+TIMEZONES = [
+    "America/Toronto",
+    "America/Montreal",
+    "America/Vancouver",
+    "America/New_York",
+    "Europe/London",
+    "Europe/Paris",
+    "Asia/Tokyo",
+    "Australia/Sydney",
+]
+# Entity types mapped to the number of distinct values they take
+ENTITY_TYPES = {"city": 500, "topic": 300, "organization": 2000, "person": 5000}
+TAG_COUNT = 200
+WORD_COUNT = 20000
+# Exponent of the Zipf distributions, higher values make popular values more popular
+DEFAULT_SKEW = 1.1
+
+
+def article_id(ordinal: int) -> str:
+    return f"art{ordinal:08d}"
+
+
+def tag(ordinal: int) -> str:
+    return f"tag{ordinal}"
+
+
+def entity_value(entity: str, ordinal: int) -> str:
+    return f"{entity}{ordinal}"
+
+
+def word(ordinal: int) -> str:
+    return f"w{ordinal}"
+
+
+class ZipfSampler:
+    """Draws ordinals in [0, size) following a Zipf distribution: ordinal k is drawn with a
+    probability proportional to 1 / (k + 1)^skew."""
+
+    def __init__(self, size: int, skew: float, rng: random.Random) -> None:
+        self.population = range(size)
+        self.cumulative_weights = list(
+            itertools.accumulate(1 / (rank + 1) ** skew for rank in self.population)
+        )
+        self.rng = rng
+
+    def sample(self, count: int = 1) -> List[int]:
+        return self.rng.choices(self.population, cum_weights=self.cumulative_weights, k=count)
+
+    def sample_unique(self, count: int) -> List[int]:
+        """Draws up to count distinct ordinals."""
+        return list(dict.fromkeys(self.sample(count)))
+
+
+def sentence(words: ZipfSampler, length: int) -> str:
+    return " ".join(word(ordinal) for ordinal in words.sample(length))
+
+
+def choose(rng: random.Random, values: Sequence[str]) -> str:
+    return values[rng.randrange(len(values))]
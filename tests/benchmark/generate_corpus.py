@@ -0,0 +1,100 @@
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+import corpus
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src"))
+from models.db_models import Article, Base, Entity, Tag  # noqa: E402
+
+# GENERATES A SYNTHETIC CORPUS OF ARTICLES, ENTITIES AND TAGS WITH ZIPF DISTRIBUTED TAGS AND
+# ENTITY VALUES, TARGETING MYSQL OR A SQLITE STAND-IN.
+# Ex: python tests/benchmark/generate_corpus.py --url sqlite:///bench.sqlite3 --articles 100000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generates a synthetic article corpus.")
+    parser.add_argument("--url", required=True, help="SQLAlchemy database url")
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--content-words", type=int, default=200)
+    parser.add_argument("--max-tags", type=int, default=4, help="Maximum tags per article")
+    parser.add_argument("--max-entities", type=int, default=8, help="Maximum entities per article")
+    parser.add_argument("--skew", type=float, default=corpus.DEFAULT_SKEW)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    words = corpus.ZipfSampler(corpus.WORD_COUNT, args.skew, rng)
+    tags = corpus.ZipfSampler(corpus.TAG_COUNT, args.skew, rng)
+    entity_samplers = {
+        entity: corpus.ZipfSampler(size, args.skew, rng)
+        for entity, size in corpus.ENTITY_TYPES.items()
+    }
+    entity_types = list(corpus.ENTITY_TYPES)
+
+    engine = create_engine(args.url)
+    Base.metadata.create_all(engine)
+    start_time = datetime(2020, 1, 1)
+    time_span = int(timedelta(days=730).total_seconds())
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    counts = {"articles": 0, "entities": 0, "tags": 0}
+
+    for batch_start in range(0, args.articles, args.batch_size):
+        articles, entities, article_tags = [], [], []
+        for ordinal in range(batch_start, min(batch_start + args.batch_size, args.articles)):
+            article_id = corpus.article_id(ordinal)
+            articles.append(
+                {
+                    "article_id": article_id,
+                    "headline": corpus.sentence(words, 8),
+                    "published_time": start_time + timedelta(seconds=rng.randrange(time_span)),
+                    "publisher_timezone": corpus.choose(rng, corpus.TIMEZONES),
+                    "article_content": corpus.sentence(words, args.content_words),
+                    "updated_at": now,
+                    "updated_by": "benchmark",
+                }
+            )
+            for _ in range(rng.randint(1, args.max_entities)):
+                entity = corpus.choose(rng, entity_types)
+                value_ordinal = entity_samplers[entity].sample()[0]
+                entities.append(
+                    {
+                        "article_id": article_id,
+                        "entity": entity,
+                        "entity_value": corpus.entity_value(entity, value_ordinal),
+                        "updated_at": now,
+                        "updated_by": "benchmark",
+                    }
+                )
+            for tag_ordinal in tags.sample_unique(rng.randint(0, args.max_tags)):
+                article_tags.append(
+                    {
+                        "article_id": article_id,
+                        "tag": corpus.tag(tag_ordinal),
+                        "tagged_at": now,
+                        "tagged_by": "benchmark",
+                    }
+                )
+        with engine.begin() as connection:
+            connection.execute(Article.__table__.insert(), articles)
+            connection.execute(Entity.__table__.insert(), entities)
+            if article_tags:
+                connection.execute(Tag.__table__.insert(), article_tags)
+        counts["articles"] += len(articles)
+        counts["entities"] += len(entities)
+        counts["tags"] += len(article_tags)
+        print(f"{counts} rows written in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
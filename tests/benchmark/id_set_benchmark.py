@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy import select
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+# COMPARES THE STRATEGIES OF THE QUERIES BY ARTICLE IDS ON LARGE ID SETS (PLAIN IN LISTS, A SINGLE
+# JSON ARRAY PARAMETER AND CONCURRENT CHUNKS) AND REPORTS THE MEAN TIME OF HYDRATING ARTICLES,
+# ENTITIES AND TAGS AND THE STATEMENT SIZE AS JSON. Runs on a corpus generated by generate_corpus.py
+# holding at least as many articles as the largest id set:
+#   python tests/benchmark/id_set_benchmark.py --url sqlite:///bench.sqlite3
+
+INFINITE = 10 ** 9
+
+# (max_id_list, id_chunk_size) of every strategy, None keeping the configured value
+STRATEGIES = {
+    "in_list": (INFINITE, INFINITE),
+    "json_array": (0, INFINITE),
+    "chunked": (None, None),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks queries by large article id sets.")
+    parser.add_argument("--url", required=True, help="SQLAlchemy url of a generated corpus")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Writes the report to this file instead of stdout")
+    return parser.parse_args()
+
+
+def hydrate(db_utils: Any, article_ids: List[str]) -> None:
+    db_utils.query_article_by_article_id(article_ids, True, ["headline", "published_time"])
+    db_utils.query_entities_by_article_id(article_ids)
+    db_utils.query_tag_by_article_id(article_ids)
+    return
+
+
+def statement_chars(db_utils: Any, article_ids: List[str]) -> int:
+    """Returns the length of the SQL sent for a query by a single chunk of article ids."""
+    from models.db_models import Article
+
+    chunk = article_ids[: db_utils.id_chunk_size]
+    statement = select(Article.article_id).where(
+        db_utils.id_criterion(Article.article_id, chunk)
+    )
+    compiled = statement.compile(
+        dialect=db_utils.engine.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    return len(str(compiled))
+
+
+def main() -> None:
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.url
+    from models.db_models import Article
+    from utils.database_utilities import DatabaseUtilities
+
+    db_utils = DatabaseUtilities(host="benchmark", database="benchmark")
+    defaults = (db_utils.max_id_list, db_utils.id_chunk_size)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with db_utils.session_manager() as session:
+        all_ids = session.execute(select(Article.article_id).limit(max(sizes))).scalars().all()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for size in sizes:
+        article_ids = all_ids[:size]
+        results[str(size)] = {"ids": len(article_ids)}
+        for strategy, (max_id_list, id_chunk_size) in STRATEGIES.items():
+            db_utils.max_id_list = defaults[0] if max_id_list is None else max_id_list
+            db_utils.id_chunk_size = defaults[1] if id_chunk_size is None else id_chunk_size
+            result: Dict[str, Any] = {"statement_chars": statement_chars(db_utils, article_ids)}
+            timings = []
+            try:
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    hydrate(db_utils, article_ids)
+                    timings.append(time.perf_counter() - start)
+                result["mean_ms"] = 1000 * sum(timings) / len(timings)
+            except Exception as error:
+                # i.e. too many SQL variables or a statement larger than max_allowed_packet
+                result["error"] = str(error).splitlines()[0]
+            results[str(size)][strategy] = result
+
+    report = {
+        "config": vars(args),
+        "dialect": db_utils.engine.dialect.name,
+        "id_chunk_size": defaults[1],
+        "id_chunk_concurrency": db_utils.id_chunk_concurrency,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import corpus
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+
+# REPLAYS A MIXED WORKLOAD AGAINST THE API AND REPORTS THROUGHPUT, LATENCY PERCENTILES AND DATABASE
+# ROUND TRIPS PER REQUEST AS JSON.
+# Against the Flask test client on a generated corpus:
+#   python tests/benchmark/load_driver.py --url sqlite:///bench.sqlite3 --articles 100000
+# Against a running server (database round trips are then not reported):
+#   python tests/benchmark/load_driver.py --server http://127.0.0.1:5000 --articles 100000
+
+WORKLOADS = ("get_all", "filter_search", "text_search", "bulk_tag")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replays a mixed workload against the API.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="SQLAlchemy url of the database behind the test client")
+    target.add_argument("--server", help="Base url of a running server")
+    parser.add_argument("--articles", type=int, required=True, help="Size of generated corpus")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--mix",
+        default="get_all=1,filter_search=4,text_search=2,bulk_tag=1",
+        help="Relative weights of the workloads",
+    )
+    parser.add_argument("--skew", type=float, default=corpus.DEFAULT_SKEW)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Writes the report to this file instead of stdout")
+    return parser.parse_args()
+
+
+class RequestBuilder:
+    """Builds requests hitting the vocabulary of the generated corpus."""
+
+    def __init__(self, articles: int, skew: float, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.articles = articles
+        self.tags = corpus.ZipfSampler(corpus.TAG_COUNT, skew, self.rng)
+        self.words = corpus.ZipfSampler(corpus.WORD_COUNT, skew, self.rng)
+        self.cities = corpus.ZipfSampler(corpus.ENTITY_TYPES["city"], skew, self.rng)
+        self.topics = corpus.ZipfSampler(corpus.ENTITY_TYPES["topic"], skew, self.rng)
+        self.lock = threading.Lock()
+
+    def build(self, workload: str) -> Tuple[str, str, Any]:
+        """Returns the method, path and JSON body of a request of the given workload."""
+        with self.lock:
+            if workload == "get_all":
+                return "GET", "/api/get_all_articles?limit=100", None
+            if workload == "filter_search":
+                body = {
+                    "tag": [corpus.tag(ordinal) for ordinal in self.tags.sample_unique(2)],
+                    "entity": {"city": [corpus.entity_value("city", self.cities.sample()[0])]},
+                }
+                if self.rng.random() < 0.5:
+                    topic = corpus.entity_value("topic", self.topics.sample()[0])
+                    body["entity"]["topic"] = [topic]
+                return "GET", "/api/search_articles", body
+            if workload == "text_search":
+                body = {"text": corpus.sentence(self.words, 2)}
+                return "GET", "/api/search_articles", body
+            body = [
+                {
+                    "article_id": corpus.article_id(self.rng.randrange(self.articles)),
+                    "tags": [corpus.tag(ordinal) for ordinal in self.tags.sample_unique(2)],
+                }
+                for _ in range(50)
+            ]
+            return "POST", "/api/tag_article/bulk", body
+
+
+def client_sender(url: str) -> Tuple[Callable[..., int], Callable[[], Optional[int]]]:
+    """Imports the Flask application on the given database. Returns a function sending a request
+    through the test client and a function returning the database round trips of the last request
+    sent by the calling thread."""
+    os.environ["DATABASE_URL"] = url
+    if url.startswith("sqlite"):
+        # MATCH ... AGAINST is MySQL only
+        os.environ.setdefault("TEXT_INDEX", "memory")
+    sys.path.insert(0, SRC_DIR)
+    import article_tagger
+    from sqlalchemy import event
+
+    counters = threading.local()
+
+    @event.listens_for(article_tagger.db_utils.engine, "before_cursor_execute")
+    def count_round_trip(*args: Any) -> None:
+        counters.round_trips = getattr(counters, "round_trips", 0) + 1
+
+    client = article_tagger.app.test_client()
+
+    def send(method: str, path: str, body: Any) -> int:
+        counters.round_trips = 0
+        return client.open(path, method=method, json=body).status_code
+
+    return send, lambda: counters.round_trips
+
+
+def server_sender(server: str) -> Tuple[Callable[..., int], Callable[[], Optional[int]]]:
+    """Returns a function sending a request to a running server, and a function returning None
+    since database round trips cannot be observed from the outside."""
+    import requests
+
+    session = requests.Session()
+
+    def send(method: str, path: str, body: Any) -> int:
+        return session.request(method, server.rstrip("/") + path, json=body).status_code
+
+    return send, lambda: None
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=SRC_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    args = parse_args()
+    weights = dict(item.split("=") for item in args.mix.split(","))
+    unknown = set(weights) - set(WORKLOADS)
+    if unknown:
+        raise SystemExit(f"Unknown workloads: {sorted(unknown)}")
+    rng = random.Random(args.seed)
+    plan = rng.choices(list(weights), weights=[float(w) for w in weights.values()], k=args.requests)
+    builder = RequestBuilder(args.articles, args.skew, args.seed)
+    send, round_trips = client_sender(args.url) if args.url else server_sender(args.server)
+
+    samples: Dict[str, List[Tuple[float, bool, Optional[int]]]] = {w: [] for w in weights}
+
+    def run(workload: str) -> None:
+        method, path, body = builder.build(workload)
+        start = time.perf_counter()
+        try:
+            ok = send(method, path, body) < 400
+        except Exception:
+            ok = False
+        latency = (time.perf_counter() - start) * 1000
+        samples[workload].append((latency, ok, round_trips()))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run, plan))
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "git_commit": git_commit(),
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "throughput_rps": args.requests / elapsed,
+        "workloads": {},
+    }
+    for workload, workload_samples in samples.items():
+        latencies = sorted(latency for latency, _, _ in workload_samples)
+        trips = [trips for _, _, trips in workload_samples if trips is not None]
+        report["workloads"][workload] = {
+            "requests": len(workload_samples),
+            "errors": sum(1 for _, ok, _ in workload_samples if not ok),
+            "throughput_rps": len(workload_samples) / elapsed,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "db_round_trips_mean": sum(trips) / len(trips) if trips else None,
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from flask import Flask, Response
+
+from utils import serialization
+from utils.search_engine import SearchEngine
+
+# COMPARES THE FLASK JSON RESPONSE PATH TO THE FAST SERIALIZATION PATH ON SYNTHETIC RESULT ROWS AND
+# REPORTS THE MEAN TIME AND SIZE OF EVERY RESPONSE AS JSON. No database is needed, rows are named
+# tuples shaped like the SQLAlchemy rows of search and get_all_articles queries.
+#   python tests/benchmark/serialization_benchmark.py --articles 10000 --repeat 5
+
+ArticleRow = namedtuple(
+    "ArticleRow", ["article_id", "headline", "published_time", "publisher_timezone"]
+)
+ListRow = namedtuple("ListRow", ["article_id", "headline", "published_time"])
+HydrationRow = namedtuple("HydrationRow", ["article_id", "kind", "name", "value"])
+
+FIELDS = ["headline", "published_time", "publisher_timezone", "entity", "tags"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks JSON response serialization.")
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Writes the report to this file instead of stdout")
+    return parser.parse_args()
+
+
+def generate_rows(articles: int, seed: int) -> Dict[str, List[Any]]:
+    """Generates article rows with 3 entities and 2 tags each, and the matching list rows."""
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 1)
+    article_rows, list_rows, hydration_rows = [], [], []
+    for index in range(articles):
+        article_id = f"article{index:08d}"
+        headline = " ".join(f"word{rng.randrange(5000)}" for _ in range(8))
+        published_time = start + timedelta(seconds=rng.randrange(10 ** 7))
+        article_rows.append(ArticleRow(article_id, headline, published_time, "America/Toronto"))
+        list_rows.append(ListRow(article_id, headline, published_time))
+        for entity in ("city", "topic", "person"):
+            value = f"{entity}{rng.randrange(1000)}"
+            hydration_rows.append(HydrationRow(article_id, "entity", entity, value))
+        for tag in rng.sample(range(200), 2):
+            hydration_rows.append(HydrationRow(article_id, "tag", f"tag{tag}", None))
+    return {"articles": article_rows, "list": list_rows, "hydration": hydration_rows}
+
+
+def measure(path: Callable[[], Response], repeat: int) -> Dict[str, float]:
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(path().get_data())
+        timings.append(time.perf_counter() - start)
+    return {"mean_ms": 1000 * sum(timings) / repeat, "min_ms": 1000 * min(timings), "bytes": size}
+
+
+def main() -> None:
+    args = parse_args()
+    rows = generate_rows(args.articles, args.seed)
+    app = Flask(__name__)
+
+    def flask_response(content: Any) -> Response:
+        return app.make_response(({"content": content, "message": "Benchmark"}, 200))
+
+    def fast_response(content: Any) -> Response:
+        response = {"content": content, "message": "Benchmark"}
+        return Response(serialization.dumps(response), status=200, mimetype="application/json")
+
+    def search_articles_dict() -> Dict[str, Dict[str, Any]]:
+        return SearchEngine.assemble(rows["articles"], rows["hydration"])
+
+    paths = {
+        "search_flask": lambda: flask_response(search_articles_dict()),
+        "search_fast": lambda: fast_response(search_articles_dict()),
+        "search_fast_columnar": lambda: fast_response(
+            serialization.columnar_articles(search_articles_dict(), FIELDS)
+        ),
+        "get_all_flask": lambda: flask_response([row._asdict() for row in rows["list"]]),
+        "get_all_fast": lambda: fast_response(serialization.records(ListRow._fields, rows["list"])),
+        "get_all_fast_columnar": lambda: fast_response(
+            serialization.columns(ListRow._fields, rows["list"])
+        ),
+    }
+    with app.app_context():
+        results = {name: measure(path, args.repeat) for name, path in paths.items()}
+
+    report = {
+        "config": vars(args),
+        "orjson": serialization.orjson is not None,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import requests
+import json
+from pprint import pprint as pp
+
+# SAMPLE POST REQUEST TO TAG ARTICLES IN BULK
+
+url = "http://127.0.0.1:5000/api/tag_article/bulk?batch_size=500&on_duplicate=ignore"
+
+payload = json.dumps([
+  {
+    "article_id": "abc123",
+    "tags": [
+      "news",
+      "global",
+      "news"
+    ]
+  },
+  {
+    "article_id": "abc456",
+    "tags": [
+      "travel"
+    ]
+  },
+  {
+    "article_id": "does_not_exist",
+    "tags": [
+      "travel"
+    ]
+  }
+])
+headers = {
+  'Content-Type': 'application/json'
+}
+
+response = requests.request("POST", url, headers=headers, data=payload)
+
+pp(response.text)
+pp(response.status_code)
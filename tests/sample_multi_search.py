@@ -0,0 +1,33 @@
+import requests
+import json
+from pprint import pprint as pp
+
+# SAMPLE GET REQUEST TO RUN A BATCH OF SEARCHES SHARING THEIR ENTITY CRITERIA
+
+url = "http://127.0.0.1:5000/api/multi_search"
+
+payload = json.dumps([
+  {
+    "tag": ["travel"],
+    "entity": {
+      "city": ["montreal"]
+    },
+    "fields": ["headline", "published_time", "tags"]
+  },
+  {
+    "tag": ["news"],
+    "entity": {
+      "city": ["montreal"]
+    },
+    "order_by_time": "asc",
+    "limit": 10
+  }
+])
+headers = {
+  'Content-Type': 'application/json'
+}
+
+response = requests.request("GET", url, headers=headers, data=payload)
+
+pp(response.text)
+pp(response.status_code)
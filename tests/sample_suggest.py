@@ -0,0 +1,15 @@
+import requests
+from pprint import pprint as pp
+
+# SAMPLE GET REQUEST TO AUTOCOMPLETE CITY ENTITY VALUES STARTING WITH "mon"
+# NEEDS THE APPLICATION STARTED WITH SUGGEST_INDEX=true
+
+url = "http://127.0.0.1:5000/api/suggest?field=entity:city&prefix=mon&limit=5"
+
+payload={}
+headers = {}
+
+response = requests.request("GET", url, headers=headers, data=payload)
+
+pp(response.text)
+pp(response.status_code)